@@ -0,0 +1,694 @@
+from src.evaluate.compare import compare_workflows
+from src.pipeline.workflows import get_workflow_runner
+from src.evaluate.compare import format_report
+from src.evaluate.compare import workflow_accuracy
+from src.evaluate.all import iterate_and_compare
+from src.evaluate.regression import save_baseline
+from src.evaluate.regression import gate
+from src.pipeline.validation.schedule import SCHEDULE_ORDERS
+from src.pipeline.validation.batch import EXIT_BACKEND_UNAVAILABLE
+from src.pipeline.validation.parking import parked_documents
+from src.pipeline.validation.batch import workflow_concurrency
+from src.pipeline.validation.tuning import format_tuning_report
+from src.pipeline.validation.tuning import sample_documents
+from src.pipeline.validation.tuning import stale_workflows
+from src.pipeline.validation.tuning import TUNING_BACKENDS
+from src.pipeline.validation.tuning import write_profile
+from src.pipeline.validation.tuning import recommend
+from src.pipeline.validation.tuning import sweep
+from src.pipeline.validation.batch import run_batch
+from src.pipeline.workflows import WORKFLOWS
+from src.utils.cascade import escalation_rates
+from src.utils.metric_index import query_metrics
+from src.utils.metric_index import update_index
+from src.utils.profiler import set_sample_fraction
+from src.utils.preflight import format_budget_report
+from src.utils.slim import format_slim_report
+from src.utils.page_index import summarize_statuses
+from src.utils.page_index import verify_rows
+from src.utils.slim import slim_documents
+from src.utils.archive import ARCHIVE_SUFFIX
+from src.utils.archive import archived_paths
+from src.utils.archive import open_archive
+from src.utils.archive import archive_key
+from src.utils.archive import PACKED_DIRS
+from src.utils.archive import compact
+from src.utils.archive import unpack
+from src.utils.archive import pack
+from src.utils.preflight import plan_corpus
+from src.utils.profiler import summarize_profiles
+from src.utils.llm import set_cache_mode
+from src.utils.llm import endpoint_stats
+from src.utils.llm import FAILOVER_ERRORS
+from src.utils.llm import endpoint_pool
+from src.utils.llm import rate_limiter
+from src.utils.llm import CACHE_MODES
+from src.utils.breaker import CircuitOpenError
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import load_jsonl
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import List
+from typing import Dict
+from typing import Any
+import argparse
+import asyncio
+import shutil
+import glob
+import json
+import zlib
+import sys
+import os
+
+
+DOCS_DIR = os.path.join(config.DATA_DIR, 'docs')
+VALIDATION_DIR = os.path.join(config.DATA_DIR, 'validation')
+
+
+def read_ids(stream: Iterable[str]) -> Iterator[str]:
+    """
+    Yield document IDs from a stream with one ID (or PDF file name) per line.
+
+    Args:
+        stream (Iterable[str]): The lines to read.
+
+    Yields:
+        str: The document IDs, without a .pdf extension.
+    """
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield os.path.splitext(os.path.basename(line))[0] if line.endswith('.pdf') else line
+
+
+def in_shard(file_name: str, shard: Optional[str]) -> bool:
+    """
+    Check whether a document belongs to a shard.
+
+    Documents are assigned by a stable hash of their ID, so shards do not overlap and can
+    be computed on streamed input.
+
+    Args:
+        file_name (str): The document ID.
+        shard (Optional[str]): The shard as 'index/count' (0-based), or None for all documents.
+
+    Returns:
+        bool: True if the document belongs to the shard.
+    """
+    if not shard:
+        return True
+    index, count = (int(part) for part in shard.split('/'))
+    return zlib.crc32(file_name.encode('utf-8')) % count == index
+
+
+def shard_spec(value: str) -> str:
+    """
+    Validate a shard given on the command line.
+
+    Args:
+        value (str): The shard as 'index/count'.
+
+    Returns:
+        str: The shard.
+
+    Raises:
+        argparse.ArgumentTypeError: If the shard is malformed or its index is not below its count.
+    """
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value!r}: expected 'index/count', e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value!r}: the index must be between 0 and count - 1")
+    return value
+
+
+def select_documents(args: argparse.Namespace) -> Iterable[str]:
+    """
+    Build the document list of a batch run from a glob, an ID file, stdin or the parked store.
+
+    Args:
+        args (argparse.Namespace): The parsed batch arguments.
+
+    Returns:
+        Iterable[str]: A list of IDs for globs and ID files, or a lazy stream for stdin.
+    """
+    if args.parked:
+        return [file_name for file_name in parked_documents(args.workflow) if in_shard(file_name, args.shard)]
+    if args.ids_file == '-':
+        return (file_name for file_name in read_ids(sys.stdin) if in_shard(file_name, args.shard))
+    if args.ids_file:
+        with open(args.ids_file, 'r', encoding='utf-8') as file:
+            file_names = list(read_ids(file))
+    else:
+        # Documents only present in the configured archive are read from it
+        paths = set(glob.glob(args.docs)) | set(archived_paths(args.docs))
+        file_names = sorted({os.path.splitext(os.path.basename(path))[0] for path in paths if path.endswith('.pdf')})
+    return [file_name for file_name in file_names if in_shard(file_name, args.shard)]
+
+
+def create_sink(workflow: str, sink: Optional[str]) -> Optional[Callable[[str, Any], None]]:
+    """
+    Create the callback that emits each finished document's rows.
+
+    Args:
+        workflow (str): The workflow name.
+        sink (Optional[str]): 'stdout' to print JSONL rows tagged with the document ID, an
+            archive (`.esga`) to add each document's JSONL and step outputs to, a directory to
+            copy each document's JSONL into, or None to keep the default location only.
+
+    Returns:
+        Optional[Callable[[str, Any], None]]: The callback for `run_batch`.
+    """
+    if not sink:
+        return None
+
+    def emit(file_name: str, _: Any) -> None:
+        jsonl_path = os.path.join(VALIDATION_DIR, f'generated/{workflow}/{file_name}.jsonl')
+        if sink == 'stdout':
+            for row in load_jsonl(jsonl_path):
+                print(json.dumps({'file_name': file_name, **row}), flush=True)
+        elif sink.endswith(ARCHIVE_SUFFIX):
+            archive = open_archive(sink, writable=True)
+            output_dir = os.path.join(config.DATA_DIR, f'output/{workflow}/{file_name}')
+            paths = [jsonl_path] + sorted(glob.glob(os.path.join(output_dir, '*')))
+            for path in paths:
+                with open(path, 'rb') as file:
+                    archive.write(archive_key(path), file.read())
+        else:
+            os.makedirs(sink, exist_ok=True)
+            shutil.copyfile(jsonl_path, os.path.join(sink, f'{file_name}.jsonl'))
+
+    return emit
+
+
+def apply_runtime_options(args: argparse.Namespace) -> None:
+    """
+    Apply the rate limit, cache mode and profiling options.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+    """
+    if args.rate_limit is not None:
+        rate_limiter.set_rate(args.rate_limit)
+    if args.cache_mode:
+        set_cache_mode(args.cache_mode)
+    if args.profile is not None:
+        set_sample_fraction(args.profile)
+
+
+def cmd_extract(args: argparse.Namespace) -> int:
+    """
+    Extract documents one after the other.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0 on success, 1 if a document failed, or EXIT_BACKEND_UNAVAILABLE if all failures were backend outages.
+    """
+    apply_runtime_options(args)
+    run = get_workflow_runner(args.workflow)
+    failed = unavailable = 0
+    for file_name in read_ids(args.file_names):
+        try:
+            run(file_name)
+        except Exception as e:
+            failed += 1
+            if isinstance(e, (CircuitOpenError,) + FAILOVER_ERRORS):
+                unavailable += 1
+            logger.error(f"Error processing file {file_name}: {e}")
+    # A distinct exit code lets batch runs park documents that failed on a backend outage
+    if failed and failed == unavailable:
+        return EXIT_BACKEND_UNAVAILABLE
+    return 1 if failed else 0
+
+
+def cmd_batch(args: argparse.Namespace) -> int:
+    """
+    Extract the selected documents concurrently and emit their rows to the sink.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0 if every document was extracted, 1 if one failed, or EXIT_BACKEND_UNAVAILABLE if all unprocessed documents were parked.
+    """
+    apply_runtime_options(args)
+    file_names = select_documents(args)
+    if isinstance(file_names, list):
+        logger.info(f"Selected {len(file_names)} documents for {args.workflow}")
+        if args.preflight:
+            # The budget goes to stderr so that a stdout sink keeps only JSONL rows
+            plans = plan_corpus(args.workflow, file_names)
+            print(format_budget_report(plans, rate_limiter.rate * 60 if rate_limiter.rate else None), end='', file=sys.stderr)
+    deadlines = None
+    if args.deadlines:
+        with open(args.deadlines, 'r', encoding='utf-8') as file:
+            deadlines = json.load(file)
+    failures: Dict[str, str] = {}
+    asyncio.run(run_batch(
+        args.workflow,
+        file_names,
+        args.concurrency or workflow_concurrency(args.workflow),
+        resume=args.resume,
+        directory=DOCS_DIR,
+        on_result=create_sink(args.workflow, args.sink),
+        progress_interval=args.progress_interval or None,
+        order=args.schedule,
+        deadlines=deadlines,
+        on_failure=failures.__setitem__
+    ))
+    if args.sink and args.sink.endswith(ARCHIVE_SUFFIX):
+        open_archive(args.sink, writable=True).write_index()
+    if failures:
+        logger.error(f"{len(failures)} documents were not extracted: {sorted(failures)}")
+        # Parked documents are left for a later `batch --parked` run
+        return EXIT_BACKEND_UNAVAILABLE if set(failures.values()) == {'parked'} else 1
+    return 0
+
+
+def cmd_evaluate(args: argparse.Namespace) -> int:
+    """
+    Compare the workflows' generated rows with the expected rows and write their coverage.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    for workflow in args.workflows:
+        iterate_and_compare(
+            os.path.join(VALIDATION_DIR, f'generated/{workflow}'),
+            os.path.join(VALIDATION_DIR, 'expected'),
+            workflow
+        )
+        print(f"Coverage for {workflow} written to {os.path.join(config.DATA_DIR, f'evaluation/{workflow}/coverage.txt')}")
+    return 0
+
+
+def cmd_benchmark(args: argparse.Namespace) -> int:
+    """
+    Print the workflow comparison and the cascade escalation rates.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    print(format_report(compare_workflows(args.workflows)), end='')
+    rates = escalation_rates()
+    if rates:
+        print('\nModel cascade escalations per step:')
+        for step, rate in rates.items():
+            print(f"  {step}: {rate['escalated']}/{rate['calls']} ({rate['rate'] * 100:.1f}%)")
+    return 0
+
+
+def cmd_baseline(args: argparse.Namespace) -> int:
+    """
+    Store the workflows' current extractions as regression baselines.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    for workflow in args.workflows:
+        print(f"Baseline for {workflow} saved to {save_baseline(workflow)}")
+    return 0
+
+
+def cmd_gate(args: argparse.Namespace) -> int:
+    """
+    Check the workflows for regressions against their baselines.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0 when no workflow regressed, 1 on a regression, 2 when a baseline is missing.
+    """
+    return max(gate(workflow, args.against, args.alpha, args.min_coverage_drop, args.max_latency_increase) for workflow in args.workflows)
+
+
+def cmd_profile(args: argparse.Namespace) -> int:
+    """
+    Print the aggregated profiles of sampled document runs.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    print(summarize_profiles(args.workflow, args.limit), end='')
+    return 0
+
+
+def cmd_index(args: argparse.Namespace) -> int:
+    """
+    Update the metric index from the generated and expected rows.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    stats = update_index()
+    print(f"Indexed {stats['updated']} files ({stats['rows']} rows), removed {stats['removed']}, unchanged {stats['unchanged']}")
+    return 0
+
+
+def cmd_query(args: argparse.Namespace) -> int:
+    """
+    Print the indexed metric rows matching the filters as JSON lines.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    if not args.no_update:
+        update_index()
+    rows = query_metrics(args.code, args.year, args.unit, args.sector, args.company, args.country, args.kind, args.workflow, args.document, args.limit)
+    for row in rows:
+        print(json.dumps(row))
+    return 0
+
+
+def cmd_verify(args: argparse.Namespace) -> int:
+    """
+    Verify a workflow's generated rows against the PDF text layer and print the statuses.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    generated_dir = os.path.join(config.DATA_DIR, f'validation/generated/{args.workflow}')
+    totals = summarize_statuses([])
+    for path in sorted(glob.glob(os.path.join(generated_dir, '*.jsonl'))):
+        file_name = os.path.basename(path)[:-len('.jsonl')]
+        pdf_path = os.path.join(DOCS_DIR, f'{file_name}.pdf')
+        if not os.path.exists(pdf_path):
+            continue
+        summary = summarize_statuses(verify_rows(pdf_path, load_jsonl(path), correct_pages=False))
+        totals = {status: totals[status] + count for status, count in summary.items()}
+        print(f"{file_name}: " + ', '.join(f"{status} {count}" for status, count in summary.items()))
+    print('total: ' + ', '.join(f"{status} {count}" for status, count in totals.items()))
+    return 0
+
+
+def cmd_slim(args: argparse.Namespace) -> int:
+    """
+    Slim the PDFs and print the size and accuracy report.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    reports = slim_documents(args.docs)
+    print(format_slim_report(reports, workflow_accuracy(args.workflow) if args.workflow else None), end='')
+    return 0
+
+
+def cmd_preflight(args: argparse.Namespace) -> int:
+    """
+    Plan the documents and print the token and call budget.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    file_names = sorted(os.path.splitext(os.path.basename(path))[0] for path in glob.glob(args.docs) if path.endswith('.pdf'))
+    plans = plan_corpus(args.workflow, file_names, 'local' if args.offline else None)
+    print(format_budget_report(plans, args.rate_limit if args.rate_limit is not None else config.RATE_LIMIT_CALLS_PER_MINUTE), end='')
+    return 0
+
+
+def cmd_pack(args: argparse.Namespace) -> int:
+    """
+    Pack the data directories into an archive, or compact an archive.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    if args.compact:
+        stats = compact(args.archive)
+        print(f"Compacted {args.archive}: {stats['members']} members, {stats['bytes_before']} -> {stats['bytes_after']} bytes")
+        return 0
+    stats = pack(args.archive, tuple(args.include))
+    print(f"Packed {stats['added']} files ({stats['raw_bytes']} -> {stats['stored_bytes']} bytes), {stats['unchanged']} unchanged")
+    return 0
+
+
+def cmd_unpack(args: argparse.Namespace) -> int:
+    """
+    List an archive's members or unpack them.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    if args.list:
+        archive = open_archive(args.archive)
+        for key in archive.keys(args.pattern):
+            entry = archive.entry(key)
+            print(f"{key}\t{entry['raw_bytes']}\t{entry['stored_bytes']}")
+        return 0
+    print(f"Unpacked {unpack(args.archive, args.target, args.pattern)} files")
+    return 0
+
+
+def cmd_tune(args: argparse.Namespace) -> int:
+    """
+    Tune the workflows' concurrency, chunk size and hedging, or check whether their tuning is stale.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0 on success, 1 if a workflow could not be tuned or, with --check, is stale.
+    """
+    if args.check:
+        stale = stale_workflows(args.profile, args.workflows)
+        for workflow in args.workflows:
+            print(f"{workflow}: {'stale' if workflow in stale else 'up to date'} in profile {args.profile}")
+        return 1 if stale else 0
+    for workflow in args.workflows:
+        candidates = sorted(os.path.splitext(os.path.basename(path))[0] for path in glob.glob(args.docs) if path.endswith('.pdf'))
+        file_names = sample_documents(DOCS_DIR, candidates, args.sample)
+        logger.info(f"Tuning {workflow} on {len(file_names)} documents: {file_names}")
+        trials = sweep(
+            workflow,
+            file_names,
+            DOCS_DIR,
+            args.concurrency,
+            [chunk_size or None for chunk_size in args.chunk_sizes],
+            {'on': [True], 'off': [False], 'both': [False, True]}[args.hedging],
+            args.backend,
+            args.latency,
+            args.time_scale
+        )
+        try:
+            recommendation = recommend(trials, args.max_latency)
+        except ValueError as e:
+            logger.error(f"Could not tune {workflow}: {e}")
+            return 1
+        print(f"{workflow}:\n{format_tuning_report(trials, recommendation)}", end='')
+        if not args.dry_run:
+            path = write_profile(args.profile, workflow, recommendation, trials, file_names, args.backend)
+            print(f"Recommended settings written to {path}")
+    return 0
+
+
+def cmd_endpoints(args: argparse.Namespace) -> int:
+    """
+    Print the health and call statistics of the model endpoints.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        int: 0.
+    """
+    if args.check:
+        for status in endpoint_pool.check_health():
+            latency = f"{status['latency']:.3f} s" if status['latency'] is not None else '-'
+            print(f"{status['endpoint']}: {'up' if status['available'] else 'down'} ({latency})")
+    for stats in endpoint_stats():
+        p50 = f"{stats['latency_p50']:.2f}" if stats['latency_p50'] is not None else '-'
+        p95 = f"{stats['latency_p95']:.2f}" if stats['latency_p95'] is not None else '-'
+        print(f"{stats['endpoint']}: {stats['calls']} calls, {stats['error_rate'] * 100:.1f}% errors, p50 {p50} s, p95 {p95} s")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build the command-line parser.
+
+    Returns:
+        argparse.ArgumentParser: The parser with the extract, batch, evaluate and benchmark commands.
+    """
+    parser = argparse.ArgumentParser(prog='esg-extract', description='ESG data extraction pipeline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    runtime = argparse.ArgumentParser(add_help=False)
+    runtime.add_argument('--workflow', choices=WORKFLOWS, default='multi_step', help='Extraction workflow.')
+    runtime.add_argument('--rate-limit', type=float, help='Maximum model calls per minute (0 disables the limit).')
+    runtime.add_argument('--cache-mode', choices=CACHE_MODES, help='Response cache mode.')
+    runtime.add_argument('--profile', type=float, metavar='FRACTION', help='Profile this fraction of document runs (0-1).')
+
+    extract = commands.add_parser('extract', parents=[runtime], help='Extract one or more documents sequentially.')
+    extract.add_argument('file_names', nargs='+', help='Document IDs (or PDF file names) in the docs directory.')
+    extract.set_defaults(handler=cmd_extract)
+
+    batch = commands.add_parser('batch', parents=[runtime], help='Extract many documents concurrently.')
+    source = batch.add_mutually_exclusive_group()
+    source.add_argument('--docs', default=os.path.join(DOCS_DIR, '*.pdf'), help='Glob of PDFs in the docs directory.')
+    source.add_argument('--ids-file', help="File with one document ID per line, or '-' to stream IDs from stdin.")
+    source.add_argument('--parked', action='store_true', help='Run the documents parked during a model backend outage.')
+    batch.add_argument('--shard', type=shard_spec, help="Process only shard 'index/count' (0-based) of the documents.")
+    batch.add_argument('--concurrency', type=int,
+                       help='Documents processed concurrently; defaults to the tuned or configured concurrency of the workflow.')
+    batch.add_argument('--schedule', choices=SCHEDULE_ORDERS, default=config.BATCH_SCHEDULE,
+                       help='Start order: input order, longest predicted first, or least deadline slack first.')
+    batch.add_argument('--deadlines', help='JSON file mapping document IDs to deadlines in seconds from the start of the batch.')
+    batch.add_argument('--resume', action='store_true', help='Skip documents that already have an extraction.')
+    batch.add_argument('--preflight', action='store_true', help='Print the token and call budget of the batch (to stderr) before it starts.')
+    batch.add_argument('--sink', help="'stdout' to print JSONL rows, a directory to copy each document's JSONL into, "
+                       "or a .esga archive to append each document's JSONL and step outputs to.")
+    batch.add_argument('--progress-interval', type=float, default=config.BATCH_PROGRESS_INTERVAL,
+                       help='Seconds between progress reports on stderr (0 disables them).')
+    batch.set_defaults(handler=cmd_batch)
+
+    evaluate = commands.add_parser('evaluate', help='Compare generated extractions with the expected ones.')
+    evaluate.add_argument('--workflows', nargs='+', choices=WORKFLOWS, default=list(WORKFLOWS))
+    evaluate.set_defaults(handler=cmd_evaluate)
+
+    benchmark = commands.add_parser('benchmark', help='Compare coverage, latency and tokens across workflows.')
+    benchmark.add_argument('--workflows', nargs='+', choices=WORKFLOWS, default=list(WORKFLOWS))
+    benchmark.set_defaults(handler=cmd_benchmark)
+
+    profile = commands.add_parser('profile', help='Merge stored profiles and list the top self-time functions.')
+    profile.add_argument('--workflow', choices=WORKFLOWS, help='Only merge profiles of this workflow.')
+    profile.add_argument('--limit', type=int, default=20, help='Number of functions to list.')
+    profile.set_defaults(handler=cmd_profile)
+
+    index = commands.add_parser('index', help='Build or incrementally update the metric index over generated and expected rows.')
+    index.set_defaults(handler=cmd_index)
+
+    query = commands.add_parser('query', help='Query indexed metrics across documents (prints JSONL).')
+    query.add_argument('--code', help="Metric code, e.g. '429'.")
+    query.add_argument('--year', type=int)
+    query.add_argument('--unit')
+    query.add_argument('--sector')
+    query.add_argument('--company', help='Company name (substring) or ID.')
+    query.add_argument('--country')
+    query.add_argument('--kind', choices=['generated', 'expected'])
+    query.add_argument('--workflow', choices=WORKFLOWS)
+    query.add_argument('--document', help='Document ID.')
+    query.add_argument('--limit', type=int)
+    query.add_argument('--no-update', action='store_true', help='Query without updating the index first.')
+    query.set_defaults(handler=cmd_query)
+
+    verify = commands.add_parser('verify', help="Check the values and page numbers of a workflow's extractions against the PDF text layer.")
+    verify.add_argument('--workflow', choices=WORKFLOWS, default='multi_step')
+    verify.set_defaults(handler=cmd_verify)
+
+    slim = commands.add_parser('slim', help='Build the slimmed copies of the documents and report the byte savings.')
+    slim.add_argument('--docs', default=os.path.join(DOCS_DIR, '*.pdf'), help='Glob of PDFs in the docs directory.')
+    slim.add_argument('--workflow', choices=WORKFLOWS, help="Also show each document's coverage in this workflow's current extractions.")
+    slim.set_defaults(handler=cmd_slim)
+
+    preflight = commands.add_parser('preflight', help="Estimate a batch's tokens and calls and each document's plan.")
+    preflight.add_argument('--workflow', choices=WORKFLOWS, default='multi_step')
+    preflight.add_argument('--docs', default=os.path.join(DOCS_DIR, '*.pdf'), help='Glob of PDFs in the docs directory.')
+    preflight.add_argument('--offline', action='store_true', help='Estimate tokens locally instead of counting them with the model.')
+    preflight.add_argument('--rate-limit', type=float, help='Model calls per minute to project the duration at.')
+    preflight.set_defaults(handler=cmd_preflight)
+
+    pack_archive = commands.add_parser('pack', help='Add documents and outputs to a single-file archive.')
+    pack_archive.add_argument('archive', help=f'Archive path ({ARCHIVE_SUFFIX}), created if missing.')
+    pack_archive.add_argument('--include', nargs='+', default=list(PACKED_DIRS), help='Directories under the data directory.')
+    pack_archive.add_argument('--compact', action='store_true', help='Rewrite the archive without replaced members instead.')
+    pack_archive.set_defaults(handler=cmd_pack)
+
+    unpack_archive = commands.add_parser('unpack', help='Extract archive members into the data directory.')
+    unpack_archive.add_argument('archive', help=f'Archive path ({ARCHIVE_SUFFIX}).')
+    unpack_archive.add_argument('--pattern', default='*', help="Glob over member paths, e.g. 'docs/*.pdf'.")
+    unpack_archive.add_argument('--target', help='Directory to extract into instead of the data directory.')
+    unpack_archive.add_argument('--list', action='store_true', help='List the members with their raw and stored sizes instead.')
+    unpack_archive.set_defaults(handler=cmd_unpack)
+
+    tune = commands.add_parser('tune', help='Sweep concurrency, chunking and hedging on a sample and write the best settings to a profile.')
+    tune.add_argument('--workflows', nargs='+', choices=WORKFLOWS, default=['multi_step'])
+    tune.add_argument('--docs', default=os.path.join(DOCS_DIR, '*.pdf'), help='Glob of PDFs in the docs directory to sample from.')
+    tune.add_argument('--sample', type=int, default=16, help='Documents in the sample, spread over page counts.')
+    tune.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8], help='Concurrency levels.')
+    tune.add_argument('--chunk-sizes', type=int, nargs='+', default=[0, 4, 8, 16],
+                      help='Multi-step pipelined chunk sizes (0 runs steps 2 and 3 sequentially).')
+    tune.add_argument('--hedging', choices=['on', 'off', 'both'], default='both', help='Hedging settings to try.')
+    tune.add_argument('--backend', choices=TUNING_BACKENDS, default='local',
+                      help='local replays recorded responses and latencies; real calls the configured endpoints.')
+    tune.add_argument('--latency', type=float, help='Mean call latency of the local backend instead of the recorded latencies.')
+    tune.add_argument('--time-scale', type=float, default=1.0, help='Factor applied to local call latencies to shorten the sweep.')
+    tune.add_argument('--max-latency', type=float, help='Largest acceptable mean document latency in seconds.')
+    tune.add_argument('--profile', default='tuned', help='Profile under config/profiles to write the settings to.')
+    tune.add_argument('--dry-run', action='store_true', help='Print the recommendation without writing the profile.')
+    tune.add_argument('--check', action='store_true', help="Only check whether the profile's tuning matches the current templates and model.")
+    tune.set_defaults(handler=cmd_tune)
+
+    endpoints = commands.add_parser('endpoints', help='Show per-endpoint call statistics from the telemetry.')
+    endpoints.add_argument('--check', action='store_true', help='Probe each configured endpoint first.')
+    endpoints.set_defaults(handler=cmd_endpoints)
+
+    baseline = commands.add_parser('baseline', help='Store the current accuracy, latency and tokens as a baseline.')
+    baseline.add_argument('--workflows', nargs='+', choices=WORKFLOWS, default=['multi_step'])
+    baseline.set_defaults(handler=cmd_baseline)
+
+    regression = commands.add_parser('gate', help='Compare the current run with a baseline; exits nonzero on a regression.')
+    regression.add_argument('--workflows', nargs='+', choices=WORKFLOWS, default=['multi_step'])
+    regression.add_argument('--against', help='Baseline key (or prefix); defaults to the latest baseline.')
+    regression.add_argument('--alpha', type=float, default=0.05, help='Significance level of the coverage sign test.')
+    regression.add_argument('--min-coverage-drop', type=float, default=1.0, help='Smallest mean coverage drop (points) that counts.')
+    regression.add_argument('--max-latency-increase', type=float, default=0.1, help='Tolerated relative p95 latency increase.')
+    regression.set_defaults(handler=cmd_gate)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Main entry point of the command-line interface.
+
+    Args:
+        argv (Optional[List[str]]): The arguments; defaults to sys.argv.
+
+    Returns:
+        int: The process exit code.
+    """
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -27,6 +27,13 @@ class Config:
         self.__initialized = True
         
         self.__config = self._load_config(config_path)
+        # A profile (e.g. written by the tuning sweep) overrides keys of the base configuration
+        self.PROFILES_DIR = os.path.join(os.path.dirname(config_path), 'profiles')
+        self.PROFILE = os.environ.get('ESG_CONFIG_PROFILE') or self.__config.get('profile')
+        if self.PROFILE:
+            profile_path = os.path.join(self.PROFILES_DIR, f'{self.PROFILE}.yml')
+            self.__config = self._merge(self.__config, self._load_config(profile_path) or {})
+            logger.info(f"Applied configuration profile {profile_path}")
         self.PROJECT_ID = self.__config['project_id']
         self.REGION = self.__config['region']
         self.BUCKET = self.__config['bucket']
@@ -34,6 +41,96 @@ class Config:
         self._set_google_credentials(self.CREDENTIALS_PATH)
         self.TEXT_GEN_MODEL_NAME = self.__config['text_gen_model_name']
         self.DATA_DIR = self.__config['data_dir']
+        self.FSYNC_POLICY = self.__config.get('fsync_policy', 'file')
+        self.LOCK_TIMEOUT = self.__config.get('lock_timeout', -1)
+        multi_step = self.__config.get('multi_step', {})
+        self.MULTI_STEP_PIPELINING = multi_step.get('pipelining', False)
+        self.MULTI_STEP_PIPELINE_CHUNK_SIZE = multi_step.get('pipeline_chunk_size', 8)
+        self.MULTI_STEP_PIPELINE_WORKERS = multi_step.get('pipeline_workers', 8)
+        self.MERGED_INCLUDE_METADATA = self.__config.get('merged_step', {}).get('include_metadata', True)
+        self.HYBRID_CONFIDENCE_THRESHOLD = self.__config.get('hybrid', {}).get('confidence_threshold', 0.8)
+        dedup = self.__config.get('dedup', {})
+        self.DEDUP_ENABLED = dedup.get('enabled', True)
+        self.DEDUP_NEAR_DUPLICATE_THRESHOLD = dedup.get('near_duplicate_threshold', 0.9)
+        self.DEDUP_LINK_MODE = dedup.get('link_mode', 'symlink')
+        batch = self.__config.get('batch', {})
+        self.BATCH_CONCURRENCY = batch.get('concurrency', 5)
+        self.BATCH_WORKFLOW_CONCURRENCY = batch.get('workflow_concurrency') or {}
+        self.BATCH_PROGRESS_INTERVAL = batch.get('progress_interval', 10)
+        self.BATCH_SCHEDULE = batch.get('schedule', 'lpt')
+        self.RATE_LIMIT_CALLS_PER_MINUTE = batch.get('rate_limit')
+        self.CACHE_MODE = batch.get('cache_mode', 'off')
+        timeouts = self.__config.get('timeouts', {})
+        self.CALL_TIMEOUT = timeouts.get('call_timeout')
+        self.DOCUMENT_TIMEOUT = timeouts.get('document_timeout')
+        self.TIMEOUT_RETRIES = timeouts.get('retries', 1)
+        self.TIMEOUT_ISOLATION = timeouts.get('isolation', 'thread')
+        breaker = self.__config.get('breaker', {})
+        self.BREAKER_ENABLED = breaker.get('enabled', True)
+        self.BREAKER_WINDOW = breaker.get('window', 60)
+        self.BREAKER_MIN_CALLS = breaker.get('min_calls', 10)
+        self.BREAKER_ERROR_THRESHOLD = breaker.get('error_threshold', 0.5)
+        self.BREAKER_OPEN_SECONDS = breaker.get('open_seconds', 30)
+        self.BREAKER_MAX_OPEN_SECONDS = breaker.get('max_open_seconds', 600)
+        self.BREAKER_MAX_WAIT = breaker.get('max_wait', 3600)
+        cascade = self.__config.get('cascade', {})
+        self.CASCADE_ENABLED = cascade.get('enabled', False)
+        self.CASCADE_MODEL_NAME = cascade.get('model', 'gemini-1.5-flash-001')
+        self.CASCADE_STEPS = [str(step) for step in cascade.get('steps', [0, 1, 2, 3, 'single', 'fused'])]
+        self.CASCADE_TOLERANCE = cascade.get('tolerance', 0.05)
+        hedging = self.__config.get('hedging', {})
+        self.HEDGING_ENABLED = hedging.get('enabled', False)
+        self.HEDGING_PERCENTILE = hedging.get('percentile', 95)
+        if not 1 <= self.HEDGING_PERCENTILE <= 99:
+            raise ValueError(f"hedging.percentile must be between 1 and 99, got {self.HEDGING_PERCENTILE}")
+        self.HEDGING_MIN_SAMPLES = hedging.get('min_samples', 20)
+        self.HEDGING_WINDOW = hedging.get('window', 200)
+        self.HEDGING_BUDGET = hedging.get('budget', 0.1)
+        self.HEDGING_WORKFLOWS = hedging.get('workflows') or {}
+        verification = self.__config.get('verification', {})
+        self.VERIFICATION_ENABLED = verification.get('enabled', False)
+        self.VERIFICATION_CORRECT_PAGES = verification.get('correct_pages', True)
+        self.VERIFICATION_RETRY_UNVERIFIED = verification.get('retry_unverified', False)
+        slimming = self.__config.get('slimming', {})
+        self.SLIMMING_ENABLED = slimming.get('enabled', False)
+        self.SLIMMING_MAX_IMAGE_SIDE = slimming.get('max_image_side', 1600)
+        self.SLIMMING_JPEG_QUALITY = slimming.get('jpeg_quality', 75)
+        packing = self.__config.get('packing', {})
+        self.PACKING_ENABLED = packing.get('enabled', False)
+        self.PACKING_MAX_DOCUMENT_PAGES = packing.get('max_document_pages', 5)
+        self.PACKING_MAX_DOCUMENTS = packing.get('max_documents', 8)
+        self.PACKING_MAX_REQUEST_PAGES = packing.get('max_request_pages', 40)
+        preflight = self.__config.get('preflight', {})
+        self.PREFLIGHT_ENABLED = preflight.get('enabled', False)
+        self.PREFLIGHT_MODE = preflight.get('mode', 'local')
+        self.PREFLIGHT_MAX_OUTPUT_TOKENS = preflight.get('max_output_tokens', 8192)
+        self.PREFLIGHT_MAX_PAGES = preflight.get('max_pages', 1000)
+        self.PREFLIGHT_CONTEXT_TOKENS = preflight.get('context_tokens') or {}
+        self.PREFLIGHT_DEFAULT_CONTEXT_TOKENS = preflight.get('default_context_tokens', 1048576)
+        self.PREFLIGHT_LARGE_CONTEXT_MODEL = preflight.get('large_context_model')
+        archive = self.__config.get('archive', {})
+        self.ARCHIVE_PATH = archive.get('path')
+        self.ARCHIVE_CODEC = archive.get('codec', 'zstd')
+        self.ARCHIVE_LEVEL = archive.get('level', 3)
+        endpoints = self.__config.get('endpoints', {})
+        self.ENDPOINTS = endpoints.get('pool') or [{'project': self.PROJECT_ID, 'region': self.REGION}]
+        self.ENDPOINT_FAILURE_THRESHOLD = endpoints.get('failure_threshold', 3)
+        self.ENDPOINT_COOLDOWN = endpoints.get('cooldown', 30)
+        self.ENDPOINT_SMOOTHING = endpoints.get('smoothing', 0.2)
+        profiling = self.__config.get('profiling', {})
+        self.PROFILING_ENABLED = profiling.get('enabled', False)
+        self.PROFILING_SAMPLE_FRACTION = profiling.get('sample_fraction', 0.05)
+        self.PROFILING_INTERVAL = profiling.get('interval', 0.01)
+        service = self.__config.get('service', {})
+        self.SERVICE_HOST = service.get('host', '127.0.0.1')
+        self.SERVICE_PORT = service.get('port', 8080)
+        self.SERVICE_UNIX_SOCKET = service.get('unix_socket')
+        self.SERVICE_WORKERS = service.get('workers', 3)
+        self.SERVICE_QUEUE_SIZE = service.get('queue_size', 1000)
+        self.SERVICE_SPOOL_DIR = service.get('spool_dir')
+        self.SERVICE_POLL_INTERVAL = service.get('poll_interval', 5)
+        self.SERVICE_DEFAULT_WORKFLOW = service.get('default_workflow', 'multi_step')
+        self.SERVICE_JOB_RETENTION = service.get('job_retention', 7 * 24 * 3600)
 
     @staticmethod
     def _load_config(config_path: str) -> Dict[str, Any]:
@@ -52,6 +149,26 @@ class Config:
         except Exception as e:
             logger.error(f"Failed to load the configuration file. Error: {e}")
 
+    @staticmethod
+    def _merge(base: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Merge overriding configuration into a base configuration, section by section.
+
+        Args:
+        - base (dict): The base configuration.
+        - overrides (dict): The keys to override; nested sections are merged recursively.
+
+        Returns:
+        - dict: The merged configuration.
+        """
+        merged = dict(base)
+        for key, value in overrides.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key] = Config._merge(merged[key], value)
+            else:
+                merged[key] = value
+        return merged
+
     @staticmethod
     def _set_google_credentials(credentials_path: str) -> None:
         """
@@ -0,0 +1,180 @@
+from src.evaluate.single import compare_jsonl_files
+from src.utils.telemetry import load_events
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from collections import defaultdict
+from typing import Optional
+from typing import List
+from typing import Dict
+from typing import Any
+import statistics
+import json
+import os
+
+
+WORKFLOWS = ['single_step', 'multi_step', 'merged_step']
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Compute a percentile with linear interpolation between closest ranks.
+
+    Args:
+        values (List[float]): The sample.
+        q (float): The percentile in [0, 100].
+
+    Returns:
+        Optional[float]: The percentile, or None for an empty sample.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def workflow_accuracy(workflow: str) -> Dict[str, Dict[str, int]]:
+    """
+    Compute the matched and expected metric counts per document for a workflow.
+
+    Args:
+        workflow (str): The workflow name.
+
+    Returns:
+        Dict[str, Dict[str, int]]: Per document ID, the number of matches and expected metrics.
+    """
+    generated_dir = os.path.join(config.DATA_DIR, f'validation/generated/{workflow}')
+    expected_dir = os.path.join(config.DATA_DIR, 'validation/expected')
+    accuracy = {}
+    if not os.path.isdir(generated_dir):
+        return accuracy
+
+    for filename in os.listdir(generated_dir):
+        expected_path = os.path.join(expected_dir, filename)
+        if not filename.endswith('.jsonl') or not os.path.exists(expected_path):
+            continue
+        matches, total_expected = compare_jsonl_files(os.path.join(generated_dir, filename), expected_path)
+        accuracy[os.path.splitext(filename)[0]] = {'matches': len(matches), 'expected': total_expected}
+    return accuracy
+
+
+def workflow_costs(workflow: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Collect latency, token usage and call count of the latest run of each document for a workflow.
+
+    Calls of a packed request are tagged with the pack rather than a document, so they are
+    split between the pack's documents by the share recorded with each document's run.
+
+    Args:
+        workflow (str): The workflow name.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Per document ID, the run latency, total tokens, number of calls
+        and number of hedged (duplicate) calls.
+    """
+    latest_runs = {}
+    for event in load_events('run'):
+        if event.get('workflow') == workflow and event.get('status') == 'ok':
+            latest_runs[event['file_name']] = event
+
+    run_ids = {event.get('run_id'): file_name for file_name, event in latest_runs.items()}
+    packs = defaultdict(dict)
+    for file_name, event in latest_runs.items():
+        if event.get('pack'):
+            packs[event['pack']][file_name] = event.get('share', 1 / event.get('packed', 1))
+    costs = {file_name: {'latency': event['latency'], 'tokens': 0, 'calls': 0, 'hedges': 0} for file_name, event in latest_runs.items()}
+    for event in load_events('call'):
+        if event.get('run_id') in run_ids:
+            shares = {run_ids[event['run_id']]: 1}
+        else:
+            shares = packs.get(event.get('file_name'), {})
+        for file_name, share in shares.items():
+            costs[file_name]['calls'] += share
+            costs[file_name]['tokens'] += share * (event.get('total_tokens') or 0)
+            if event.get('attempt') == 'hedge':
+                costs[file_name]['hedges'] += share
+    return costs
+
+
+def summarize_workflow(workflow: str) -> Dict[str, Any]:
+    """
+    Summarise accuracy, latency and token usage of a workflow.
+
+    Args:
+        workflow (str): The workflow name.
+
+    Returns:
+        Dict[str, Any]: The workflow summary.
+    """
+    accuracy = workflow_accuracy(workflow)
+    costs = workflow_costs(workflow)
+    latencies = [cost['latency'] for cost in costs.values()]
+    tokens = [cost['tokens'] for cost in costs.values()]
+    calls = [cost['calls'] for cost in costs.values()]
+    hedges = [cost['hedges'] for cost in costs.values()]
+    matches = sum(doc['matches'] for doc in accuracy.values())
+    expected = sum(doc['expected'] for doc in accuracy.values())
+    coverages = [doc['matches'] / doc['expected'] * 100 for doc in accuracy.values() if doc['expected']]
+
+    return {
+        'workflow': workflow,
+        'documents_evaluated': len(accuracy),
+        'documents_timed': len(costs),
+        'coverage_micro': matches / expected * 100 if expected else None,
+        'coverage_macro': statistics.mean(coverages) if coverages else None,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'tokens_mean': statistics.mean(tokens) if tokens else None,
+        'calls_mean': statistics.mean(calls) if calls else None,
+        'hedges_mean': statistics.mean(hedges) if hedges else None
+    }
+
+
+def format_report(summaries: List[Dict[str, Any]]) -> str:
+    """
+    Render workflow summaries as a fixed-width text table.
+
+    Args:
+        summaries (List[Dict[str, Any]]): The workflow summaries.
+
+    Returns:
+        str: The report text.
+    """
+    columns = ['workflow', 'documents_evaluated', 'coverage_micro', 'coverage_macro', 'latency_p50', 'latency_p95', 'tokens_mean', 'calls_mean', 'hedges_mean']
+
+    def fmt(value: Any) -> str:
+        if value is None:
+            return '-'
+        return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+    rows = [columns] + [[fmt(summary[column]) for column in columns] for summary in summaries]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows) + '\n'
+
+
+def compare_workflows(workflows: List[str] = WORKFLOWS) -> List[Dict[str, Any]]:
+    """
+    Compare latency, tokens and accuracy across workflows and write the comparison report.
+
+    Accuracy uses the same matching as `iterate_and_compare`; latency and tokens come from the
+    telemetry of the latest successful run of each document.
+
+    Args:
+        workflows (List[str]): The workflows to compare.
+
+    Returns:
+        List[Dict[str, Any]]: The workflow summaries.
+    """
+    summaries = [summarize_workflow(workflow) for workflow in workflows]
+    report_path = os.path.join(config.DATA_DIR, 'evaluation/comparison.txt')
+    atomic_write(report_path, format_report(summaries))
+    atomic_write(os.path.join(config.DATA_DIR, 'evaluation/comparison.json'), json.dumps(summaries, indent=4))
+    logger.info(f"Workflow comparison written to {report_path}")
+    return summaries
+
+
+if __name__ == '__main__':
+    compare_workflows()
@@ -0,0 +1,304 @@
+from src.evaluate.compare import workflow_accuracy
+from src.evaluate.compare import workflow_costs
+from src.evaluate.compare import percentile
+from src.utils.slim import slim_settings
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from typing import Optional
+from typing import List
+from typing import Dict
+from typing import Any
+import statistics
+import hashlib
+import random
+import math
+import json
+import time
+import sys
+import os
+
+
+TEMPLATES_DIR = os.path.join(config.DATA_DIR, 'templates')
+BASELINES_DIR = os.path.join(config.DATA_DIR, 'baselines')
+
+# Bootstrap resamples for the p95 latency confidence interval (fixed seed for reproducibility)
+BOOTSTRAP_SAMPLES = 2000
+BOOTSTRAP_SEED = 0
+
+
+def template_hashes() -> Dict[str, str]:
+    """
+    Hash every template file.
+
+    Returns:
+        Dict[str, str]: The SHA-256 of each template, keyed by its path relative to the templates directory.
+    """
+    hashes = {}
+    for root, _, files in os.walk(TEMPLATES_DIR):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            with open(path, 'rb') as file:
+                hashes[os.path.relpath(path, TEMPLATES_DIR)] = hashlib.sha256(file.read()).hexdigest()
+    return dict(sorted(hashes.items()))
+
+
+def baseline_key(workflow: str, hashes: Dict[str, str], model: str, preprocessing: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Compute the key identifying a configuration: the workflow, its templates, the model and
+    the document preprocessing.
+
+    Args:
+        workflow (str): The workflow name.
+        hashes (Dict[str, str]): The template hashes.
+        model (str): The model name(s).
+        preprocessing (Optional[Dict[str, Any]]): The PDF slimming settings, or None when documents are sent as they are.
+
+    Returns:
+        str: A short hex key.
+    """
+    configuration = {'workflow': workflow, 'templates': hashes, 'model': model}
+    if preprocessing is not None:
+        configuration['preprocessing'] = preprocessing
+    payload = json.dumps(configuration, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:12]
+
+
+def current_model() -> str:
+    """
+    Describe the model(s) the pipelines currently use.
+
+    Returns:
+        str: The model name, with the cascade's first model when the cascade is enabled.
+    """
+    if config.CASCADE_ENABLED:
+        return f'{config.CASCADE_MODEL_NAME}->{config.TEXT_GEN_MODEL_NAME}'
+    return config.TEXT_GEN_MODEL_NAME
+
+
+def collect_run(workflow: str) -> Dict[str, Any]:
+    """
+    Collect the per-document accuracy, latency and tokens of the current extractions.
+
+    Args:
+        workflow (str): The workflow name.
+
+    Returns:
+        Dict[str, Any]: The run snapshot with its configuration key.
+    """
+    hashes = template_hashes()
+    model = current_model()
+    preprocessing = slim_settings() if config.SLIMMING_ENABLED else None
+    accuracy = workflow_accuracy(workflow)
+    costs = workflow_costs(workflow)
+    documents = {}
+    for file_name in sorted(set(accuracy) | set(costs)):
+        doc_accuracy = accuracy.get(file_name, {})
+        doc_cost = costs.get(file_name, {})
+        expected = doc_accuracy.get('expected')
+        documents[file_name] = {
+            'coverage': doc_accuracy['matches'] / expected * 100 if expected else None,
+            'matches': doc_accuracy.get('matches'),
+            'expected': expected,
+            'latency': doc_cost.get('latency'),
+            'tokens': doc_cost.get('tokens'),
+            'calls': doc_cost.get('calls')
+        }
+    return {
+        'workflow': workflow,
+        'key': baseline_key(workflow, hashes, model, preprocessing),
+        'model': model,
+        'preprocessing': preprocessing,
+        'templates': hashes,
+        'created_at': time.time(),
+        'documents': documents
+    }
+
+
+def save_baseline(workflow: str) -> str:
+    """
+    Store the current extractions of a workflow as a baseline.
+
+    Args:
+        workflow (str): The workflow name.
+
+    Returns:
+        str: The path of the stored baseline.
+    """
+    run = collect_run(workflow)
+    path = os.path.join(BASELINES_DIR, workflow, f"{time.strftime('%Y%m%dT%H%M%S')}-{run['key']}.json")
+    atomic_write(path, json.dumps(run, indent=4))
+    logger.info(f"Baseline {run['key']} for {workflow} ({len(run['documents'])} documents) saved to {path}")
+    return path
+
+
+def load_baseline(workflow: str, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Load the latest baseline of a workflow, optionally restricted to a configuration key.
+
+    Args:
+        workflow (str): The workflow name.
+        key (Optional[str]): A configuration key (or prefix) to select, or None for the latest baseline.
+
+    Returns:
+        Optional[Dict[str, Any]]: The baseline, or None if there is none.
+    """
+    directory = os.path.join(BASELINES_DIR, workflow)
+    if not os.path.isdir(directory):
+        return None
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.json') and (key is None or name.split('-', 1)[1].startswith(key)))
+    if not names:
+        return None
+    with open(os.path.join(directory, names[-1]), 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def sign_test(differences: List[float]) -> float:
+    """
+    One-sided exact sign test that the paired differences tend to be negative.
+
+    Args:
+        differences (List[float]): The paired differences (ties are ignored).
+
+    Returns:
+        float: The p-value.
+    """
+    negative = sum(1 for difference in differences if difference < 0)
+    n = sum(1 for difference in differences if difference != 0)
+    if not n:
+        return 1.0
+    return sum(math.comb(n, k) for k in range(negative, n + 1)) / 2 ** n
+
+
+def bootstrap_p95_ratio(baseline: List[float], current: List[float]) -> List[float]:
+    """
+    Bootstrap the ratio of the current to the baseline p95 latency over paired documents.
+
+    Args:
+        baseline (List[float]): The baseline latencies.
+        current (List[float]): The current latencies of the same documents.
+
+    Returns:
+        List[float]: The 2.5th and 97.5th percentiles of the ratio.
+    """
+    rng = random.Random(BOOTSTRAP_SEED)
+    n = len(baseline)
+    ratios = []
+    for _ in range(BOOTSTRAP_SAMPLES):
+        indices = [rng.randrange(n) for _ in range(n)]
+        base = percentile([baseline[i] for i in indices], 95)
+        if base:
+            ratios.append(percentile([current[i] for i in indices], 95) / base)
+    return [percentile(ratios, 2.5), percentile(ratios, 97.5)] if ratios else [None, None]
+
+
+def compare_to_baseline(
+    baseline: Dict[str, Any],
+    run: Dict[str, Any],
+    alpha: float,
+    min_coverage_drop: float,
+    max_latency_increase: float
+) -> Dict[str, Any]:
+    """
+    Compare a run with a baseline on the documents both have measured.
+
+    Accuracy regresses when the mean per-document coverage drops by at least min_coverage_drop
+    points and a one-sided sign test over the documents is significant at alpha. p95 latency
+    regresses when the whole bootstrap 95 % interval of the p95 ratio lies above
+    1 + max_latency_increase. Token usage is reported but does not gate.
+
+    Args:
+        baseline (Dict[str, Any]): The stored baseline.
+        run (Dict[str, Any]): The current run snapshot.
+        alpha (float): The significance level of the accuracy test.
+        min_coverage_drop (float): The smallest mean coverage drop (in points) that counts.
+        max_latency_increase (float): The tolerated relative p95 latency increase.
+
+    Returns:
+        Dict[str, Any]: The comparison, with a 'regressions' list that is empty when the gate passes.
+    """
+    shared = sorted(set(baseline['documents']) & set(run['documents']))
+    pairs = [(baseline['documents'][doc], run['documents'][doc]) for doc in shared]
+    regressions = []
+
+    coverage_pairs = [(base['coverage'], new['coverage']) for base, new in pairs if base['coverage'] is not None and new['coverage'] is not None]
+    coverage_deltas = [new - base for base, new in coverage_pairs]
+    coverage_delta = statistics.mean(coverage_deltas) if coverage_deltas else None
+    coverage_p = sign_test(coverage_deltas)
+    if coverage_delta is not None and coverage_delta <= -min_coverage_drop and coverage_p < alpha:
+        regressions.append(f"coverage dropped by {-coverage_delta:.2f} points (sign test p={coverage_p:.4f})")
+
+    latency_pairs = [(base['latency'], new['latency']) for base, new in pairs if base['latency'] is not None and new['latency'] is not None]
+    p95_ratio_interval = [None, None]
+    if len(latency_pairs) >= 2:
+        p95_ratio_interval = bootstrap_p95_ratio([base for base, _ in latency_pairs], [new for _, new in latency_pairs])
+        if p95_ratio_interval[0] is not None and p95_ratio_interval[0] > 1 + max_latency_increase:
+            regressions.append(f"p95 latency increased by at least {(p95_ratio_interval[0] - 1) * 100:.1f}% (95% bootstrap interval)")
+
+    token_pairs = [(base['tokens'], new['tokens']) for base, new in pairs if base['tokens'] and new['tokens'] is not None]
+    return {
+        'workflow': run['workflow'],
+        'baseline_key': baseline['key'],
+        'current_key': run['key'],
+        'documents_compared': len(shared),
+        'coverage_baseline': statistics.mean(base for base, _ in coverage_pairs) if coverage_pairs else None,
+        'coverage_current': statistics.mean(new for _, new in coverage_pairs) if coverage_pairs else None,
+        'coverage_delta': coverage_delta,
+        'coverage_p_value': coverage_p,
+        'latency_p95_baseline': percentile([base for base, _ in latency_pairs], 95),
+        'latency_p95_current': percentile([new for _, new in latency_pairs], 95),
+        'latency_p95_ratio_interval': p95_ratio_interval,
+        'tokens_ratio': statistics.mean(new / base for base, new in token_pairs) if token_pairs else None,
+        'regressions': regressions
+    }
+
+
+def format_comparison(comparison: Dict[str, Any]) -> str:
+    """
+    Render a baseline comparison as text.
+
+    Args:
+        comparison (Dict[str, Any]): The comparison from `compare_to_baseline`.
+
+    Returns:
+        str: The report text.
+    """
+    def fmt(value: Any) -> str:
+        if value is None:
+            return '-'
+        if isinstance(value, list):
+            return '[' + ', '.join(fmt(item) for item in value) + ']'
+        return f"{value:.4f}" if isinstance(value, float) else str(value)
+
+    lines = [f"{key}: {fmt(value)}" for key, value in comparison.items() if key != 'regressions']
+    lines.append('RESULT: ' + ('REGRESSION\n  ' + '\n  '.join(comparison['regressions']) if comparison['regressions'] else 'OK'))
+    return '\n'.join(lines) + '\n'
+
+
+def gate(workflow: str, against: Optional[str] = None, alpha: float = 0.05, min_coverage_drop: float = 1.0, max_latency_increase: float = 0.1) -> int:
+    """
+    Compare the current extractions of a workflow with its baseline and report regressions.
+
+    Args:
+        workflow (str): The workflow name.
+        against (Optional[str]): The baseline key (or prefix); defaults to the latest baseline.
+        alpha (float): The significance level of the accuracy test.
+        min_coverage_drop (float): The smallest mean coverage drop (in points) that counts.
+        max_latency_increase (float): The tolerated relative p95 latency increase.
+
+    Returns:
+        int: 0 when there is no regression, 1 on a regression, 2 when no baseline exists.
+    """
+    baseline = load_baseline(workflow, against)
+    if baseline is None:
+        logger.error(f"No baseline found for {workflow}" + (f" with key {against}" if against else ''))
+        return 2
+    comparison = compare_to_baseline(baseline, collect_run(workflow), alpha, min_coverage_drop, max_latency_increase)
+    report = format_comparison(comparison)
+    atomic_write(os.path.join(config.DATA_DIR, f'evaluation/{workflow}/regression.txt'), report)
+    print(report, end='')
+    return 1 if comparison['regressions'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(gate(sys.argv[1] if len(sys.argv) > 1 else 'multi_step'))
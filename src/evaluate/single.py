@@ -1,14 +1,16 @@
-from src.utils.evaluate import compare_json_objects
+from src.utils.record import load_records
+from src.utils.record import match_keys
 from src.config.logging import logger
 from src.config.setup import config
-from src.utils.io import load_jsonl
+from collections import defaultdict
 from typing import Tuple
 from typing import List 
+from typing import Dict
 from typing import Any 
 import os
 
 
-def compare_jsonl_files(expected_file_path: str, generated_file_path: str) -> Tuple[List[Tuple[Any, Any]], int]:
+def compare_jsonl_files(expected_file_path: str, generated_file_path: str) -> Tuple[List[Tuple[Dict[str, Any], Dict[str, Any]]], int]:
     """
     Compares two JSONL files and finds matching objects.
 
@@ -17,26 +19,26 @@ def compare_jsonl_files(expected_file_path: str, generated_file_path: str) -> Tu
         generated_file_path (str): Path to the generated JSONL file.
 
     Returns:
-        Tuple[List[Tuple[Any, Any]], int]: A list of matching object pairs and the count of objects in the generated file.
+        Tuple[List[Tuple[Dict[str, Any], Dict[str, Any]]], int]: A list of matching object pairs and the count of objects in the generated file.
     """
     try:
-        expected_json_list = load_jsonl(expected_file_path)
-        generated_json_list = load_jsonl(generated_file_path)
+        expected_records = load_records(expected_file_path)
+        generated_records = load_records(generated_file_path)
     except Exception as e:
         logger.error(f"Error loading JSONL files: {e}")
         return [], 0
 
+    # Objects match on code and value converted to a canonical unit; index one side by that key
+    expected_by_key = defaultdict(list)
+    for expected_record, key in zip(expected_records, match_keys(expected_records)):
+        expected_by_key[key].append(expected_record)
+
     matches = []
-    for generated_obj in generated_json_list:
-        for expected_obj in expected_json_list:
-            try:
-                is_code_matched, is_value_matched = compare_json_objects(expected_obj, generated_obj)
-                if is_code_matched and is_value_matched:
-                    matches.append((expected_obj, generated_obj))
-            except Exception as e:
-                logger.error(f"Error comparing JSON objects: {e}")
-
-    return matches, len(generated_json_list)
+    for generated_record, key in zip(generated_records, match_keys(generated_records)):
+        for expected_record in expected_by_key.get(key, []):
+            matches.append((expected_record.to_dict(), generated_record.to_dict()))
+
+    return matches, len(generated_records)
 
 
 if __name__ == '__main__':
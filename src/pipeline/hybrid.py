@@ -0,0 +1,242 @@
+from src.pipeline.multi_step import step_1 as llm_discover
+from src.pipeline.multi_step import step_2 as llm_extract
+from src.pipeline.multi_step import step_3 as llm_classify
+from src.utils.template import load_metric_catalogue
+from src.utils.template import load_response_schema
+from src.utils.telemetry import record_event
+from src.utils.telemetry import run_context
+from src.utils.profiler import profile_run
+from src.pipeline.multi_step import wait_for_saves
+from src.utils.rules import extract_with_rules
+from src.utils.pdf import extract_page_texts
+from vertexai.generative_models import Part
+from src.utils.io import load_binary_file
+from src.utils.slim import upload_path
+from src.utils.page_index import mark_rows
+from src.utils.lock import document_lock
+from src.config.logging import logger
+from src.config.setup import config
+from concurrent.futures import Future
+from src.utils.io import save_jsonl
+from src.utils.io import save_json
+from typing import Optional
+from typing import List
+from typing import Dict
+from typing import Any
+import time
+import re
+import os
+
+
+OUTPUT_DIR = os.path.join(config.DATA_DIR, 'output')
+VALIDATION_DIR = os.path.join(config.DATA_DIR, 'validation')
+
+
+# Fields of a row that step 3 derives from the document rather than from the value itself
+CLASSIFICATION_FIELDS = ('scope', 'flag', 'flag_reasoning', 'consumption_type')
+
+# Snippet wording that moves a rule-resolved row off the step 3 defaults (Full, Operational Consumption)
+PARTIAL_CUES = re.compile(r'\b(?:excluding|excludes|only|partial|selected sites|headquarters|subsidiar(?:y|ies))\b', re.IGNORECASE)
+SUPPLY_CHAIN_CUES = re.compile(r'\b(?:supply chain|suppliers?|contractors?|third[- ]party|logistics providers?)\b', re.IGNORECASE)
+
+
+def is_placeholder(row: Dict[str, Any]) -> bool:
+    """
+    Check whether a step 2 row stands for a metric the model did not find (null or -1 value).
+
+    Args:
+        row (Dict[str, Any]): The step 2 row.
+
+    Returns:
+        bool: True if the row carries no value.
+    """
+    value = row.get('value')
+    return value is None or (not isinstance(value, bool) and value == -1)
+
+
+def resolve_with_llm(
+    file_name: str,
+    pdf_parts: Part,
+    metrics: Optional[List[Dict[str, Any]]],
+    pending_saves: List[Future]
+) -> List[Dict[str, Any]]:
+    """
+    Extract the metrics the rules could not handle with the multi-step LLM steps 1 and 2.
+
+    Args:
+        file_name (str): The name of the PDF file (without extension).
+        pdf_parts (Part): The PDF part sent to the model.
+        metrics (Optional[List[Dict[str, Any]]]): The metrics (code and item) to extract, or None
+            to let step 1 discover them when the text layer gave no usable hint.
+        pending_saves (List[Future]): Collects the background saves of the intermediates.
+
+    Returns:
+        List[Dict[str, Any]]: The step 2 rows that carry a value.
+    """
+    output_dir = os.path.join(OUTPUT_DIR, f'hybrid/{file_name}')
+    if metrics is None:
+        metrics, saved = llm_discover(pdf_parts, os.path.join(output_dir, 'out_step_1.txt'))
+        pending_saves.append(saved)
+    if not metrics:
+        return []
+    out_step_2, saved = llm_extract(metrics, pdf_parts, os.path.join(output_dir, 'out_step_2.txt'))
+    pending_saves.append(saved)
+    found = [row for row in out_step_2 if not is_placeholder(row)]
+    if len(found) < len(out_step_2):
+        logger.info(f"Step 2 found no value for {len(out_step_2) - len(found)} of {len(out_step_2)} metrics of {file_name}")
+    return found
+
+
+def classify_locally(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Classify a rule-resolved row without the model, following the step 3 instruction's defaults.
+
+    Step 3 assigns the Full flag and operational consumption unless the data is clearly
+    limited or consumed by the supply chain; the row's snippet is checked for such wording.
+    Scope defaults to Global, as rule-resolved rows come from the document's headline tables.
+
+    Args:
+        row (Dict[str, Any]): The rule-resolved row.
+
+    Returns:
+        Dict[str, Any]: The classification fields.
+    """
+    snippet = row.get('snippet') or ''
+    partial = PARTIAL_CUES.search(snippet)
+    supply_chain = SUPPLY_CHAIN_CUES.search(snippet)
+    return {
+        'scope': 'Global',
+        'flag': 'Partial' if partial else 'Full',
+        'flag_reasoning': f"Rule-based: the snippet mentions '{partial.group(0)}'" if partial else 'Rule-based: no limitation of scope in the snippet',
+        'consumption_type': 'Supply Chain Consumption' if supply_chain else 'Operational Consumption'
+    }
+
+
+def classify_rule_rows(rule_rows: List[Dict[str, Any]], classified: List[Dict[str, Any]], fields: List[str]) -> List[Dict[str, Any]]:
+    """
+    Complete the rows resolved by the rules with the classification step 3 gave them.
+
+    The values, units, pages and snippets found by the rules are kept; the year is taken
+    from step 3 when the rules found none. Rows step 3 did not return (or all rows, when
+    step 3 was not called) are classified locally with `classify_locally`.
+
+    Args:
+        rule_rows (List[Dict[str, Any]]): The rows resolved by the rules.
+        classified (List[Dict[str, Any]]): The step 3 output, empty if step 3 was not called.
+        fields (List[str]): The fields of an output row.
+
+    Returns:
+        List[Dict[str, Any]]: The rule rows with exactly the output fields.
+    """
+    classifications: Dict[str, Dict[str, Any]] = {}
+    for row in classified:
+        classifications.setdefault(row.get('code'), row)
+    rows = []
+    for rule_row in rule_rows:
+        classification = classifications.get(rule_row['code'])
+        if classification is None:
+            if classified:
+                logger.warning(f"Step 3 returned no classification for rule-resolved metric {rule_row['code']}")
+            classification = classify_locally(rule_row)
+        row = {field: rule_row.get(field) for field in fields}
+        row.update({field: classification.get(field) for field in CLASSIFICATION_FIELDS if field in row})
+        if row.get('year') is None and 'year' in row:
+            row['year'] = classification.get('year')
+        rows.append(row)
+    return rows
+
+
+def run(file_name: str) -> Dict[str, Any]:
+    """
+    Run the hybrid extraction process for the given PDF file.
+
+    Metrics from the step 1 catalogue are first resolved offline from the PDF text layer
+    with table and regex rules. Catalogue metrics the document mentions but the rules could
+    not resolve are extracted with the multi-step LLM step 2 (or steps 1 and 2 if the text
+    layer mentions no catalogue metric). When the LLM found values, step 3 classifies them
+    together with the rule rows; otherwise the rule rows are classified locally and the
+    document needs no model call at all. Metrics the LLM found no value for are left out.
+    All rows carry the step 3 fields and a 'source' field ('rules' or 'llm'); the rules'
+    confidences go to the resolution report.
+
+    Args:
+        file_name (str): The name of the PDF file (without extension) to be processed.
+
+    Returns:
+        Dict[str, Any]: The resolution report with the share of metrics resolved by each path.
+
+    Raises:
+        Exception: If any step in the process fails, the exception is logged and re-raised.
+    """
+    try:
+        logger.info(f"Running hybrid extraction for file: {file_name}")
+        with document_lock(file_name, workflow='hybrid'), run_context('hybrid', file_name), profile_run():
+            file_path = os.path.join(config.DATA_DIR, f'docs/{file_name}.pdf')
+            output_dir = os.path.join(OUTPUT_DIR, f'hybrid/{file_name}')
+            start_time = time.time()
+            pending_saves: List[Future] = []
+
+            # Fast path: rule-based extraction against the metric catalogue
+            page_texts = extract_page_texts(file_path)
+            resolved: List[Dict[str, Any]] = []
+            unresolved: Optional[List[Dict[str, Any]]] = None
+            if page_texts and any(text.strip() for text in page_texts):
+                resolved, unresolved = extract_with_rules(page_texts, load_metric_catalogue(), config.HYBRID_CONFIDENCE_THRESHOLD)
+                if not resolved and not any(entry['mentioned'] for entry in unresolved):
+                    # No catalogue label found in the text layer; let the LLM discover metrics
+                    unresolved = None
+            else:
+                logger.warning(f"No usable text layer for {file_name}; falling back to the LLM pipeline")
+
+            # Fallback: LLM steps for the mentioned metrics the rules could not resolve
+            fields = list(load_response_schema(workflow='multi_step', step=3)['items']['properties'])
+            metrics = None if unresolved is None else [
+                {'code': entry['code'], 'item': entry['item']} for entry in unresolved if entry['mentioned']
+            ]
+            extracted: List[Dict[str, Any]] = []
+            classified: List[Dict[str, Any]] = []
+            if metrics is None or metrics:
+                pdf_parts = Part.from_data(data=load_binary_file(upload_path(file_path)), mime_type='application/pdf')
+                extracted = resolve_with_llm(file_name, pdf_parts, metrics, pending_saves)
+                if extracted:
+                    # One step 3 call classifies the rows of both paths
+                    classified, saved = llm_classify(resolved + extracted, pdf_parts, os.path.join(output_dir, 'out_step_3.txt'))
+                    pending_saves.append(saved)
+            rule_rows = classify_rule_rows(resolved, classified, fields)
+            resolved_codes = {row['code'] for row in resolved}
+            llm_rows = [{field: row.get(field) for field in fields} for row in classified if row.get('code') not in resolved_codes]
+
+            rows = [{**row, 'source': 'rules'} for row in rule_rows] + [{**row, 'source': 'llm'} for row in llm_rows]
+            total = len(rows)
+            report = {
+                'file_name': file_name,
+                'rules': len(rule_rows),
+                'llm': len(llm_rows),
+                'rules_share': len(rule_rows) / total if total else 0.0,
+                'llm_share': len(llm_rows) / total if total else 0.0,
+                'llm_calls': len(pending_saves),
+                'rule_confidence': {row['code']: round(row['confidence'], 2) for row in resolved}
+            }
+
+            if config.VERIFICATION_ENABLED:
+                mark_rows(file_path, rows)
+            # The JSONL marks the run complete (see `--resume`), so the intermediates must be saved first
+            wait_for_saves(pending_saves)
+            save_json(rows, os.path.join(output_dir, 'out.txt'))
+            save_json(report, os.path.join(output_dir, 'resolution.json'))
+            save_jsonl(rows, os.path.join(VALIDATION_DIR, f'generated/hybrid/{file_name}.jsonl'), workflow='hybrid')
+
+            elapsed_time = time.time() - start_time
+            record_event('run', latency=elapsed_time, status='ok', rules=report['rules'], llm=report['llm'])
+            logger.info(f"Hybrid extraction resolved {report['rules']} metrics by rules and {report['llm']} by LLM "
+                        f"({report['llm_calls']} LLM calls) in {elapsed_time:.2f} seconds")
+            return report
+
+    except Exception as e:
+        logger.error(f"Error in run process: {e}")
+        raise  # Re-raise the exception after logging
+
+
+if __name__ == '__main__':
+    file_name = '100395060535523152'
+    run(file_name)
@@ -0,0 +1,163 @@
+from src.pipeline.multi_step import step_0 as extract_metadata
+from src.utils.template import load_merged_templates
+from src.utils.telemetry import telemetry_context
+from src.pipeline.multi_step import wait_for_saves
+from src.pipeline.multi_step import _chain_executor
+from src.utils.telemetry import bind_context
+from src.utils.telemetry import record_event
+from src.utils.telemetry import run_context
+from src.utils.profiler import profile_run
+from src.utils.preflight import restore_page_numbers
+from src.utils.preflight import planned_upload_path
+from src.utils.cascade import generate_routed
+from src.utils.cascade import default_model
+from src.utils.preflight import plan_run
+from vertexai.generative_models import Part
+from src.utils.io import save_jsonl
+from src.utils.io import load_binary_file
+from src.utils.page_index import mark_rows
+from src.utils.lock import document_lock
+from src.config.logging import logger
+from src.config.setup import config
+from concurrent.futures import Future
+from concurrent.futures import wait
+from src.utils.io import save_json
+from typing import List
+from typing import Dict
+from typing import Any
+import time
+import os
+
+
+OUTPUT_DIR = os.path.join(config.DATA_DIR, 'output')
+VALIDATION_DIR = os.path.join(config.DATA_DIR, 'validation')
+
+
+def flatten_metric(metric: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flatten a nested merged-workflow metric into the multi-step step 3 row shape.
+
+    Args:
+        metric (Dict[str, Any]): A metric with 'discovery', 'extraction' and 'scope_and_classification' parts.
+
+    Returns:
+        Dict[str, Any]: The flat metric row.
+    """
+    return {**metric.get('discovery', {}), **metric.get('extraction', {}), **metric.get('scope_and_classification', {})}
+
+
+def fused_extract(pdf_parts: Part, output_path: str) -> Dict[str, Any]:
+    """
+    Discover, extract and classify all metrics in a single call using an LLM (Gemini).
+
+    The response schema chains the multi-step steps 1-3: each metric holds a discovery,
+    an extraction and a scope_and_classification object, which are flattened into the
+    step 3 row shape before saving.
+
+    Args:
+        pdf_parts (Part): The parts of the PDF document to be processed.
+        output_path (str): The file path where the output JSON will be saved.
+
+    Returns:
+        Dict[str, Any]: The output with the flattened rows under "metrics".
+
+    Raises:
+        ValueError: If the model fails to generate a response.
+        IOError: If saving the JSON to the output path fails.
+    """
+    try:
+        system_instruction, user_instruction, response_schema = load_merged_templates()
+        contents: List[Any] = [pdf_parts, user_instruction]
+
+        with telemetry_context(step='fused'):
+            output_json: Dict[str, Any] = generate_routed(system_instruction, contents, response_schema, step='fused')
+
+        if not output_json:
+            raise ValueError("Failed to generate response from the model.")
+
+        output = {'metrics': [flatten_metric(metric) for metric in output_json.get('metrics', [])]}
+        if not save_json(output, output_path):
+            raise IOError(f"Failed to save JSON to {output_path}")
+        logger.info(f"Output JSON successfully saved to {output_path}")
+        return output
+
+    except ValueError as ve:
+        logger.error(f"ValueError occurred: {ve}")
+        raise
+
+    except IOError as ioe:
+        logger.error(f"IOError occurred while saving JSON: {ioe}")
+        raise
+
+    except Exception as e:
+        logger.error(f"An unexpected error occurred: {e}")
+        raise
+
+
+def run(file_name: str) -> None:
+    """
+    Run the merged extraction process for the given PDF file.
+
+    The process makes at most two concurrent calls:
+    1. Extracting metadata fields (the multi-step step 0, optional via `merged_step.include_metadata`),
+       on the multi-step chain executor.
+    2. A single fused call that discovers, extracts and classifies every metric.
+
+    With the preflight enabled, the document's plan may send a filtered PDF or route the
+    calls to another model (see `src.utils.preflight`).
+
+    Args:
+        file_name (str): The name of the PDF file (without extension) to be processed.
+
+    Raises:
+        Exception: If any step in the process fails, the exception is logged and re-raised.
+    """
+    try:
+        logger.info(f"Running merged extraction for file: {file_name}")
+        with document_lock(file_name, workflow='merged_step'), run_context('merged_step', file_name), profile_run():
+            file_path = os.path.join(config.DATA_DIR, f'docs/{file_name}.pdf')
+            plan = plan_run('merged_step', file_name)
+            pdf_bytes = load_binary_file(planned_upload_path(file_path, plan))
+            pdf_parts = Part.from_data(data=pdf_bytes, mime_type='application/pdf')
+            output_dir = os.path.join(OUTPUT_DIR, f'merged_step/{file_name}')
+            start_time = time.time()
+            pending_saves: List[Future] = []
+
+            with default_model(plan['model'] if plan else None):
+                metadata = None
+                if config.MERGED_INCLUDE_METADATA:
+                    # Step 0 is independent of the fused call and overlaps with it
+                    metadata = _chain_executor.submit(bind_context(extract_metadata), pdf_parts, os.path.join(output_dir, 'out_step_0.txt'))
+
+                output_path = os.path.join(output_dir, 'out.txt')
+                try:
+                    output = fused_extract(pdf_parts, output_path)
+                except Exception:
+                    # Never leave the metadata call running once the document has failed
+                    if metadata is not None:
+                        metadata.cancel()
+                        wait([metadata])
+                    raise
+                if metadata is not None:
+                    pending_saves.append(metadata.result())
+            output = {**output, 'metrics': restore_page_numbers(output['metrics'], plan)}
+
+            # Write the output to JSONL format
+            if config.VERIFICATION_ENABLED:
+                mark_rows(file_path, output['metrics'])
+            # The JSONL marks the run complete (see `--resume`), so the intermediates must be saved first
+            wait_for_saves(pending_saves)
+            save_jsonl(output, os.path.join(VALIDATION_DIR, f'generated/merged_step/{file_name}.jsonl'), workflow='merged_step')
+
+            elapsed_time = time.time() - start_time
+            record_event('run', latency=elapsed_time, status='ok')
+            logger.info(f"Extraction process completed successfully in {elapsed_time:.2f} seconds")
+
+    except Exception as e:
+        logger.error(f"Error in run process: {e}")
+        raise  # Re-raise the exception after logging
+
+
+if __name__ == '__main__':
+    file_name = '100395060535523152'
+    run(file_name)
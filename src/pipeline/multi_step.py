@@ -1,16 +1,31 @@
-from vertexai.generative_models import HarmBlockThreshold
-from vertexai.generative_models import GenerationConfig
 from src.utils.template import load_system_instruction
-from vertexai.generative_models import GenerativeModel
+from src.utils.telemetry import telemetry_context
+from src.utils.telemetry import bind_context
+from src.utils.telemetry import record_event
+from src.utils.telemetry import run_context
+from src.utils.profiler import profile_run
+from src.utils.preflight import restore_page_numbers
+from src.utils.preflight import planned_upload_path
+from src.utils.cascade import generate_routed
+from src.utils.cascade import default_model
+from src.utils.preflight import plan_run
 from src.utils.template import load_user_instruction
 from src.utils.template import load_response_schema
-from vertexai.generative_models import HarmCategory
-from src.utils.io import convert_json_to_jsonl
+from src.utils.io import save_json_async
 from vertexai.generative_models import Part
 from src.utils.io import load_binary_file
+from src.utils.page_index import summarize_statuses
+from src.utils.page_index import verify_rows
+from src.utils.page_index import mark_rows
 from src.config.logging import logger
 from src.config.setup import config
-from src.utils.io import save_json
+from src.utils.io import save_jsonl
+from src.utils.lock import document_lock
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
+from concurrent.futures import wait
+from typing import Optional
+from typing import Tuple
 from typing import List
 from typing import Dict 
 from typing import Any 
@@ -22,106 +37,51 @@ import os
 OUTPUT_DIR = os.path.join(config.DATA_DIR, 'output')
 VALIDATION_DIR = os.path.join(config.DATA_DIR, 'validation')
 
-def create_generation_config(response_schema: Dict[str, Any]) -> GenerationConfig:
-    """
-    Create a GenerationConfig instance.
-
-    Args:
-        response_schema (Dict[str, Any]): The schema for the response.
-
-    Returns:
-        GenerationConfig: An instance of GenerationConfig with the specified parameters.
-    """
-    try:
-        logger.info("Creating generation configuration")
-        config = GenerationConfig(
-            temperature=0.0, 
-            top_p=0.0, 
-            top_k=1, 
-            candidate_count=1, 
-            max_output_tokens=8192,
-            response_mime_type="application/json",
-            response_schema=response_schema
-        )
-        logger.info("Successfully created generation configuration")
-        return config
-    except Exception as e:
-        logger.error(f"Error creating generation configuration: {e}")
-        raise
-
+# Fields of each upstream step's output that the next step actually needs
+STEP_INPUT_FIELDS = {
+    2: ('code', 'item'),
+    3: ('code', 'item', 'value', 'unit', 'page_number', 'snippet')
+}
 
-def create_safety_settings() -> Dict[HarmCategory, HarmBlockThreshold]:
-    """
-    Create a safety settings dictionary.
+# Step 0 and the step 2 -> step 3 chains of pipelined runs, shared by all documents
+_chain_executor = ThreadPoolExecutor(max_workers=config.MULTI_STEP_PIPELINE_WORKERS, thread_name_prefix='multi-step-chain')
 
-    Returns:
-        Dict[HarmCategory, HarmBlockThreshold]: A dictionary mapping harm categories to block thresholds.
+def compact_step_output(step_output: List[Dict[str, Any]], step: int) -> Part:
     """
-    try:
-        logger.info("Creating safety settings")
-        safety_settings = {
-            HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE
-        }
-        logger.info("Successfully created safety settings")
-        return safety_settings
-    except Exception as e:
-        logger.error(f"Error creating safety settings: {e}")
-        raise  # Re-raise the exception after logging
+    Build a compact text part from an upstream step's output for the given step.
 
-
-def generate_response(model: GenerativeModel, contents: List[Part], response_schema: Dict[str, Any]) -> Any:
-    """
-    Generate content using the generative model.
+    Only the fields the step needs are kept and the JSON is minified, which keeps
+    the prompt small compared to the pretty-printed intermediate files.
 
     Args:
-        model (GenerativeModel): The generative model to use.
-        contents (List[Part]): The contents to be processed by the model.
-        response_schema (Dict[str, Any]): The schema for the response.
+        step_output (List[Dict[str, Any]]): The parsed output of the previous step.
+        step (int): The step that will consume the output.
 
     Returns:
-        Any: The generated response.
+        Part: A plain text part holding the minified JSON.
     """
-    try:
-        logger.info("Generating response using the generative model")
-        response = model.generate_content(
-            contents,
-            generation_config=create_generation_config(response_schema),
-            safety_settings=create_safety_settings()
-        )
-        output_json = json.loads(response.text.strip())
-        logger.info(f"Response generated: {output_json}")
-        logger.info(f"Finish reason: {response.candidates[0].finish_reason}")
-        logger.info(f"Safety ratings: {response.candidates[0].safety_ratings}")
-        return output_json
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding JSON response: {e}")
-        raise  # Re-raise the exception after logging
-    except Exception as e:
-        logger.error(f"Error generating response: {e}")
-        raise  # Re-raise the exception after logging
+    fields = STEP_INPUT_FIELDS[step]
+    compact = [{field: item[field] for field in fields if field in item} for item in step_output]
+    return Part.from_text(json.dumps(compact, separators=(',', ':'), ensure_ascii=False))
 
 
-def step_0(model: GenerativeModel, pdf_parts: Part, output_path: str) -> None:
+def step_0(pdf_parts: Part, output_path: str) -> Future:
     """
     Extract the metadata fields from the provided PDF document using an LLM (Gemini).
 
     Args:
-        model (GenerativeModel): The generative model instance configured for text generation.
         pdf_parts (Part): The parts of the PDF document to be processed.
         output_path (str): The file path where the output JSON will be saved.
 
+    Returns:
+        Future: The pending background save of the output JSON.
+
     Raises:
         ValueError: If the model fails to generate a response.
-        IOError: If saving the JSON to the output path fails.
     """
     try:
         # Load system and user instructions for the first step of the workflow
         system_instruction = load_system_instruction(workflow='multi_step', step=0)
-        model = GenerativeModel(config.TEXT_GEN_MODEL_NAME, system_instruction=system_instruction)
         user_instruction = load_user_instruction(workflow='multi_step', step=0)
         
         # Prepare the contents for the model
@@ -131,46 +91,42 @@ def step_0(model: GenerativeModel, pdf_parts: Part, output_path: str) -> None:
         response_schema: Dict[str, Any] = load_response_schema(workflow='multi_step', step=0)
         
         # Generate the response using the model
-        output_json: Dict[str, Any] = generate_response(model, contents, response_schema)
+        with telemetry_context(step=0):
+            output_json: Dict[str, Any] = generate_routed(system_instruction, contents, response_schema, step=0)
         
         if not output_json:
             raise ValueError("Failed to generate response from the model.")
         
-        # Save the generated response as a JSON file
-        save_json(output_json, output_path)
-        logger.info(f"Output JSON successfully saved to {output_path}")
+        # Persist the generated response off the critical path
+        return save_json_async(output_json, output_path)
     
     except ValueError as ve:
         logger.error(f"ValueError occurred: {ve}")
         raise
     
-    except IOError as ioe:
-        logger.error(f"IOError occurred while saving JSON: {ioe}")
-        raise
-    
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         raise
 
 
-def step_1(model: GenerativeModel, pdf_parts: Part, output_path: str) -> None:
+def step_1(pdf_parts: Part, output_path: str) -> Tuple[List[Dict[str, Any]], Future]:
     """
     Identify and extract all energy consumption metrics mentioned in the document.
     Return each metric with its code and item name using an LLM (Gemini).
 
     Args:
-        model (GenerativeModel): The generative model instance configured for text generation.
         pdf_parts (Part): The parts of the PDF document to be processed.
         output_path (str): The file path where the output JSON will be saved.
 
+    Returns:
+        Tuple[List[Dict[str, Any]], Future]: The discovered metrics and the pending background save.
+
     Raises:
         ValueError: If the model fails to generate a response.
-        IOError: If saving the JSON to the output path fails.
     """
     try:
         # Load system and user instructions for the second step of the workflow
         system_instruction = load_system_instruction(workflow='multi_step', step=1)
-        model = GenerativeModel(config.TEXT_GEN_MODEL_NAME, system_instruction=system_instruction)
         user_instruction = load_user_instruction(workflow='multi_step', step=1)
         
         # Prepare the contents for the model
@@ -180,31 +136,27 @@ def step_1(model: GenerativeModel, pdf_parts: Part, output_path: str) -> None:
         response_schema: Dict[str, Any] = load_response_schema(workflow='multi_step', step=1)
         
         # Generate the response using the model
-        output_json: Dict[str, Any] = generate_response(model, contents, response_schema)
+        with telemetry_context(step=1):
+            output_json: List[Dict[str, Any]] = generate_routed(system_instruction, contents, response_schema, step=1)
         
         if not output_json:
             raise ValueError("Failed to generate response from the model.")
         
-        # Save the generated response as a JSON file
-        save_json(output_json, output_path)
-        logger.info(f"Output JSON successfully saved to {output_path}")
+        # Persist the generated response off the critical path
+        return output_json, save_json_async(output_json, output_path)
     
     except ValueError as ve:
         logger.error(f"ValueError occurred: {ve}")
         raise
     
-    except IOError as ioe:
-        logger.error(f"IOError occurred while saving JSON: {ioe}")
-        raise
-    
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         raise
 
 
-def step_2(file_name: str, model: GenerativeModel, pdf_parts: Part, output_path: str) -> None:
+def step_2(step_1_output: List[Dict[str, Any]], pdf_parts: Part, output_path: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[Future]]:
     """
-    Extracts information for each metric listed in the provided text file from the corresponding PDF.
+    Extracts information for each metric discovered in step 1 from the corresponding PDF.
     
     For each metric, the following information is extracted:
     - Raw numerical value
@@ -213,24 +165,23 @@ def step_2(file_name: str, model: GenerativeModel, pdf_parts: Part, output_path:
     - Relevant text snippet
 
     Args:
-        file_name (str): The name of the file containing the metrics.
-        model (GenerativeModel): The generative model instance configured for text generation.
+        step_1_output (List[Dict[str, Any]]): The metrics discovered in step 1.
         pdf_parts (Part): The parts of the PDF document to be processed.
-        output_path (str): The file path where the output JSON will be saved.
+        output_path (Optional[str]): The file path where the output JSON will be saved, or None to keep it in memory only.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], Optional[Future]]: The extracted values and the pending background save, if any.
 
     Raises:
         ValueError: If the model fails to generate a response.
-        IOError: If saving the JSON to the output path fails.
     """
     try:
         # Load system and user instructions for the third step of the workflow
         system_instruction = load_system_instruction(workflow='multi_step', step=2)
-        model = GenerativeModel(config.TEXT_GEN_MODEL_NAME, system_instruction=system_instruction)
         user_instruction = load_user_instruction(workflow='multi_step', step=2)
         
-        # Load the output from step 1
-        out_step_1_file = load_binary_file(os.path.join(OUTPUT_DIR, f'multi_step/{file_name}/out_step_1.txt'))
-        out_step_1 = Part.from_data(data=out_step_1_file, mime_type='text/plain')
+        # Pass the step 1 output in memory as compact JSON
+        out_step_1 = compact_step_output(step_1_output, step=2)
         
         # Prepare the contents for the model
         contents: List[Any] = [pdf_parts, out_step_1, user_instruction]
@@ -239,29 +190,25 @@ def step_2(file_name: str, model: GenerativeModel, pdf_parts: Part, output_path:
         response_schema: Dict[str, Any] = load_response_schema(workflow='multi_step', step=2)
         
         # Generate the response using the model
-        output_json: Dict[str, Any] = generate_response(model, contents, response_schema)
+        with telemetry_context(step=2):
+            output_json: List[Dict[str, Any]] = generate_routed(system_instruction, contents, response_schema, step=2)
         
         if not output_json:
             raise ValueError("Failed to generate response from the model.")
         
-        # Save the generated response as a JSON file
-        save_json(output_json, output_path)
-        logger.info(f"Output JSON successfully saved to {output_path}")
+        # Persist the generated response off the critical path
+        return output_json, save_json_async(output_json, output_path) if output_path else None
     
     except ValueError as ve:
         logger.error(f"ValueError occurred: {ve}")
         raise
     
-    except IOError as ioe:
-        logger.error(f"IOError occurred while saving JSON: {ioe}")
-        raise
-    
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         raise
 
 
-def step_3(file_name: str, model: GenerativeModel, pdf_parts: Part, output_path: str) -> None:
+def step_3(step_2_output: List[Dict[str, Any]], pdf_parts: Part, output_path: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[Future]]:
     """
     For each extracted metric, extract additional information from the provided PDF.
     
@@ -271,24 +218,23 @@ def step_3(file_name: str, model: GenerativeModel, pdf_parts: Part, output_path:
     - Classification of each value as either 'Operational Consumption' or 'Supply Chain Consumption' based on the context in the document.
 
     Args:
-        file_name (str): The name of the file containing the metrics.
-        model (GenerativeModel): The generative model instance configured for text generation.
+        step_2_output (List[Dict[str, Any]]): The values extracted in step 2.
         pdf_parts (Part): The parts of the PDF document to be processed.
-        output_path (str): The file path where the output JSON will be saved.
+        output_path (Optional[str]): The file path where the output JSON will be saved, or None to keep it in memory only.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], Optional[Future]]: The classified metrics and the pending background save, if any.
 
     Raises:
         ValueError: If the model fails to generate a response.
-        IOError: If saving the JSON to the output path fails.
     """
     try:
         # Load system and user instructions for the fourth step of the workflow
         system_instruction = load_system_instruction(workflow='multi_step', step=3)
-        model = GenerativeModel(config.TEXT_GEN_MODEL_NAME, system_instruction=system_instruction)
         user_instruction = load_user_instruction(workflow='multi_step', step=3)
         
-        # Load the output from step 2
-        out_step_2_file = load_binary_file(os.path.join(OUTPUT_DIR, f'multi_step/{file_name}/out_step_2.txt'))
-        out_step_2 = Part.from_data(data=out_step_2_file, mime_type='text/plain')
+        # Pass the step 2 output in memory as compact JSON
+        out_step_2 = compact_step_output(step_2_output, step=3)
         
         # Prepare the contents for the model
         contents: List[Any] = [pdf_parts, out_step_2, user_instruction]
@@ -297,28 +243,184 @@ def step_3(file_name: str, model: GenerativeModel, pdf_parts: Part, output_path:
         response_schema: Dict[str, Any] = load_response_schema(workflow='multi_step', step=3)
         
         # Generate the response using the model
-        output_json: Dict[str, Any] = generate_response(model, contents, response_schema)
+        with telemetry_context(step=3):
+            output_json: List[Dict[str, Any]] = generate_routed(system_instruction, contents, response_schema, step=3)
         
         if not output_json:
             raise ValueError("Failed to generate response from the model.")
         
-        # Save the generated response as a JSON file
-        save_json(output_json, output_path)
-        logger.info(f"Output JSON successfully saved to {output_path}")
+        # Persist the generated response off the critical path
+        return output_json, save_json_async(output_json, output_path) if output_path else None
     
     except ValueError as ve:
         logger.error(f"ValueError occurred: {ve}")
         raise
     
-    except IOError as ioe:
-        logger.error(f"IOError occurred while saving JSON: {ioe}")
-        raise
-    
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         raise
 
 
+def verify_step_2(
+    step_2_output: List[Dict[str, Any]],
+    file_path: str,
+    pdf_parts: Part,
+    output_dir: str,
+    retry_name: str = 'out_step_2_retry.txt'
+) -> Tuple[List[Dict[str, Any]], Optional[Future]]:
+    """
+    Verify the step 2 values against the PDF text layer and re-ask step 2 for the failures.
+
+    Page numbers are corrected on copies of the rows when configured, since the rows as
+    generated may still be being saved in the background. Verified rows are kept as they are;
+    if retries are enabled, the metrics whose value is printed nowhere in the document are
+    sent through step 2 once more, and a retried row replaces the original when it verifies.
+
+    Args:
+        step_2_output (List[Dict[str, Any]]): The values extracted in step 2.
+        file_path (str): The path to the PDF file.
+        pdf_parts (Part): The parts of the PDF document to be processed.
+        output_dir (str): The directory of the intermediate outputs.
+        retry_name (str): The file name of the retry output in the output directory.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], Optional[Future]]: The step 2 rows for step 3 and the pending save of the retry output, if any.
+    """
+    step_2_output = [dict(row) for row in step_2_output]
+    statuses = verify_rows(file_path, step_2_output, config.VERIFICATION_CORRECT_PAGES)
+    with telemetry_context(step=2):
+        record_event('verify', **summarize_statuses(statuses))
+    failed = [row for row, status in zip(step_2_output, statuses) if status == 'unverified']
+    if not failed or not config.VERIFICATION_RETRY_UNVERIFIED:
+        return step_2_output, None
+
+    logger.info(f"Re-asking step 2 for {len(failed)} metrics whose value was not found in the text layer")
+    with telemetry_context(retry=True):
+        retried, saved = step_2(failed, pdf_parts, os.path.join(output_dir, retry_name))
+    retried = [dict(row) for row in retried]
+    retried_statuses = verify_rows(file_path, retried, config.VERIFICATION_CORRECT_PAGES)
+    with telemetry_context(step=2, retry=True):
+        record_event('verify', **summarize_statuses(retried_statuses))
+    replacements = {
+        (row.get('code'), row.get('item')): row
+        for row, status in zip(retried, retried_statuses) if status in ('verified', 'corrected')
+    }
+    merged = [
+        replacements.get((row.get('code'), row.get('item')), row) if status == 'unverified' else row
+        for row, status in zip(step_2_output, statuses)
+    ]
+    return merged, saved
+
+
+def run_chain(
+    chunk: List[Dict[str, Any]],
+    index: int,
+    file_path: str,
+    pdf_parts: Part,
+    output_dir: str
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Optional[Future]]:
+    """
+    Run steps 2 and 3 for one chunk of the step 1 metrics.
+
+    Args:
+        chunk (List[Dict[str, Any]]): The step 1 metrics of the chunk.
+        index (int): The chunk's position, used to name its verification retry output.
+        file_path (str): The path to the PDF file.
+        pdf_parts (Part): The parts of the PDF document to be processed.
+        output_dir (str): The directory of the intermediate outputs.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Optional[Future]]: The chunk's step 2
+        rows as generated, its step 3 rows and the pending save of its retry output, if any.
+    """
+    with telemetry_context(chunk=index):
+        out_step_2, _ = step_2(chunk, pdf_parts, None)
+        # Verification may move page numbers in place; out_step_2.txt keeps the rows as generated
+        generated = [dict(row) for row in out_step_2]
+        saved = None
+        if config.VERIFICATION_ENABLED:
+            out_step_2, saved = verify_step_2(out_step_2, file_path, pdf_parts, output_dir, f'out_step_2_retry_{index}.txt')
+        out_step_3, _ = step_3(out_step_2, pdf_parts, None)
+    return generated, out_step_3, saved
+
+
+def run_pipelined_steps(
+    step_1_output: List[Dict[str, Any]],
+    file_path: str,
+    pdf_parts: Part,
+    output_dir: str,
+    chunk_size: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Future]]:
+    """
+    Run steps 2 and 3 as concurrent chains over chunks of the step 1 metrics.
+
+    Each chunk of `multi_step.pipeline_chunk_size` metrics goes through step 2 and straight on
+    to step 3 without waiting for the other chunks, so the document's latency approaches that
+    of its slowest chain rather than the sum of the full steps. The chunks' outputs are
+    concatenated in step 1 order and saved as `out_step_2.txt` and `out_step_3.txt`, with the
+    same shape as in sequential runs.
+
+    Step 1 does not locate the metrics, so every chain's step 2 and step 3 call sends the whole
+    PDF: the document's input tokens for steps 2 and 3 grow with the number of chunks. The
+    returned step 3 rows are still being saved and must be copied before they are changed.
+
+    Args:
+        step_1_output (List[Dict[str, Any]]): The metrics discovered in step 1.
+        file_path (str): The path to the PDF file.
+        pdf_parts (Part): The parts of the PDF document to be processed.
+        output_dir (str): The directory of the intermediate outputs.
+        chunk_size (Optional[int]): Metrics per chain; defaults to `multi_step.pipeline_chunk_size`.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Future]]: The step 2 rows, the
+        step 3 rows and the pending saves.
+
+    Raises:
+        Exception: The first error of any chain, once the other chains are cancelled or finished.
+    """
+    size = max(1, chunk_size or config.MULTI_STEP_PIPELINE_CHUNK_SIZE)
+    chunks = [step_1_output[i:i + size] for i in range(0, len(step_1_output), size)]
+    logger.info(f"Pipelining steps 2 and 3 over {len(chunks)} chunks of up to {size} metrics ({len(chunks)}x the PDF input tokens of each step)")
+    # Each chain runs in a copy of the caller's context so its telemetry keeps the run tags
+    chains = [
+        _chain_executor.submit(bind_context(run_chain), chunk, index, file_path, pdf_parts, output_dir)
+        for index, chunk in enumerate(chunks)
+    ]
+    out_step_2: List[Dict[str, Any]] = []
+    out_step_3: List[Dict[str, Any]] = []
+    pending_saves: List[Future] = []
+    try:
+        for chain in chains:
+            generated, classified, saved = chain.result()
+            out_step_2.extend(generated)
+            out_step_3.extend(classified)
+            if saved is not None:
+                pending_saves.append(saved)
+    except Exception:
+        # Drop the queued chains and let the running ones finish before the document fails
+        for chain in chains:
+            chain.cancel()
+        wait(chains)
+        raise
+    pending_saves.append(save_json_async(out_step_2, os.path.join(output_dir, 'out_step_2.txt')))
+    pending_saves.append(save_json_async(out_step_3, os.path.join(output_dir, 'out_step_3.txt')))
+    return out_step_2, out_step_3, pending_saves
+
+
+def wait_for_saves(pending_saves: List[Future]) -> None:
+    """
+    Wait for background saves of intermediate outputs to finish.
+
+    Args:
+        pending_saves (List[Future]): The futures returned by the step functions.
+
+    Raises:
+        IOError: If any of the intermediate outputs could not be saved.
+    """
+    if not all(future.result() for future in pending_saves):
+        raise IOError("Failed to save one or more intermediate outputs")
+
+
 def run(file_name: str) -> None:
     """
     Run the entire extraction process for the given PDF file.
@@ -329,6 +431,13 @@ def run(file_name: str) -> None:
     3. Extracting detailed information for each metric.
     4. Extracting additional information and classifying each metric.
 
+    Step outputs are handed to the next step in memory; the intermediate files are
+    written in the background and awaited before the run completes. With pipelining
+    enabled, step 0 overlaps with the other steps and steps 2 and 3 run as concurrent
+    chains over chunks of the step 1 metrics (see `run_pipelined_steps`). With the preflight
+    enabled, the document's plan may chunk steps 2 and 3 this way, send a filtered PDF or
+    route the calls to another model (see `src.utils.preflight`).
+
     Args:
         file_name (str): The name of the PDF file (without extension) to be processed.
 
@@ -337,25 +446,62 @@ def run(file_name: str) -> None:
     """
     try:
         logger.info(f"Running extraction for file: {file_name}")
-        file_path = os.path.join(config.DATA_DIR, f'docs/{file_name}.pdf')
-        pdf_bytes = load_binary_file(file_path)
-        pdf_parts = Part.from_data(data=pdf_bytes, mime_type='application/pdf')
-        start_time = time.time()
-        
-        # Run each step in the extraction process
-        step_0(config.TEXT_GEN_MODEL_NAME, pdf_parts, os.path.join(OUTPUT_DIR, f'multi_step/{file_name}/out_step_0.txt'))
-        step_1(config.TEXT_GEN_MODEL_NAME, pdf_parts, os.path.join(OUTPUT_DIR, f'multi_step/{file_name}/out_step_1.txt'))
-        step_2(file_name, config.TEXT_GEN_MODEL_NAME, pdf_parts, os.path.join(OUTPUT_DIR, f'multi_step/{file_name}/out_step_2.txt'))
-        
-        output_path = os.path.join(OUTPUT_DIR, f'multi_step/{file_name}/out_step_3.txt')
-        step_3(file_name, config.TEXT_GEN_MODEL_NAME, pdf_parts, output_path)
+        with document_lock(file_name, workflow='multi_step'), run_context('multi_step', file_name), profile_run():
+            file_path = os.path.join(config.DATA_DIR, f'docs/{file_name}.pdf')
+            plan = plan_run('multi_step', file_name)
+            # With filtered pages, step 2 is verified against the filtered PDF the model saw
+            pdf_path = planned_upload_path(file_path, plan)
+            step_file_path = pdf_path if plan and plan['kept_pages'] else file_path
+            pdf_bytes = load_binary_file(pdf_path)
+            pdf_parts = Part.from_data(data=pdf_bytes, mime_type='application/pdf')
+            output_dir = os.path.join(OUTPUT_DIR, f'multi_step/{file_name}')
+            start_time = time.time()
+            pending_saves: List[Future] = []
+            chunk_size = plan['chunk_size'] if plan else None
+
+            with default_model(plan['model'] if plan else None):
+                if config.MULTI_STEP_PIPELINING or chunk_size:
+                    # Step 0 is independent of the metric chain and overlaps with it
+                    metadata = _chain_executor.submit(bind_context(step_0), pdf_parts, os.path.join(output_dir, 'out_step_0.txt'))
+                    try:
+                        out_step_1, saved = step_1(pdf_parts, os.path.join(output_dir, 'out_step_1.txt'))
+                        pending_saves.append(saved)
+                        _, out_step_3, saved_chains = run_pipelined_steps(out_step_1, step_file_path, pdf_parts, output_dir, chunk_size)
+                        pending_saves.extend(saved_chains)
+                    except Exception:
+                        # Never leave the metadata call running once the document has failed
+                        metadata.cancel()
+                        wait([metadata])
+                        raise
+                    pending_saves.append(metadata.result())
+                else:
+                    # Run each step in the extraction process
+                    pending_saves.append(step_0(pdf_parts, os.path.join(output_dir, 'out_step_0.txt')))
+                    out_step_1, saved = step_1(pdf_parts, os.path.join(output_dir, 'out_step_1.txt'))
+                    pending_saves.append(saved)
+                    out_step_2, saved = step_2(out_step_1, pdf_parts, os.path.join(output_dir, 'out_step_2.txt'))
+                    pending_saves.append(saved)
+                    if config.VERIFICATION_ENABLED:
+                        out_step_2, saved = verify_step_2(out_step_2, step_file_path, pdf_parts, output_dir)
+                        if saved is not None:
+                            pending_saves.append(saved)
+                    out_step_3, saved = step_3(out_step_2, pdf_parts, os.path.join(output_dir, 'out_step_3.txt'))
+                    pending_saves.append(saved)
+            out_step_3 = restore_page_numbers(out_step_3, plan)
         
-        # Convert the final output to JSONL format
-        convert_json_to_jsonl(output_path, os.path.join(VALIDATION_DIR, f'generated/multi_step/{file_name}.jsonl'), workflow='multi_step')
+            # Write the final output to JSONL format
+            if config.VERIFICATION_ENABLED:
+                # Marking adds fields to the rows; out_step_3.txt may still be being saved from them
+                out_step_3 = [dict(row) for row in out_step_3]
+                mark_rows(file_path, out_step_3)
+            # The JSONL marks the run complete (see `--resume`), so the intermediates must be saved first
+            wait_for_saves(pending_saves)
+            save_jsonl(out_step_3, os.path.join(VALIDATION_DIR, f'generated/multi_step/{file_name}.jsonl'), workflow='multi_step')
         
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        logger.info(f"Extraction process completed successfully in {elapsed_time:.2f} seconds")
+            end_time = time.time()
+            elapsed_time = end_time - start_time
+            record_event('run', latency=elapsed_time, status='ok')
+            logger.info(f"Extraction process completed successfully in {elapsed_time:.2f} seconds")
     
     except Exception as e:
         logger.error(f"Error in run process: {e}")
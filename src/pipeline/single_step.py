@@ -1,167 +1,278 @@
-from vertexai.generative_models import HarmBlockThreshold
-from vertexai.generative_models import GenerationConfig
 from src.utils.template import load_system_instruction
-from vertexai.generative_models import GenerativeModel
+from src.utils.template import load_packed_templates
+from src.utils.telemetry import telemetry_context
+from src.utils.telemetry import record_event
+from src.utils.telemetry import run_context
+from src.utils.profiler import profile_run
+from src.utils.preflight import restore_page_numbers
+from src.utils.preflight import planned_upload_path
+from src.utils.cascade import generate_routed
+from src.utils.cascade import default_model
+from src.utils.preflight import plan_run
 from src.utils.template import load_user_instruction
 from src.utils.template import load_response_schema
-from vertexai.generative_models import HarmCategory
-from src.utils.io import convert_json_to_jsonl
+from src.utils.io import save_jsonl
 from vertexai.generative_models import Part
 from src.utils.io import load_binary_file
+from src.utils.slim import upload_path
+from src.utils.page_index import mark_rows
 from src.config.logging import logger
 from src.config.setup import config
 from src.utils.io import save_json
+from src.utils.lock import document_lock
+from src.utils.pdf import count_pages
+from typing import Optional
 from typing import List
 from typing import Dict 
 from typing import Any 
-import json
+import contextlib
 import time
+import uuid
 import os
 
 
 OUTPUT_DIR = os.path.join(config.DATA_DIR, 'output')
 VALIDATION_DIR = os.path.join(config.DATA_DIR, 'validation')
 
-def create_generation_config(response_schema: Dict[str, Any]) -> GenerationConfig:
+def llm_extract(pdf_parts: Part, output_path: str) -> Dict[str, Any]:
     """
-    Create a GenerationConfig instance.
+    Extract information from a PDF using a generative model and save the output.
 
     Args:
-        response_schema (Dict[str, Any]): The schema for the response.
+        pdf_parts (Part): The PDF parts to be processed.
+        output_path (str): The path to save the extracted information.
 
     Returns:
-        GenerationConfig: An instance of GenerationConfig with the specified parameters.
+        Dict[str, Any]: The parsed extraction output.
+
+    Raises:
+        Exception: If any error occurs during the extraction process, it is logged and re-raised.
     """
     try:
-        logger.info("Creating generation configuration")
-        config = GenerationConfig(
-            temperature=0.0, 
-            top_p=0.0, 
-            top_k=1, 
-            candidate_count=1, 
-            max_output_tokens=8192,
-            response_mime_type="application/json",
-            response_schema=response_schema
-        )
-        logger.info("Successfully created generation configuration")
-        return config
+        logger.info("Starting LLM extraction")
+        system_instruction = load_system_instruction(workflow='single_step', step=None)
+        user_instruction = load_user_instruction(workflow='single_step', step=None)
+        response_schema = load_response_schema(workflow='single_step', step=None)
+        contents = [pdf_parts, user_instruction]
+        with telemetry_context(step='single'):
+            response = generate_routed(system_instruction, contents, response_schema, step='single')
+        save_json(response, output_path)
+        logger.info("LLM extraction completed successfully")
+        return response
     except Exception as e:
-        logger.error(f"Error creating generation configuration: {e}")
-        raise
+        logger.error(f"Error in LLM extraction: {e}")
+        raise  # Re-raise the exception after logging
 
 
-def create_safety_settings() -> Dict[HarmCategory, HarmBlockThreshold]:
+def run(file_name: str) -> None:
     """
-    Create a safety settings dictionary.
+    Run the extraction process on a specified PDF file.
 
-    Returns:
-        Dict[HarmCategory, HarmBlockThreshold]: A dictionary mapping harm categories to block thresholds.
+    With the preflight enabled, the document's plan may send a filtered PDF or route the
+    call to another model (see `src.utils.preflight`).
+
+    Args:
+        file_name (str): The name of the PDF file to process.
+
+    Raises:
+        Exception: If any error occurs during the process, it is logged and re-raised.
     """
     try:
-        logger.info("Creating safety settings")
-        safety_settings = {
-            HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE
-        }
-        logger.info("Successfully created safety settings")
-        return safety_settings
+        logger.info(f"Running extraction for file: {file_name}")
+        with document_lock(file_name, workflow='single_step'), run_context('single_step', file_name), profile_run():
+            file_path = os.path.join(config.DATA_DIR, f'docs/{file_name}.pdf')
+            plan = plan_run('single_step', file_name)
+            pdf_bytes = load_binary_file(planned_upload_path(file_path, plan))
+            pdf_parts = Part.from_data(data=pdf_bytes, mime_type='application/pdf')
+            output_path = os.path.join(OUTPUT_DIR, f'single_step/{file_name}/out.txt')
+            start_time = time.time()
+        
+            # Run the LLM extraction
+            with default_model(plan['model'] if plan else None):
+                response = llm_extract(pdf_parts, output_path)
+            response = {**response, 'metrics': restore_page_numbers(response['metrics'], plan)}
+        
+            # Write the output to JSONL format
+            if config.VERIFICATION_ENABLED:
+                mark_rows(file_path, response['metrics'])
+            save_jsonl(response, os.path.join(VALIDATION_DIR, f'generated/single_step/{file_name}.jsonl'), workflow='single_step')
+        
+            end_time = time.time()
+            elapsed_time = end_time - start_time
+            record_event('run', latency=elapsed_time, status='ok')
+            logger.info(f"Extraction process completed successfully in {elapsed_time:.2f} seconds")
     except Exception as e:
-        logger.error(f"Error creating safety settings: {e}")
+        logger.error(f"Error in run process: {e}")
         raise  # Re-raise the exception after logging
 
 
-def generate_response(model: GenerativeModel, contents: List[Part], response_schema: Dict[str, Any]) -> Any:
+def plan_packs(file_names: List[str], directory: Optional[str] = None, pages: Optional[Dict[str, Optional[int]]] = None) -> List[List[str]]:
     """
-    Generate content using the generative model.
+    Group small documents into packs that are extracted with a single model request.
+
+    Documents of at most `packing.max_document_pages` pages are packed first-fit in
+    descending page order, each pack holding at most `packing.max_documents` documents and
+    `packing.max_request_pages` pages (page counts stand in for the request's input tokens,
+    which are dominated by the per-page cost of PDF input). Larger documents and documents
+    whose page count is unknown stay on their own.
 
     Args:
-        model (GenerativeModel): The generative model to use.
-        contents (List[Part]): The contents to be processed by the model.
-        response_schema (Dict[str, Any]): The schema for the response.
+        file_names (List[str]): The document IDs, in their scheduled order.
+        directory (Optional[str]): The directory containing the PDFs. Defaults to the docs directory.
+        pages (Optional[Dict[str, Optional[int]]]): Page counts already read, keyed by document ID; missing ones are counted.
 
     Returns:
-        Any: The generated response.
+        List[List[str]]: The units of work: packs of several documents, and single documents,
+        in the order of their first document.
     """
-    try:
-        logger.info("Generating response using the generative model")
-        response = model.generate_content(
-            contents,
-            generation_config=create_generation_config(response_schema),
-            safety_settings=create_safety_settings()
-        )
-        output_json = json.loads(response.text.strip())
-        logger.info(f"Response generated: {output_json}")
-        logger.info(f"Finish reason: {response.candidates[0].finish_reason}")
-        logger.info(f"Safety ratings: {response.candidates[0].safety_ratings}")
-        return output_json
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding JSON response: {e}")
-        raise  # Re-raise the exception after logging
-    except Exception as e:
-        logger.error(f"Error generating response: {e}")
-        raise  # Re-raise the exception after logging
+    directory = directory or os.path.join(config.DATA_DIR, 'docs')
+    pages = {
+        file_name: (pages or {}).get(file_name) or count_pages(os.path.join(directory, f'{file_name}.pdf'))
+        for file_name in file_names
+    }
+    small = [file_name for file_name in file_names if pages[file_name] is not None and pages[file_name] <= config.PACKING_MAX_DOCUMENT_PAGES]
 
+    packs: List[List[str]] = []
+    for file_name in sorted(small, key=lambda name: -pages[name]):
+        for pack in packs:
+            if len(pack) < config.PACKING_MAX_DOCUMENTS and sum(pages[name] for name in pack) + pages[file_name] <= config.PACKING_MAX_REQUEST_PAGES:
+                pack.append(file_name)
+                break
+        else:
+            packs.append([file_name])
 
-def llm_extract(model: GenerativeModel, pdf_parts: Part, output_path: str) -> None:
+    position = {file_name: i for i, file_name in enumerate(file_names)}
+    units = [pack for pack in packs if len(pack) > 1]
+    packed = {file_name for pack in units for file_name in pack}
+    units.extend([file_name] for file_name in file_names if file_name not in packed)
+    units.sort(key=lambda unit: min(position[name] for name in unit))
+    logger.info(f"Packed {len(packed)} of {len(file_names)} documents into {len(units) - len(file_names) + len(packed)} requests")
+    return units
+
+
+def pack_shares(pages: Dict[str, Optional[int]]) -> Dict[str, float]:
     """
-    Extract information from a PDF using a generative model and save the output.
+    Split the cost of a packed request between its documents in proportion to their pages.
 
     Args:
-        model (GenerativeModel): The generative model to use for extraction.
-        pdf_parts (Part): The PDF parts to be processed.
-        output_path (str): The path to save the extracted information.
+        pages (Dict[str, Optional[int]]): The page count of each packed document (unknown counts as one page).
+
+    Returns:
+        Dict[str, float]: The share of each document, summing to one.
+    """
+    weights = {file_name: count or 1 for file_name, count in pages.items()}
+    total = sum(weights.values())
+    return {file_name: weight / total for file_name, weight in weights.items()}
+
+
+def llm_extract_packed(pdf_parts: Dict[str, Part], output_paths: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Extract information from several PDFs with one model request and save each document's output.
+
+    Each PDF is preceded by a "Document ID: <id>" line, and the response holds the
+    single-step output of each document under its ID.
+
+    Args:
+        pdf_parts (Dict[str, Part]): The PDF part of each document, keyed by document ID.
+        output_paths (Dict[str, str]): The path to save each document's output to.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The parsed output of each document found in the response.
 
     Raises:
-        Exception: If any error occurs during the extraction process, it is logged and re-raised.
+        Exception: If the request fails or its response is not an object, it is logged and re-raised.
     """
     try:
-        logger.info("Starting LLM extraction")
-        system_instruction = load_system_instruction(workflow='single_step', step=None)
-        user_instruction = load_user_instruction(workflow='single_step', step=None)
-        response_schema = load_response_schema(workflow='single_step', step=None)
-        model = GenerativeModel(config.TEXT_GEN_MODEL_NAME, system_instruction=system_instruction)
-        contents = [pdf_parts, user_instruction]
-        response = generate_response(model, contents, response_schema)
-        save_json(response, output_path)
-        logger.info("LLM extraction completed successfully")
+        logger.info(f"Starting packed LLM extraction of {len(pdf_parts)} documents")
+        system_instruction, user_instruction, response_schema = load_packed_templates(list(pdf_parts))
+        contents = []
+        for document_id, part in pdf_parts.items():
+            contents.extend([Part.from_text(f"Document ID: {document_id}"), part])
+        contents.append(user_instruction)
+        with telemetry_context(step='single', packed=len(pdf_parts)):
+            response = generate_routed(system_instruction, contents, response_schema, step='single')
+        if not isinstance(response, dict):
+            raise ValueError(f"Expected an object keyed by document ID, got {type(response).__name__}")
+
+        outputs = {}
+        for document_id, output in response.items():
+            if document_id not in output_paths or not isinstance(output, dict) or not isinstance(output.get('metrics'), list):
+                logger.warning(f"Ignoring unexpected entry {document_id} in packed response")
+                continue
+            save_json(output, output_paths[document_id])
+            outputs[document_id] = output
+        logger.info(f"Packed LLM extraction returned {len(outputs)} of {len(pdf_parts)} documents")
+        return outputs
     except Exception as e:
-        logger.error(f"Error in LLM extraction: {e}")
+        logger.error(f"Error in packed LLM extraction: {e}")
         raise  # Re-raise the exception after logging
 
 
-def run(file_name: str) -> None:
+def run_packed(file_names: List[str], pages: Optional[Dict[str, Optional[int]]] = None) -> List[str]:
     """
-    Run the extraction process on a specified PDF file.
+    Run the extraction process on several small PDF files with one model request.
+
+    Each document gets the same `out.txt` and JSONL files as with `run`, and a 'run' event
+    of its own whose latency is its share of the pack's (see `pack_shares`); the share is
+    recorded with the event so that the pack's calls and tokens can be split the same way.
+    Documents missing from the response, or every document if the packed request fails,
+    are extracted on their own with `run`.
 
     Args:
-        file_name (str): The name of the PDF file to process.
+        file_names (List[str]): The names of the PDF files to process.
+        pages (Optional[Dict[str, Optional[int]]]): Page counts already read, keyed by document ID; missing ones are counted.
 
-    Raises:
-        Exception: If any error occurs during the process, it is logged and re-raised.
+    Returns:
+        List[str]: The documents that could not be extracted, packed or on their own.
     """
+    logger.info(f"Running packed extraction for files: {file_names}")
+    outputs: Dict[str, Dict[str, Any]] = {}
+    start_time = time.time()
     try:
-        logger.info(f"Running extraction for file: {file_name}")
-        file_path = os.path.join(config.DATA_DIR, f'docs/{file_name}.pdf')
-        pdf_bytes = load_binary_file(file_path)
-        pdf_parts = Part.from_data(data=pdf_bytes, mime_type='application/pdf')
-        output_path = os.path.join(OUTPUT_DIR, f'single_step/{file_name}/out.txt')
-        start_time = time.time()
-        
-        # Run the LLM extraction
-        llm_extract(config.TEXT_GEN_MODEL_NAME, pdf_parts, output_path)
-        
-        # Convert the output to JSONL format
-        convert_json_to_jsonl(output_path, os.path.join(VALIDATION_DIR, f'generated/single_step/{file_name}.jsonl'), workflow='single_step')
-        
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        logger.info(f"Extraction process completed successfully in {elapsed_time:.2f} seconds")
+        with contextlib.ExitStack() as stack:
+            for file_name in sorted(file_names):
+                stack.enter_context(document_lock(file_name, workflow='single_step'))
+            # Calls of the packed request are attributed to the pack as a whole
+            pack_id = f"pack-{uuid.uuid4().hex[:8]}"
+            stack.enter_context(telemetry_context(workflow='single_step', file_name=pack_id, run_id=uuid.uuid4().hex))
+            stack.enter_context(profile_run())
+
+            file_paths = {file_name: os.path.join(config.DATA_DIR, f'docs/{file_name}.pdf') for file_name in file_names}
+            shares = pack_shares({
+                file_name: (pages or {}).get(file_name) or count_pages(file_path)
+                for file_name, file_path in file_paths.items()
+            })
+            pdf_parts = {
+                file_name: Part.from_data(data=load_binary_file(upload_path(file_path)), mime_type='application/pdf')
+                for file_name, file_path in file_paths.items()
+            }
+            output_paths = {file_name: os.path.join(OUTPUT_DIR, f'single_step/{file_name}/out.txt') for file_name in file_names}
+            outputs = llm_extract_packed(pdf_parts, output_paths)
+
+            elapsed_time = time.time() - start_time
+            for file_name, response in list(outputs.items()):
+                try:
+                    with run_context('single_step', file_name):
+                        if config.VERIFICATION_ENABLED:
+                            mark_rows(file_paths[file_name], response['metrics'])
+                        save_jsonl(response, os.path.join(VALIDATION_DIR, f'generated/single_step/{file_name}.jsonl'), workflow='single_step')
+                        record_event('run', latency=elapsed_time * shares[file_name], status='ok', pack=pack_id, packed=len(file_names), share=shares[file_name])
+                except Exception as e:
+                    logger.error(f"Error writing packed output of {file_name}: {e}")
+                    del outputs[file_name]
+            logger.info(f"Packed extraction of {len(outputs)} documents completed in {elapsed_time:.2f} seconds")
     except Exception as e:
-        logger.error(f"Error in run process: {e}")
-        raise  # Re-raise the exception after logging
+        logger.error(f"Error in packed run process, extracting the documents on their own: {e}")
+
+    failed = []
+    for file_name in file_names:
+        if file_name in outputs:
+            continue
+        try:
+            run(file_name)
+        except Exception:
+            failed.append(file_name)
+    return failed
 
 
 if __name__ == '__main__':
@@ -0,0 +1,380 @@
+from src.pipeline.workflows import get_workflow_runner
+from src.pipeline.single_step import run_packed
+from src.pipeline.single_step import pack_shares
+from src.pipeline.single_step import plan_packs
+from google.api_core import exceptions as google_exceptions
+from src.utils.deadline import run_with_deadline
+from src.utils.telemetry import record_event
+from src.utils.telemetry import run_context
+from src.utils.deadline import is_timeout
+from src.utils.breaker import CircuitOpenError
+from src.utils.llm import circuit_breaker
+from src.utils.llm import FAILOVER_ERRORS
+from src.utils.llm import get_cache_mode
+from src.utils.llm import rate_limiter
+from src.pipeline.validation.schedule import collect_features
+from src.pipeline.validation.schedule import compact_history
+from src.pipeline.validation.schedule import order_documents
+from src.pipeline.validation.schedule import record_run
+from src.pipeline.validation.parking import unpark
+from src.pipeline.validation.parking import park
+from src.utils.dedup import materialize_duplicates
+from src.utils.dedup import deduplicate
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+from typing import List
+from typing import Dict
+from typing import Any
+import asyncio
+import time
+import sys
+import os
+
+
+VALIDATION_DIR = os.path.join(config.DATA_DIR, 'validation')
+
+# Exit code of `cli.py extract` when documents failed because the model backend was unavailable
+EXIT_BACKEND_UNAVAILABLE = 75
+
+
+async def run_in_subprocess(workflow: str, file_name: str, timeout: Optional[float], rate_limit: Optional[float]) -> None:
+    """
+    Extract a document in a subprocess of the CLI, killing it at the deadline.
+
+    Unlike a worker thread, a subprocess can be stopped at once, closing its connections
+    and freeing its worker for the next document.
+
+    Args:
+        workflow (str): The workflow name.
+        file_name (str): The document ID.
+        timeout (Optional[float]): Seconds before the subprocess is killed, or None for no limit.
+        rate_limit (Optional[float]): The subprocess's share of the model call rate, in calls per minute.
+
+    Raises:
+        google_exceptions.DeadlineExceeded: If the subprocess was killed at the deadline.
+        google_exceptions.ServiceUnavailable: If the extraction failed because the backend was unavailable.
+        RuntimeError: If the extraction failed.
+    """
+    command = [sys.executable, '-m', 'src.cli', 'extract', '--workflow', workflow, '--cache-mode', get_cache_mode()]
+    if rate_limit:
+        command.extend(['--rate-limit', str(rate_limit)])
+    process = await asyncio.create_subprocess_exec(*command, file_name)
+    try:
+        code = await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        raise google_exceptions.DeadlineExceeded(f"Extraction of {file_name} did not finish within {timeout:g} seconds") from None
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if code == EXIT_BACKEND_UNAVAILABLE:
+        raise google_exceptions.ServiceUnavailable(f"Extraction of {file_name} failed because the model backend was unavailable")
+    if code != 0:
+        raise RuntimeError(f"Extraction subprocess exited with code {code}")
+
+
+def workflow_concurrency(workflow: str, default: Optional[int] = None) -> int:
+    """
+    Get the number of documents of a workflow processed concurrently.
+
+    Args:
+        workflow (str): The workflow name.
+        default (Optional[int]): The concurrency when `batch.workflow_concurrency` has no entry for the workflow; defaults to `batch.concurrency`.
+
+    Returns:
+        int: The configured (or tuned) concurrency.
+    """
+    return config.BATCH_WORKFLOW_CONCURRENCY.get(workflow) or default or config.BATCH_CONCURRENCY
+
+
+def is_completed(workflow: str, file_name: str) -> bool:
+    """
+    Check whether a document already has a final extraction for a workflow.
+
+    Final JSONL files are written atomically, so their presence means the run finished.
+
+    Args:
+        workflow (str): The workflow name.
+        file_name (str): The name of the PDF file (without extension).
+
+    Returns:
+        bool: True if the document's JSONL output exists.
+    """
+    return os.path.exists(os.path.join(VALIDATION_DIR, f'generated/{workflow}/{file_name}.jsonl'))
+
+
+class Progress:
+    """
+    Tracks batch progress and reports throughput and ETA.
+    """
+
+    def __init__(self, total: Optional[int]):
+        """
+        Initialize the progress tracker.
+
+        Args:
+            total (Optional[int]): The number of documents, or None while it is unknown (streamed input).
+        """
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.parked = 0
+        self.start_time = time.monotonic()
+
+    def summary(self) -> str:
+        """
+        Format the current throughput and ETA.
+
+        Returns:
+            str: A one-line progress summary.
+        """
+        elapsed = time.monotonic() - self.start_time
+        finished = self.done + self.failed
+        throughput = finished / elapsed * 60 if elapsed else 0.0
+        total = '?' if self.total is None else str(self.total)
+        eta = '?'
+        if self.total is not None and finished:
+            eta = f"{(self.total - finished) * elapsed / finished:.0f}s"
+        parked = f", parked {self.parked}" if self.parked else ''
+        return f"[{finished}/{total}] ok {self.done}, failed {self.failed}{parked} | {throughput:.2f} docs/min | elapsed {elapsed:.0f}s | ETA {eta}"
+
+
+async def report_progress(progress: Progress, interval: float) -> None:
+    """
+    Print the progress summary periodically until cancelled.
+
+    Args:
+        progress (Progress): The progress tracker.
+        interval (float): Seconds between reports.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        print(progress.summary(), file=sys.stderr, flush=True)
+
+
+async def run_batch(
+    workflow: str,
+    file_names: Iterable[str],
+    concurrency: int,
+    resume: bool = False,
+    directory: Optional[str] = None,
+    on_result: Optional[Callable[[str, Any], None]] = None,
+    progress_interval: Optional[float] = None,
+    order: Optional[str] = None,
+    deadlines: Optional[Dict[str, float]] = None,
+    on_failure: Optional[Callable[[str, str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Run a workflow over many documents with a fixed number of concurrent workers.
+
+    Documents are pulled from the input as workers free up, so the input may be a stream
+    (e.g. IDs read from stdin) whose length is unknown upfront. When the input is a list,
+    duplicate documents are processed once and their outputs materialised afterwards, and
+    the documents are started in the scheduled order (streams keep their arrival order).
+    Each run's latency is appended to the history log used to estimate document costs, and
+    the log is folded into the history store when the batch ends.
+    Document runs are bounded by `timeouts.document_timeout`: in a worker thread their model
+    calls are cut off at the deadline, in a subprocess (`timeouts.isolation: process`) the
+    subprocess is killed. Timed-out documents are recorded as 'run' events with status
+    'timeout' and retried after the rest of the batch, up to `timeouts.retries` times.
+    While the model backend's circuit breaker is open, documents are parked in a persistent
+    store instead of failing, and workers wait for the breaker to close (at most
+    `breaker.max_wait` seconds) before running them; documents still parked then are left
+    for a later `batch --parked` run.
+    With packing enabled, small single-step documents of a list input are grouped into packs
+    that one worker extracts with a single model request (bounded by the per-call timeout only).
+
+    Args:
+        workflow (str): The workflow name.
+        file_names (Iterable[str]): The documents to process (file names without extension).
+        concurrency (int): The number of documents processed concurrently.
+        resume (bool): Skip documents that already have a final extraction.
+        directory (Optional[str]): The directory containing the PDFs. Defaults to the docs directory.
+        on_result (Optional[Callable[[str, Any], None]]): Called with each successful document and its run result.
+        progress_interval (Optional[float]): Seconds between progress reports; None disables them.
+        order (Optional[str]): The schedule order (fifo, lpt or deadline); defaults to the configured order.
+        deadlines (Optional[Dict[str, float]]): Per-document deadlines in seconds from the start, for the deadline order.
+        on_failure (Optional[Callable[[str, str], None]]): Called at the end with each document that was not
+            processed and why: 'error', 'timeout' (after the retries) or 'parked'.
+
+    Returns:
+        Dict[str, Any]: The run result of each successfully processed document.
+    """
+    directory = directory or os.path.join(config.DATA_DIR, 'docs')
+    run = get_workflow_runner(workflow)
+
+    duplicate_groups: Dict[str, List[str]] = {}
+    # Size and page count of each listed document, read once for scheduling, packing and the history
+    features: Dict[str, Dict[str, Optional[int]]] = {}
+    if isinstance(file_names, list):
+        file_names, duplicate_groups = deduplicate(directory, file_names)
+        features = await asyncio.to_thread(collect_features, directory, file_names)
+        file_names = await asyncio.to_thread(order_documents, workflow, directory, file_names, order or config.BATCH_SCHEDULE, concurrency, deadlines, features)
+    progress = Progress(len(file_names) if isinstance(file_names, list) else None)
+    units: Iterable[Any] = file_names
+    pages = {file_name: feature['pages'] for file_name, feature in features.items()}
+    if workflow == 'single_step' and config.PACKING_ENABLED and isinstance(file_names, list):
+        units = await asyncio.to_thread(plan_packs, file_names, directory, pages)
+
+    # Feed documents through a bounded queue so streamed input is consumed lazily
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: Dict[str, Any] = {}
+
+    async def produce() -> None:
+        iterator = iter(units)
+        count = 0
+        while True:
+            unit = await asyncio.to_thread(next, iterator, None)
+            if unit is None:
+                break
+            pack = []
+            for file_name in unit if isinstance(unit, list) else [unit]:
+                file_name = file_name.strip()
+                if not file_name:
+                    continue
+                count += 1
+                if resume and is_completed(workflow, file_name):
+                    logger.info(f"Skipping already extracted file: {file_name}")
+                    progress.done += 1
+                    continue
+                pack.append(file_name)
+            if len(pack) > 1:
+                await pending.put(pack)
+            elif pack:
+                await pending.put(pack[0])
+        progress.total = count
+        for _ in range(concurrency):
+            await pending.put(None)
+
+    timeout = config.DOCUMENT_TIMEOUT
+    timed_out: List[str] = []
+    # Final outcome of each document that did not succeed; a retried success removes it
+    failures: Dict[str, str] = {}
+
+    async def run_document(file_name: str) -> Any:
+        if config.TIMEOUT_ISOLATION == 'process':
+            rate_limit = rate_limiter.rate * 60 / concurrency if rate_limiter.rate else None
+            return await run_in_subprocess(workflow, file_name, timeout, rate_limit)
+        # Wrap the synchronous function in a coroutine; the deadline reaches its model calls
+        return await asyncio.to_thread(run_with_deadline, run, timeout, file_name)
+
+    async def work(queue: asyncio.Queue) -> None:
+        while True:
+            file_name = await queue.get()
+            if file_name is None:
+                return
+            if isinstance(file_name, list):
+                await work_pack(file_name)
+            else:
+                await work_document(file_name)
+
+    async def wait_for_backend(file_name: str) -> bool:
+        if circuit_breaker.state == 'closed':
+            return True
+        await asyncio.to_thread(park, workflow, file_name, 'model backend circuit open')
+        if await asyncio.to_thread(circuit_breaker.wait_closed, config.BREAKER_MAX_WAIT):
+            return True
+        progress.parked += 1
+        failures[file_name] = 'parked'
+        return False
+
+    async def work_document(file_name: str) -> None:
+        while True:
+            if not await wait_for_backend(file_name):
+                return
+            start_time = time.monotonic()
+            try:
+                logger.info(f"Processing file: {file_name}")
+                results[file_name] = await run_document(file_name)
+                failures.pop(file_name, None)
+                if config.TIMEOUT_ISOLATION == 'process':
+                    circuit_breaker.record(ok=True)
+                await asyncio.to_thread(record_run, workflow, directory, file_name, time.monotonic() - start_time, features.get(file_name))
+                await asyncio.to_thread(unpark, workflow, file_name)
+                progress.done += 1
+                logger.info(f"Finished processing file: {file_name}")
+                if on_result:
+                    on_result(file_name, results[file_name])
+                return
+            except Exception as e:
+                if config.TIMEOUT_ISOLATION == 'process' and isinstance(e, google_exceptions.ServiceUnavailable):
+                    # The subprocess's own breaker is lost with it; count its outcome here
+                    circuit_breaker.record(ok=False)
+                if circuit_breaker.state != 'closed' and isinstance(e, (CircuitOpenError,) + FAILOVER_ERRORS):
+                    logger.warning(f"Model backend unavailable while processing {file_name}, parking it: {e}")
+                    continue
+                progress.failed += 1
+                failures[file_name] = 'timeout' if is_timeout(e) else 'error'
+                if is_timeout(e):
+                    timed_out.append(file_name)
+                    with run_context(workflow, file_name):
+                        record_event('run', latency=time.monotonic() - start_time, status='timeout', timeout=timeout)
+                    logger.error(f"Timed out processing file {file_name}: {e}")
+                else:
+                    logger.error(f"Error processing file {file_name}: {e}")
+                return
+
+    async def work_pack(pack: List[str]) -> None:
+        logger.info(f"Processing pack of {len(pack)} files: {pack}")
+        start_time = time.monotonic()
+        try:
+            failed = await asyncio.to_thread(run_packed, pack, pages)
+        except Exception as e:
+            logger.error(f"Error processing pack {pack}: {e}")
+            failed = pack
+        latency = time.monotonic() - start_time
+        # Each member is charged its share of the pack, not the pack's whole wall time
+        shares = pack_shares({file_name: pages.get(file_name) for file_name in pack})
+        for file_name in pack:
+            if file_name in failed and circuit_breaker.state != 'closed':
+                # Failed because of the outage: park and run it on its own once the backend recovers
+                await work_document(file_name)
+                continue
+            if file_name in failed:
+                progress.failed += 1
+                failures[file_name] = 'error'
+                logger.error(f"Error processing file {file_name}")
+                continue
+            results[file_name] = None
+            await asyncio.to_thread(record_run, workflow, directory, file_name, latency * shares[file_name], features.get(file_name))
+            await asyncio.to_thread(unpark, workflow, file_name)
+            progress.done += 1
+            if on_result:
+                on_result(file_name, None)
+
+    reporter = asyncio.create_task(report_progress(progress, progress_interval)) if progress_interval else None
+    try:
+        await asyncio.gather(produce(), *(work(pending) for _ in range(concurrency)))
+        for attempt in range(1, config.TIMEOUT_RETRIES + 1):
+            if not timed_out:
+                break
+            logger.warning(f"Retrying {len(timed_out)} timed-out documents (retry {attempt} of {config.TIMEOUT_RETRIES})")
+            retries: asyncio.Queue = asyncio.Queue()
+            for file_name in timed_out + [None] * concurrency:
+                retries.put_nowait(file_name)
+            progress.failed -= len(timed_out)
+            timed_out.clear()
+            await asyncio.gather(*(work(retries) for _ in range(concurrency)))
+    finally:
+        if reporter:
+            reporter.cancel()
+        await asyncio.to_thread(compact_history)
+
+    materialize_duplicates(workflow, duplicate_groups)
+    if on_result:
+        for canonical, duplicates in duplicate_groups.items():
+            if canonical in results:
+                for duplicate in duplicates:
+                    on_result(duplicate, results[canonical])
+    if on_failure:
+        for file_name, reason in failures.items():
+            on_failure(file_name, reason)
+            for duplicate in duplicate_groups.get(file_name, []):
+                on_failure(duplicate, reason)
+    logger.info(f"Batch {workflow} finished: {progress.summary()}")
+    if progress_interval:
+        print(progress.summary(), file=sys.stderr, flush=True)
+    return results
@@ -0,0 +1,75 @@
+from src.pipeline.validation.batch import workflow_concurrency
+from src.pipeline.validation.batch import run_batch
+from src.utils.io import get_pdf_file_names
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from typing import Optional
+from typing import List
+from typing import Dict
+from typing import Any
+import asyncio
+import os
+
+
+def write_resolution_summary(reports: List[Dict[str, Any]], output_path: str) -> None:
+    """
+    Write the per-document and corpus-level share of metrics resolved by each path.
+
+    Args:
+        reports (List[Dict[str, Any]]): The resolution reports of the processed documents.
+        output_path (str): The path of the summary text file.
+    """
+    lines = [f"{report['file_name']}: rules {report['rules']}, llm {report['llm']}, llm calls {report['llm_calls']}" for report in reports]
+    rules = sum(report['rules'] for report in reports)
+    llm = sum(report['llm'] for report in reports)
+    total = rules + llm
+    rules_share = rules / total * 100 if total else 0
+    llm_share = llm / total * 100 if total else 0
+    lines.append(f"TOTAL: rules {rules} ({rules_share:.2f}%), llm {llm} ({llm_share:.2f}%), "
+                 f"llm calls {sum(report['llm_calls'] for report in reports)}")
+    atomic_write(output_path, '\n'.join(lines) + '\n')
+    logger.info(f"Rules resolved {rules_share:.2f}% of {total} metrics; summary written to {output_path}")
+
+
+async def run(directory: str, concurrency: Optional[int] = None) -> None:
+    """
+    Run the hybrid data extraction process on PDF files in the specified directory concurrently.
+
+    Args:
+        directory (str): The directory path where PDF files are located.
+        concurrency (Optional[int]): The number of files to process concurrently. Defaults to the
+            workflow's `batch.workflow_concurrency` entry, or 5.
+    """
+    try:
+        # Convert generator to list
+        pdf_files = list(get_pdf_file_names(directory))
+        logger.info(f"Found {len(pdf_files)} PDF files in the directory.")
+
+        if not pdf_files:
+            logger.warning("No PDF files found in the specified directory.")
+            return
+
+        # Duplicates are processed once and their outputs materialised by the batch runner
+        reports = await run_batch('hybrid', pdf_files, concurrency or workflow_concurrency('hybrid', 5), directory=directory)
+        write_resolution_summary(list(reports.values()), os.path.join(config.DATA_DIR, 'evaluation/hybrid/resolution.txt'))
+
+    except Exception as e:
+        logger.error(f"Error retrieving or processing PDF files from directory {directory}: {e}")
+
+
+async def main() -> None:
+    """
+    Main entry point for the asynchronous hybrid PDF processing script.
+    """
+    try:
+        directory = os.path.join(config.DATA_DIR, 'docs/')
+        logger.info(f"Starting parallel hybrid PDF processing in directory: {directory}")
+        await run(directory)
+        logger.info("Hybrid PDF processing completed successfully.")
+    except Exception as e:
+        logger.critical(f"Critical failure in main execution: {e}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
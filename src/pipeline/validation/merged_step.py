@@ -0,0 +1,50 @@
+from src.pipeline.validation.batch import workflow_concurrency
+from src.pipeline.validation.batch import run_batch
+from src.utils.io import get_pdf_file_names
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Optional
+import asyncio
+import os
+
+
+async def run(directory: str, concurrency: Optional[int] = None) -> None:
+    """
+    Run the merged data extraction process on PDF files in the specified directory concurrently.
+
+    Args:
+        directory (str): The directory path where PDF files are located.
+        concurrency (Optional[int]): The number of files to process concurrently. Defaults to the
+            workflow's `batch.workflow_concurrency` entry, or 5.
+    """
+    try:
+        # Convert generator to list
+        pdf_files = list(get_pdf_file_names(directory))
+        logger.info(f"Found {len(pdf_files)} PDF files in the directory.")
+
+        if not pdf_files:
+            logger.warning("No PDF files found in the specified directory.")
+            return
+
+        # Duplicates are processed once and their outputs materialised by the batch runner
+        await run_batch('merged_step', pdf_files, concurrency or workflow_concurrency('merged_step', 5), directory=directory)
+
+    except Exception as e:
+        logger.error(f"Error retrieving or processing PDF files from directory {directory}: {e}")
+
+
+async def main() -> None:
+    """
+    Main entry point for the asynchronous merged PDF processing script.
+    """
+    try:
+        directory = os.path.join(config.DATA_DIR, 'docs/')
+        logger.info(f"Starting parallel merged PDF processing in directory: {directory}")
+        await run(directory)
+        logger.info("Merged PDF processing completed successfully.")
+    except Exception as e:
+        logger.critical(f"Critical failure in main execution: {e}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
\ No newline at end of file
@@ -1,35 +1,21 @@
-from src.pipeline.multi_step import run as multi_step_run
+from src.pipeline.validation.batch import workflow_concurrency
+from src.pipeline.validation.batch import run_batch
 from src.utils.io import get_pdf_file_names
 from src.config.logging import logger
 from src.config.setup import config
+from typing import Optional
 import asyncio
 import os
 
 
-async def process_file(file_name: str) -> None:
-    """
-    Process a single PDF file asynchronously using the multi-step pipeline.
-
-    Args:
-        file_name (str): The name of the PDF file to process.
-    """
-    try:
-        logger.info(f"Processing file: {file_name}")
-        # Wrap the synchronous function in a coroutine
-        await asyncio.to_thread(multi_step_run, file_name)
-        logger.info(f"Finished processing file: {file_name}")
-        print('-' * 200)
-    except Exception as e:
-        logger.error(f"Error processing file {file_name}: {e}")
-
-
-async def run(directory: str, concurrency: int = 3) -> None:
+async def run(directory: str, concurrency: Optional[int] = None) -> None:
     """
     Run the multi-step data extraction process on PDF files in the specified directory concurrently.
 
     Args:
         directory (str): The directory path where PDF files are located.
-        concurrency (int): The number of files to process concurrently. Defaults to 5.
+        concurrency (Optional[int]): The number of files to process concurrently. Defaults to the
+            workflow's `batch.workflow_concurrency` entry, or 3.
     """
     try:
         # Convert generator to list
@@ -40,18 +26,8 @@ async def run(directory: str, concurrency: int = 3) -> None:
             logger.warning("No PDF files found in the specified directory.")
             return
 
-        # Create a semaphore to limit concurrency
-        semaphore = asyncio.Semaphore(concurrency)
-
-        async def process_with_semaphore(file_name: str) -> None:
-            async with semaphore:
-                await process_file(file_name)
-
-        # Create tasks for each file
-        tasks = [asyncio.create_task(process_with_semaphore(file)) for file in pdf_files]
-
-        # Wait for all tasks to complete
-        await asyncio.gather(*tasks)
+        # Duplicates are processed once and their outputs materialised by the batch runner
+        await run_batch('multi_step', pdf_files, concurrency or workflow_concurrency('multi_step', 3), directory=directory)
 
     except Exception as e:
         logger.error(f"Error retrieving or processing PDF files from directory {directory}: {e}")
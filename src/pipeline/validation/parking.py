@@ -0,0 +1,81 @@
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from typing import List
+from typing import Dict
+from typing import Any
+import threading
+import json
+import time
+import os
+
+
+PARKED_PATH = os.path.join(config.DATA_DIR, 'index/parked.json')
+
+_parked_lock = threading.Lock()
+
+
+def load_parked() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Load the store of documents parked while the model backend was unavailable.
+
+    Returns:
+        Dict[str, Dict[str, Dict[str, Any]]]: Per workflow and document ID, when and why it was parked.
+    """
+    if not os.path.exists(PARKED_PATH):
+        return {}
+    try:
+        with open(PARKED_PATH, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (IOError, json.JSONDecodeError) as e:
+        logger.error(f"Error loading parked store {PARKED_PATH}, starting a new one: {e}")
+        return {}
+
+
+def park(workflow: str, file_name: str, reason: str) -> None:
+    """
+    Park a document so that it is run once the backend recovers, in this or a later batch.
+
+    Args:
+        workflow (str): The workflow name.
+        file_name (str): The document ID.
+        reason (str): Why the document could not run.
+    """
+    with _parked_lock:
+        parked = load_parked()
+        entry = parked.setdefault(workflow, {}).get(file_name)
+        parked[workflow][file_name] = {'parked_at': (entry or {}).get('parked_at', time.time()), 'reason': reason}
+        atomic_write(PARKED_PATH, json.dumps(parked))
+    logger.warning(f"Parked {file_name} ({workflow}): {reason}")
+
+
+def unpark(workflow: str, file_name: str) -> None:
+    """
+    Remove a document from the parked store, e.g. once it ran.
+
+    Args:
+        workflow (str): The workflow name.
+        file_name (str): The document ID.
+    """
+    with _parked_lock:
+        parked = load_parked()
+        if file_name not in parked.get(workflow, {}):
+            return
+        del parked[workflow][file_name]
+        if not parked[workflow]:
+            del parked[workflow]
+        atomic_write(PARKED_PATH, json.dumps(parked))
+
+
+def parked_documents(workflow: str) -> List[str]:
+    """
+    List the parked documents of a workflow, oldest first.
+
+    Args:
+        workflow (str): The workflow name.
+
+    Returns:
+        List[str]: The document IDs.
+    """
+    entries = load_parked().get(workflow, {})
+    return sorted(entries, key=lambda file_name: entries[file_name]['parked_at'])
@@ -0,0 +1,259 @@
+from src.utils.telemetry import current_tags
+from src.utils.pdf import count_pages
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from typing import Optional
+from typing import List
+from typing import Dict
+from typing import Any
+import statistics
+import threading
+import json
+import os
+
+
+HISTORY_PATH = os.path.join(config.DATA_DIR, 'index/history.json')
+# Runs recorded since the store was last compacted, one JSON line each
+HISTORY_LOG_PATH = os.path.join(config.DATA_DIR, 'index/history.log.jsonl')
+SCHEDULE_ORDERS = ('fifo', 'lpt', 'deadline')
+
+# Weight of the newest run in a document's smoothed latency
+LATENCY_SMOOTHING = 0.5
+
+_history_lock = threading.Lock()
+
+
+def _apply_run(history: Dict[str, Dict[str, Dict[str, Any]]], run: Dict[str, Any]) -> None:
+    """
+    Fold one recorded run into the history, smoothing the document's latency.
+
+    Args:
+        history (Dict[str, Dict[str, Dict[str, Any]]]): The history, updated in place.
+        run (Dict[str, Any]): The run's workflow, file_name, latency, pages and size.
+    """
+    latency = run['latency']
+    entry = history.setdefault(run['workflow'], {}).get(run['file_name'])
+    if entry and entry.get('latency') is not None:
+        latency = LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * entry['latency']
+    history[run['workflow']][run['file_name']] = {
+        'latency': latency, 'pages': run['pages'], 'size': run['size'], 'runs': (entry or {}).get('runs', 0) + 1
+    }
+
+
+def load_history() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Load the per-document history store, including the runs logged since its last compaction.
+
+    Returns:
+        Dict[str, Dict[str, Dict[str, Any]]]: Per workflow and document ID, the smoothed
+        latency, page count and size of past runs.
+    """
+    history = {}
+    if os.path.exists(HISTORY_PATH):
+        try:
+            with open(HISTORY_PATH, 'r', encoding='utf-8') as file:
+                history = json.load(file)
+        except (IOError, json.JSONDecodeError) as e:
+            logger.error(f"Error loading history store {HISTORY_PATH}, starting a new one: {e}")
+    if os.path.exists(HISTORY_LOG_PATH):
+        with open(HISTORY_LOG_PATH, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    _apply_run(history, json.loads(line))
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # A line cut short by a crash; the runs before and after it still count
+                    logger.warning(f"Skipping unreadable line in {HISTORY_LOG_PATH}")
+    return history
+
+
+def record_latency(workflow: str, file_name: str, latency: float, pages: Optional[int], size: Optional[int]) -> None:
+    """
+    Record a document's run latency in the history store.
+
+    The run is appended to the history log rather than rewriting the store, so recording
+    costs the same however many documents the store holds; `compact_history` folds the
+    log into the store.
+
+    Args:
+        workflow (str): The workflow name.
+        file_name (str): The document ID.
+        latency (float): The wall time of the run in seconds.
+        pages (Optional[int]): The document's page count, if known.
+        size (Optional[int]): The document's size in bytes, if known.
+    """
+    run = {'workflow': workflow, 'file_name': file_name, 'latency': latency, 'pages': pages, 'size': size}
+    with _history_lock:
+        os.makedirs(os.path.dirname(HISTORY_LOG_PATH), exist_ok=True)
+        with open(HISTORY_LOG_PATH, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(run) + '\n')
+
+
+def compact_history() -> None:
+    """
+    Fold the history log into the store and start a new log.
+    """
+    with _history_lock:
+        if not os.path.exists(HISTORY_LOG_PATH):
+            return
+        try:
+            atomic_write(HISTORY_PATH, json.dumps(load_history()))
+            os.remove(HISTORY_LOG_PATH)
+        except Exception as e:
+            # The log is still read on load; compaction only keeps it short
+            logger.error(f"Error compacting history store {HISTORY_PATH}: {e}")
+
+
+def document_features(directory: str, file_name: str) -> Dict[str, Optional[int]]:
+    """
+    Read the size and page count of a document.
+
+    Args:
+        directory (str): The directory containing the PDF files.
+        file_name (str): The document ID.
+
+    Returns:
+        Dict[str, Optional[int]]: The 'size' in bytes and the number of 'pages' (None when unreadable).
+    """
+    file_path = os.path.join(directory, f'{file_name}.pdf')
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return {'size': None, 'pages': None}
+    return {'size': size, 'pages': count_pages(file_path)}
+
+
+def collect_features(directory: str, file_names: List[str]) -> Dict[str, Dict[str, Optional[int]]]:
+    """
+    Read the size and page count of each document of a batch.
+
+    Args:
+        directory (str): The directory containing the PDF files.
+        file_names (List[str]): The document IDs.
+
+    Returns:
+        Dict[str, Dict[str, Optional[int]]]: The features of each document (see `document_features`).
+    """
+    return {file_name: document_features(directory, file_name) for file_name in file_names}
+
+
+def record_run(workflow: str, directory: str, file_name: str, latency: float, features: Optional[Dict[str, Optional[int]]] = None) -> None:
+    """
+    Record a finished run together with the document's size and page count.
+
+    Runs of a tuning sweep are not recorded: their latencies are scaled and measured under
+    deliberately varied contention, so they would skew the estimates of real batches.
+
+    Args:
+        workflow (str): The workflow name.
+        directory (str): The directory containing the PDF files.
+        file_name (str): The document ID.
+        latency (float): The wall time of the run in seconds.
+        features (Optional[Dict[str, Optional[int]]]): The features read when the batch was
+            scheduled; read from the document if not given.
+    """
+    if 'tuning' in current_tags():
+        return
+    try:
+        features = features or document_features(directory, file_name)
+        record_latency(workflow, file_name, latency, features['pages'], features['size'])
+    except Exception as e:
+        # The history only improves scheduling; never fail a document because of it
+        logger.error(f"Error recording run history of {file_name}: {e}")
+
+
+def estimate_costs(workflow: str, features: Dict[str, Dict[str, Optional[int]]]) -> Dict[str, float]:
+    """
+    Estimate the run time of each document.
+
+    A document with history uses its smoothed past latency. Otherwise the cost is its page
+    count (or its size, converted with the median bytes per page of the batch) times the
+    median seconds per page of the workflow's history. Without any history the estimate is
+    in pages, which still orders documents correctly relative to each other.
+
+    Args:
+        workflow (str): The workflow name.
+        features (Dict[str, Dict[str, Optional[int]]]): The size and page count of each document.
+
+    Returns:
+        Dict[str, float]: The estimated cost of each document.
+    """
+    history = load_history().get(workflow, {})
+    per_page = [entry['latency'] / entry['pages'] for entry in history.values() if entry.get('pages')]
+    seconds_per_page = statistics.median(per_page) if per_page else None
+    page_sizes = [feature['size'] / feature['pages'] for feature in features.values() if feature['size'] and feature['pages']]
+    bytes_per_page = statistics.median(page_sizes) if page_sizes else None
+
+    costs = {}
+    for file_name, feature in features.items():
+        pages = feature['pages']
+        if pages is None and feature['size'] and bytes_per_page:
+            pages = feature['size'] / bytes_per_page
+        if file_name in history and seconds_per_page is not None:
+            costs[file_name] = history[file_name]['latency']
+        elif seconds_per_page is not None:
+            costs[file_name] = (pages or 1) * seconds_per_page
+        else:
+            costs[file_name] = float(pages or 1)
+    return costs
+
+
+def order_documents(
+    workflow: str,
+    directory: str,
+    file_names: List[str],
+    order: str,
+    concurrency: int,
+    deadlines: Optional[Dict[str, float]] = None,
+    features: Optional[Dict[str, Dict[str, Optional[int]]]] = None
+) -> List[str]:
+    """
+    Order a batch so that its total wall time is short at the given concurrency.
+
+    - 'fifo' keeps the input order.
+    - 'lpt' starts the longest documents first, so a large report does not start last and
+      set the makespan alone.
+    - 'deadline' starts documents with the least slack first (deadline in seconds from the
+      start of the batch minus the estimated cost); documents without a deadline follow in
+      longest-first order.
+
+    Workers pull the next document from the shared queue as soon as they finish, so no
+    slot stays idle while documents remain.
+
+    Args:
+        workflow (str): The workflow name.
+        directory (str): The directory containing the PDF files.
+        file_names (List[str]): The documents to order.
+        order (str): One of SCHEDULE_ORDERS.
+        concurrency (int): The number of documents processed concurrently.
+        deadlines (Optional[Dict[str, float]]): Deadlines in seconds from the start of the batch.
+        features (Optional[Dict[str, Dict[str, Optional[int]]]]): The documents' features, if
+            already read (see `collect_features`).
+
+    Returns:
+        List[str]: The documents in start order.
+
+    Raises:
+        ValueError: If the order is unknown.
+    """
+    if order not in SCHEDULE_ORDERS:
+        raise ValueError(f"Unknown schedule order: {order}. Expected one of {SCHEDULE_ORDERS}")
+    if order == 'fifo' or len(file_names) < 2:
+        return file_names
+
+    costs = estimate_costs(workflow, features or collect_features(directory, file_names))
+    longest_first = sorted(file_names, key=lambda file_name: costs[file_name], reverse=True)
+    if order == 'deadline':
+        deadlines = deadlines or {}
+        rank = {file_name: i for i, file_name in enumerate(longest_first)}
+        ordered = sorted(
+            file_names,
+            key=lambda file_name: (file_name not in deadlines, deadlines.get(file_name, 0) - costs[file_name], rank[file_name])
+        )
+    else:
+        ordered = longest_first
+
+    total = sum(costs.values())
+    logger.info(f"Scheduled {len(ordered)} documents ({order}); estimated cost {total:.1f}, "
+                f"lower bound on makespan {max(max(costs.values()), total / concurrency):.1f}")
+    return ordered
@@ -0,0 +1,556 @@
+from src.pipeline.validation.schedule import document_features
+from src.pipeline.validation.batch import run_batch
+from src.evaluate.regression import template_hashes
+from src.evaluate.regression import current_model
+from src.evaluate.regression import baseline_key
+from src.utils.telemetry import telemetry_context
+from src.utils.telemetry import record_event
+from src.utils.telemetry import load_events
+from src.utils.dedup import deduplicate
+from src.utils.llm import set_cache_mode
+from src.utils.llm import get_cache_mode
+from src.utils.llm import endpoint_pool
+from src.utils.llm import rate_limiter
+from src.utils.llm import Endpoint
+from src.utils.llm import hedging
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from typing import Generator
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+from typing import Any
+import numpy as np
+import contextlib
+import statistics
+import importlib
+import tempfile
+import asyncio
+import datetime
+import shutil
+import uuid
+import yaml
+import time
+import os
+
+
+TUNING_BACKENDS = ('local', 'real')
+
+# Share of the peak predicted throughput the recommended concurrency must reach; beyond it,
+# more concurrency mostly adds latency and load on the backend
+THROUGHPUT_TARGET = 0.95
+
+# Name of the local stand-in that replays recorded latencies during a sweep
+REPLAY_ENDPOINT = 'tuning-replay'
+
+# Modules whose output and validation directories a sweep redirects to a scratch directory
+OUTPUT_MODULES = (
+    'src.pipeline.single_step',
+    'src.pipeline.multi_step',
+    'src.pipeline.merged_step',
+    'src.pipeline.hybrid',
+    'src.pipeline.validation.batch'
+)
+
+
+def sample_documents(directory: str, file_names: List[str], size: int) -> List[str]:
+    """
+    Pick distinct documents spread evenly over the page counts of the corpus.
+
+    Duplicates are left out, since a batch runs them once and the sample would shrink.
+
+    Args:
+        directory (str): The directory containing the PDF files.
+        file_names (List[str]): The candidate document IDs.
+        size (int): The number of documents to pick.
+
+    Returns:
+        List[str]: The sampled document IDs, from the shortest to the longest.
+    """
+    file_names, _ = deduplicate(directory, file_names)
+    pages = {file_name: document_features(directory, file_name)['pages'] or 0 for file_name in file_names}
+    ordered = sorted(file_names, key=lambda file_name: (pages[file_name], file_name))
+    if size >= len(ordered):
+        return ordered
+    step = len(ordered) / size
+    return [ordered[int(index * step + step / 2)] for index in range(size)]
+
+
+def recorded_latencies() -> List[float]:
+    """
+    Collect the latencies of successful calls to the real backend from the telemetry.
+
+    Returns:
+        List[float]: The call latencies in seconds; replayed and cached calls are left out.
+    """
+    local = {endpoint.name for endpoint in endpoint_pool.endpoints if endpoint.local} | {REPLAY_ENDPOINT}
+    return [
+        event['latency'] for event in load_events('call')
+        if event.get('status') == 'ok' and event.get('endpoint') not in local and 'tuning' not in event
+    ]
+
+
+def replay_endpoint(latencies: List[float], time_scale: float) -> Endpoint:
+    """
+    Create the local stand-in of the backend used by a local sweep.
+
+    The stand-in replays responses recorded in the response cache after a latency drawn from
+    the recorded ones. Its quota is the combined quota of the configured endpoints, so that
+    the sweep hits the same ceiling as a real batch.
+
+    Args:
+        latencies (List[float]): The recorded call latencies in seconds.
+        time_scale (float): Factor applied to every latency (and inverse to every quota) to shorten the sweep.
+
+    Returns:
+        Endpoint: The local endpoint.
+    """
+    quotas = [endpoint.limiter.rate for endpoint in endpoint_pool.endpoints if not endpoint.local]
+    quota = sum(quotas) * 60 / time_scale if quotas and all(quotas) else None
+    return Endpoint(REPLAY_ENDPOINT, None, None, quota=quota, local=True, latencies=[latency * time_scale for latency in latencies])
+
+
+def percentile(values: List[float], percent: int) -> Optional[float]:
+    """
+    Compute a percentile of some values.
+
+    Args:
+        values (List[float]): The values.
+        percent (int): The percentile (1-99).
+
+    Returns:
+        Optional[float]: The percentile, or None without values.
+    """
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+@contextlib.contextmanager
+def scratch_outputs() -> Generator[str, None, None]:
+    """
+    Redirect the outputs and generated rows of the workflows to a scratch directory.
+
+    Trials rerun the sample with varying settings, and must not overwrite the outputs of
+    real runs. Documents are still read from their own directory. The scratch directory is
+    deleted afterwards.
+
+    Yields:
+        str: The scratch directory.
+    """
+    scratch = tempfile.mkdtemp(prefix='tuning-')
+    saved = {}
+    for name in OUTPUT_MODULES:
+        module = importlib.import_module(name)
+        for attribute, subdirectory in (('OUTPUT_DIR', 'output'), ('VALIDATION_DIR', 'validation')):
+            if hasattr(module, attribute):
+                saved[module, attribute] = getattr(module, attribute)
+                setattr(module, attribute, os.path.join(scratch, subdirectory))
+    try:
+        yield scratch
+    finally:
+        for (module, attribute), value in saved.items():
+            setattr(module, attribute, value)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def run_trial(
+    workflow: str,
+    file_names: List[str],
+    directory: str,
+    concurrency: int,
+    chunk_size: Optional[int],
+    hedged: bool,
+    time_scale: float = 1.0
+) -> Dict[str, Any]:
+    """
+    Run the sample once with one combination of settings and measure it.
+
+    Args:
+        workflow (str): The workflow name.
+        file_names (List[str]): The sampled documents.
+        directory (str): The directory containing the PDF files.
+        concurrency (int): The number of documents processed concurrently.
+        chunk_size (Optional[int]): Metrics per pipelined step 2 -> step 3 chain (multi-step), or None to run the steps sequentially.
+        hedged (bool): Whether slow calls are hedged.
+        time_scale (float): The factor applied to replayed latencies; measurements are converted back to real time.
+
+    Returns:
+        Dict[str, Any]: The settings, the documents completed and failed, the model calls, the
+        throughput in documents per minute and the p50 and p95 document latencies in seconds.
+    """
+    config.MULTI_STEP_PIPELINING = chunk_size is not None
+    if chunk_size is not None:
+        config.MULTI_STEP_PIPELINE_CHUNK_SIZE = chunk_size
+    hedging.enabled = hedged
+    # Each trial learns its own hedge delays, so earlier trials do not favour later ones
+    hedging.reset()
+
+    trial = uuid.uuid4().hex[:12]
+    start_time = time.monotonic()
+    with telemetry_context(tuning=trial):
+        results = asyncio.run(run_batch(workflow, list(file_names), concurrency, directory=directory))
+    wall_time = (time.monotonic() - start_time) / time_scale
+
+    latencies = [
+        event['latency'] / time_scale for event in load_events('run')
+        if event.get('tuning') == trial and event.get('status') == 'ok'
+    ]
+    calls = sum(1 for event in load_events('call') if event.get('tuning') == trial)
+    measurement = {
+        'concurrency': concurrency,
+        'chunk_size': chunk_size,
+        'hedging': hedged,
+        'documents': len(results),
+        'failed': len(set(file_names)) - len(results),
+        'calls': calls,
+        'wall_time': wall_time,
+        'throughput': len(results) / wall_time * 60 if wall_time else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95)
+    }
+    record_event('tuning', workflow=workflow, trial=trial, **measurement)
+    logger.info(f"Tuning trial {measurement}")
+    return measurement
+
+
+def fit_usl(points: List[Tuple[int, float]]) -> Optional[Dict[str, float]]:
+    """
+    Fit the Universal Scalability Law to measured throughputs.
+
+    The law models the throughput at concurrency N as X(N) = λN / (1 + σ(N - 1) + κN(N - 1)),
+    where λ is the throughput of a single worker, σ the contention (e.g. for a shared rate
+    limit) and κ the coherency cost. N / X(N) is linear in the coefficients, so they are
+    fitted by least squares; a negative σ or κ is dropped from the model and the rest refitted.
+
+    Args:
+        points (List[Tuple[int, float]]): Measured (concurrency, throughput) pairs.
+
+    Returns:
+        Optional[Dict[str, float]]: λ, σ and κ, or None with fewer than three concurrency levels.
+    """
+    points = [(n, x) for n, x in points if x > 0]
+    if len({n for n, _ in points}) < 3:
+        return None
+    n = np.array([n for n, _ in points], dtype=float)
+    y = n / np.array([x for _, x in points])
+    columns = {'sigma': n - 1, 'kappa': n * (n - 1)}
+    while True:
+        design = np.column_stack([np.ones_like(n)] + list(columns.values()))
+        coefficients = np.linalg.lstsq(design, y, rcond=None)[0]
+        fitted = dict(zip(columns, coefficients[1:]))
+        negative = [name for name, value in fitted.items() if value < 0]
+        if not negative:
+            break
+        del columns[negative[-1]]
+    if coefficients[0] <= 0:
+        return None
+    return {
+        'lambda': float(1 / coefficients[0]),
+        'sigma': float(fitted.get('sigma', 0.0) / coefficients[0]),
+        'kappa': float(fitted.get('kappa', 0.0) / coefficients[0])
+    }
+
+
+def predict_throughput(fit: Dict[str, float], concurrency: int) -> float:
+    """
+    Predict the throughput at a concurrency from a Universal Scalability Law fit.
+
+    Args:
+        fit (Dict[str, float]): λ, σ and κ as returned by `fit_usl`.
+        concurrency (int): The concurrency.
+
+    Returns:
+        float: The predicted documents per minute.
+    """
+    n = concurrency
+    return fit['lambda'] * n / (1 + fit['sigma'] * (n - 1) + fit['kappa'] * n * (n - 1))
+
+
+def recommend(trials: List[Dict[str, Any]], max_latency: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Recommend settings from the trials of a sweep.
+
+    For each combination of chunk size and hedging, a throughput curve over concurrency is
+    fitted (or the measurements are used as they are when there are too few levels). The
+    candidate concurrency is the lowest one reaching `THROUGHPUT_TARGET` of the peak
+    throughput within the swept range whose mean document latency (N / X(N) by Little's
+    law) stays within the bound. The combination with the highest throughput at its
+    candidate concurrency is recommended.
+
+    Args:
+        trials (List[Dict[str, Any]]): The trial measurements.
+        max_latency (Optional[float]): The largest acceptable mean document latency in seconds.
+
+    Returns:
+        Dict[str, Any]: The recommended concurrency, chunk size and hedging, with the predicted
+        throughput and latency and the curve fit.
+
+    Raises:
+        ValueError: If no trial completed a document.
+    """
+    settings = sorted({(trial['chunk_size'] or 0, trial['hedging']) for trial in trials if trial['documents']})
+    if not settings:
+        raise ValueError("No tuning trial completed a document")
+    best = None
+    for chunk_size, hedged in settings:
+        measured = [
+            (trial['concurrency'], trial['throughput']) for trial in trials
+            if (trial['chunk_size'] or 0) == chunk_size and trial['hedging'] == hedged and trial['documents']
+        ]
+        fit = fit_usl(measured)
+        if fit:
+            levels = range(1, max(n for n, _ in measured) + 1)
+            curve = {n: predict_throughput(fit, n) for n in levels}
+        else:
+            curve = {n: max(x for m, x in measured if m == n) for n, _ in measured}
+        feasible = {n: x for n, x in curve.items() if x > 0 and (max_latency is None or n * 60 / x <= max_latency)}
+        if not feasible:
+            continue
+        peak = max(feasible.values())
+        concurrency = min(n for n, x in feasible.items() if x >= THROUGHPUT_TARGET * peak)
+        candidate = {
+            'concurrency': concurrency,
+            'chunk_size': chunk_size or None,
+            'hedging': hedged,
+            'throughput': feasible[concurrency],
+            'latency': concurrency * 60 / feasible[concurrency],
+            'fit': fit
+        }
+        if best is None or candidate['throughput'] > best['throughput']:
+            best = candidate
+    if best is None:
+        raise ValueError(f"No tuned setting keeps the mean document latency within {max_latency} seconds")
+    return best
+
+
+def sweep(
+    workflow: str,
+    file_names: List[str],
+    directory: str,
+    concurrencies: List[int],
+    chunk_sizes: List[Optional[int]],
+    hedging_options: List[bool],
+    backend: str = 'local',
+    latency: Optional[float] = None,
+    time_scale: float = 1.0
+) -> List[Dict[str, Any]]:
+    """
+    Run every combination of settings over a sample of documents.
+
+    With the local backend, model calls go to a stand-in that replays the responses recorded
+    in the response cache after latencies recorded on the backend (or a fixed mean latency),
+    so the sweep costs no model calls. Responses must have been recorded for the sample
+    first, e.g. with `batch --cache-mode write`. With the real backend the configured
+    endpoints are called. In both cases the response cache is bypassed, documents run in
+    worker threads, outputs go to a scratch directory and the runs are left out of the
+    latency history used to schedule batches.
+
+    Args:
+        workflow (str): The workflow name.
+        file_names (List[str]): The sampled documents.
+        directory (str): The directory containing the PDF files.
+        concurrencies (List[int]): The concurrency levels.
+        chunk_sizes (List[Optional[int]]): The pipelined chunk sizes (None runs the steps sequentially); multi-step only.
+        hedging_options (List[bool]): Whether to hedge slow calls.
+        backend (str): 'local' or 'real'.
+        latency (Optional[float]): Mean call latency of the local backend, instead of replaying recorded latencies.
+        time_scale (float): Factor applied to local call latencies to shorten the sweep.
+
+    Returns:
+        List[Dict[str, Any]]: The trial measurements.
+
+    Raises:
+        ValueError: If the local backend has no latencies to replay.
+    """
+    if workflow != 'multi_step':
+        chunk_sizes = [None]
+    if backend == 'local':
+        latencies = [latency] if latency is not None else recorded_latencies()
+        if not latencies:
+            raise ValueError("No recorded call latencies to replay; run a batch on the backend first or pass a latency")
+        logger.info(f"Replaying {len(latencies)} recorded call latencies (median {statistics.median(latencies):.2f} s)")
+        endpoints = [replay_endpoint(latencies, time_scale)]
+    else:
+        time_scale = 1.0
+        endpoints = endpoint_pool.endpoints
+    if len(file_names) < 2 * max(concurrencies):
+        logger.warning(f"The sample of {len(file_names)} documents is small for concurrency {max(concurrencies)}; "
+                       "its throughput will be limited by the last documents of each trial")
+
+    saved = {
+        'pipelining': config.MULTI_STEP_PIPELINING,
+        'chunk_size': config.MULTI_STEP_PIPELINE_CHUNK_SIZE,
+        'isolation': config.TIMEOUT_ISOLATION,
+        'hedging': hedging.enabled,
+        'hedging_workflows': hedging.workflows,
+        'cache_mode': get_cache_mode(),
+        'rate': rate_limiter.rate * 60 if rate_limiter.rate else None
+    }
+    # Calls must reach the (stand-in) backend, and the stand-in only exists in this process
+    set_cache_mode('off')
+    config.TIMEOUT_ISOLATION = 'thread'
+    # Each trial decides whether it hedges, whatever the profile says for the workflow
+    hedging.workflows = {}
+    if saved['rate']:
+        rate_limiter.set_rate(saved['rate'] / time_scale)
+    trials = []
+    try:
+        with endpoint_pool.substitute(endpoints), scratch_outputs():
+            for chunk_size in chunk_sizes:
+                for hedged in hedging_options:
+                    for concurrency in sorted(concurrencies):
+                        trials.append(run_trial(workflow, file_names, directory, concurrency, chunk_size, hedged, time_scale))
+    finally:
+        config.MULTI_STEP_PIPELINING = saved['pipelining']
+        config.MULTI_STEP_PIPELINE_CHUNK_SIZE = saved['chunk_size']
+        config.TIMEOUT_ISOLATION = saved['isolation']
+        hedging.enabled = saved['hedging']
+        hedging.workflows = saved['hedging_workflows']
+        hedging.reset()
+        set_cache_mode(saved['cache_mode'])
+        rate_limiter.set_rate(saved['rate'])
+    return trials
+
+
+def tuning_key(workflow: str) -> str:
+    """
+    Compute the key of the configuration a tuning applies to: the workflow, its templates and the model.
+
+    Args:
+        workflow (str): The workflow name.
+
+    Returns:
+        str: A short hex key, which changes when the templates or the model change.
+    """
+    return baseline_key(workflow, template_hashes(), current_model())
+
+
+def profile_path(name: str) -> str:
+    """
+    Get the path of a configuration profile.
+
+    Args:
+        name (str): The profile name.
+
+    Returns:
+        str: The profile's YAML file under the profiles directory.
+    """
+    return os.path.join(config.PROFILES_DIR, f'{name}.yml')
+
+
+def load_profile(name: str) -> Dict[str, Any]:
+    """
+    Load a configuration profile.
+
+    Args:
+        name (str): The profile name.
+
+    Returns:
+        Dict[str, Any]: The profile's keys, or an empty profile if it does not exist.
+    """
+    if not os.path.exists(profile_path(name)):
+        return {}
+    with open(profile_path(name), 'r', encoding='utf-8') as file:
+        return yaml.safe_load(file) or {}
+
+
+def write_profile(
+    name: str,
+    workflow: str,
+    recommendation: Dict[str, Any],
+    trials: List[Dict[str, Any]],
+    file_names: List[str],
+    backend: str
+) -> str:
+    """
+    Write recommended settings into a configuration profile, keeping the other workflows' entries.
+
+    The profile sets the workflow's concurrency, whether its calls are hedged (an override
+    under `hedging.workflows`, leaving the shared `hedging.enabled` default alone) and, for
+    the multi-step workflow, pipelining. A `tuning` section records per workflow what the settings were tuned for
+    and on which measurements, so that a stale tuning can be detected and the sweep re-run.
+
+    Args:
+        name (str): The profile name.
+        workflow (str): The workflow name.
+        recommendation (Dict[str, Any]): The recommended settings, as returned by `recommend`.
+        trials (List[Dict[str, Any]]): The trial measurements.
+        file_names (List[str]): The sampled documents.
+        backend (str): 'local' or 'real'.
+
+    Returns:
+        str: The path of the profile.
+    """
+    profile = load_profile(name)
+    profile.setdefault('batch', {}).setdefault('workflow_concurrency', {})[workflow] = recommendation['concurrency']
+    profile.setdefault('hedging', {}).setdefault('workflows', {})[workflow] = recommendation['hedging']
+    if workflow == 'multi_step':
+        multi_step = profile.setdefault('multi_step', {})
+        multi_step['pipelining'] = recommendation['chunk_size'] is not None
+        if recommendation['chunk_size'] is not None:
+            multi_step['pipeline_chunk_size'] = recommendation['chunk_size']
+    profile.setdefault('tuning', {})[workflow] = {
+        'key': tuning_key(workflow),
+        'model': current_model(),
+        'backend': backend,
+        'tuned_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'documents': file_names,
+        'throughput': round(recommendation['throughput'], 3),
+        'latency': round(recommendation['latency'], 1),
+        'fit': {key: round(value, 6) for key, value in recommendation['fit'].items()} if recommendation['fit'] else None,
+        'trials': [{key: round(value, 3) if isinstance(value, float) else value for key, value in trial.items()} for trial in trials]
+    }
+    atomic_write(profile_path(name), yaml.safe_dump(profile, sort_keys=False))
+    return profile_path(name)
+
+
+def stale_workflows(name: str, workflows: List[str]) -> List[str]:
+    """
+    List the workflows whose tuning in a profile is missing or was done for other templates or another model.
+
+    Args:
+        name (str): The profile name.
+        workflows (List[str]): The workflows to check.
+
+    Returns:
+        List[str]: The workflows to re-tune.
+    """
+    tuning = load_profile(name).get('tuning', {})
+    return [workflow for workflow in workflows if tuning.get(workflow, {}).get('key') != tuning_key(workflow)]
+
+
+def format_tuning_report(trials: List[Dict[str, Any]], recommendation: Dict[str, Any]) -> str:
+    """
+    Format the trials of a sweep and the recommended settings.
+
+    Args:
+        trials (List[Dict[str, Any]]): The trial measurements.
+        recommendation (Dict[str, Any]): The recommended settings.
+
+    Returns:
+        str: The report, one line per trial.
+    """
+    def seconds(value: Optional[float]) -> str:
+        return f"{value:.1f}" if value is not None else '-'
+
+    lines = [f"{'conc':>4} {'chunk':>5} {'hedge':>5} {'docs':>4} {'fail':>4} {'calls':>5} {'docs/min':>8} {'p50 s':>7} {'p95 s':>7}"]
+    for trial in trials:
+        lines.append(
+            f"{trial['concurrency']:>4} {trial['chunk_size'] or '-':>5} {'on' if trial['hedging'] else 'off':>5} "
+            f"{trial['documents']:>4} {trial['failed']:>4} {trial['calls']:>5} {trial['throughput']:>8.2f} "
+            f"{seconds(trial['latency_p50']):>7} {seconds(trial['latency_p95']):>7}"
+        )
+    fit = recommendation['fit']
+    if fit:
+        lines.append(f"\nThroughput curve: X(N) = {fit['lambda']:.3f} N / (1 + {fit['sigma']:.4f} (N - 1) + {fit['kappa']:.5f} N (N - 1)) docs/min")
+    lines.append(
+        f"Recommended: concurrency {recommendation['concurrency']}, "
+        f"chunk size {recommendation['chunk_size'] or 'sequential'}, hedging {'on' if recommendation['hedging'] else 'off'} "
+        f"({recommendation['throughput']:.2f} docs/min, mean latency {recommendation['latency']:.1f} s)"
+    )
+    return '\n'.join(lines) + '\n'
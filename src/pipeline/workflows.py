@@ -0,0 +1,25 @@
+from typing import Callable
+from typing import Any
+import importlib
+
+
+# Extraction workflows, each implemented by `run(file_name)` in src/pipeline/<workflow>.py
+WORKFLOWS = ('single_step', 'multi_step', 'merged_step', 'hybrid')
+
+
+def get_workflow_runner(workflow: str) -> Callable[[str], Any]:
+    """
+    Get the `run` function of an extraction workflow.
+
+    Args:
+        workflow (str): The workflow name, one of WORKFLOWS.
+
+    Returns:
+        Callable[[str], Any]: The workflow's run function, taking the document's file name.
+
+    Raises:
+        ValueError: If the workflow is unknown.
+    """
+    if workflow not in WORKFLOWS:
+        raise ValueError(f"Unknown workflow: {workflow}. Expected one of {WORKFLOWS}")
+    return importlib.import_module(f'src.pipeline.{workflow}').run
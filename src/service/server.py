@@ -0,0 +1,438 @@
+from src.pipeline.workflows import get_workflow_runner
+from http.server import BaseHTTPRequestHandler
+from src.utils.template import clear_template_cache
+from http.server import ThreadingHTTPServer
+from src.pipeline.workflows import WORKFLOWS
+from src.utils.io import atomic_write
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import load_jsonl
+from src.utils.io import save_json
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+from typing import Any
+import socketserver
+import itertools
+import threading
+import queue
+import shutil
+import json
+import time
+import uuid
+import os
+
+
+DOCS_DIR = os.path.join(config.DATA_DIR, 'docs')
+JOBS_DIR = os.path.join(config.DATA_DIR, 'service/jobs')
+VALIDATION_DIR = os.path.join(config.DATA_DIR, 'validation')
+
+
+class QueueFullError(Exception):
+    """Raised when the scheduler's bounded queue cannot accept another job."""
+
+
+def validate_file_name(file_name: Any) -> str:
+    """
+    Check that a document ID names a file directly inside the docs and output directories.
+
+    Args:
+        file_name (Any): The requested document ID.
+
+    Returns:
+        str: The document ID.
+
+    Raises:
+        ValueError: If the ID is empty, contains a path separator or is a relative path component.
+    """
+    if (
+        not isinstance(file_name, str) or file_name in ('', '.', '..') or '\x00' in file_name
+        or '/' in file_name or '\\' in file_name or os.path.basename(file_name) != file_name
+    ):
+        raise ValueError(f"Invalid file name: {file_name!r}")
+    return file_name
+
+
+class JobScheduler:
+    """
+    Bounded priority scheduler running extraction jobs on a fixed pool of worker threads.
+
+    Workers live as long as the service, so model clients, templates and caches created
+    by the pipelines stay warm across documents. Lower priority values run first; jobs
+    with equal priority run in submission order.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        """
+        Initialize the scheduler and start its workers.
+
+        Args:
+            workers (int): The number of documents processed concurrently.
+            queue_size (int): The maximum number of queued (not yet running) jobs.
+        """
+        self._queue: queue.PriorityQueue = queue.PriorityQueue(maxsize=queue_size)
+        self._sequence = itertools.count()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._restore()
+        self._workers = [threading.Thread(target=self._work, name=f'extraction-worker-{i}', daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, file_name: str, workflow: str, priority: int = 0, document: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        Queue a document for extraction.
+
+        An uploaded document is staged under a temporary name and only linked into the docs
+        directory once the job is accepted, so a rejected upload leaves nothing behind and
+        an existing document is never replaced.
+
+        Args:
+            file_name (str): The name of the PDF file (without extension) in the docs directory.
+            workflow (str): The workflow to run.
+            priority (int): Lower values run first.
+            document (Optional[bytes]): The uploaded PDF to store as the document, if any.
+
+        Returns:
+            Dict[str, Any]: The job record.
+
+        Raises:
+            ValueError: If the workflow is unknown, or the document ID is invalid or does not exist.
+            FileExistsError: If a document is uploaded under an ID that already exists.
+            QueueFullError: If the queue is full.
+        """
+        validate_file_name(file_name)
+        if workflow not in WORKFLOWS:
+            raise ValueError(f"Unknown workflow: {workflow}. Expected one of {WORKFLOWS}")
+        document_path = os.path.join(DOCS_DIR, f'{file_name}.pdf')
+        if document is not None and os.path.exists(document_path):
+            raise FileExistsError(f"Document already exists: {file_name}")
+        if document is None and not os.path.exists(document_path):
+            raise ValueError(f"Document not found: {file_name}")
+
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'file_name': file_name,
+            'workflow': workflow,
+            'priority': priority,
+            'status': 'queued',
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'error': None
+        }
+        staging_path = None
+        if document is not None:
+            staging_path = os.path.join(DOCS_DIR, f".upload-{job['job_id']}.tmp")
+            atomic_write(staging_path, document)
+        try:
+            with self._lock:
+                # Only workers take from the queue while the lock is held, so a free slot stays free
+                if self._queue.full():
+                    raise QueueFullError(f"Scheduler queue is full ({self._queue.maxsize} jobs)")
+                if staging_path is not None:
+                    # Fails if the ID was taken since the check above, instead of replacing it
+                    os.link(staging_path, document_path)
+                self._queue.put_nowait((priority, next(self._sequence), job['job_id']))
+                self._jobs[job['job_id']] = job
+        finally:
+            if staging_path is not None:
+                os.remove(staging_path)
+        self._persist(job)
+        logger.info(f"Queued job {job['job_id']}: {workflow} for {file_name} with priority {priority}")
+        self._prune()
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job's status, including its extracted rows once it has finished.
+
+        Args:
+            job_id (str): The job ID.
+
+        Returns:
+            Optional[Dict[str, Any]]: The job record, or None if the job is unknown. If the rows
+            of a finished job cannot be read, its result is None and its error says why.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            job = dict(job) if job else None
+        if job and job['status'] == 'done':
+            try:
+                job['result'] = load_jsonl(os.path.join(VALIDATION_DIR, f"generated/{job['workflow']}/{job['file_name']}.jsonl"))
+            except Exception as e:
+                logger.error(f"Error loading the rows of job {job_id}: {e}")
+                job.update(result=None, error=f"Rows unavailable: {e}")
+        return job
+
+    def list(self) -> List[Dict[str, Any]]:
+        """
+        List all jobs known to the service.
+
+        Returns:
+            List[Dict[str, Any]]: The job records in submission order.
+        """
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def _restore(self) -> None:
+        """
+        Reload persisted jobs; jobs interrupted by a restart are queued again.
+
+        Workers have not started yet, so interrupted jobs beyond the queue size cannot wait
+        for room; they are marked rejected instead and must be resubmitted.
+        """
+        if not os.path.isdir(JOBS_DIR):
+            return
+        jobs = []
+        for entry in os.listdir(JOBS_DIR):
+            if entry.endswith('.json'):
+                try:
+                    with open(os.path.join(JOBS_DIR, entry), 'r', encoding='utf-8') as file:
+                        jobs.append(json.load(file))
+                except (OSError, json.JSONDecodeError) as e:
+                    logger.error(f"Error restoring job {entry}: {e}")
+        rejected = 0
+        for job in sorted(jobs, key=lambda job: job['submitted_at']):
+            self._jobs[job['job_id']] = job
+            if job['status'] in ('queued', 'running'):
+                job.update(status='queued', started_at=None)
+                try:
+                    self._queue.put_nowait((job['priority'], next(self._sequence), job['job_id']))
+                except queue.Full:
+                    job.update(status='rejected', finished_at=time.time(), error=f"Scheduler queue was full on restart ({self._queue.maxsize} jobs)")
+                    rejected += 1
+                self._persist(job)
+        logger.info(f"Restored {len(jobs)} jobs, {self._queue.qsize()} queued, {rejected} rejected")
+        self._prune()
+
+    def _prune(self) -> None:
+        """
+        Forget jobs that finished longer ago than the retention period, in memory and on disk.
+        """
+        if not config.SERVICE_JOB_RETENTION:
+            return
+        cutoff = time.time() - config.SERVICE_JOB_RETENTION
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        for job_id in expired:
+            try:
+                os.remove(os.path.join(JOBS_DIR, f'{job_id}.json'))
+            except FileNotFoundError:
+                pass
+
+    def _persist(self, job: Dict[str, Any]) -> None:
+        """
+        Persist a job record so that statuses survive a service restart.
+
+        Args:
+            job (Dict[str, Any]): The job record.
+        """
+        save_json(job, os.path.join(JOBS_DIR, f"{job['job_id']}.json"))
+
+    def _update(self, job_id: str, **fields: Any) -> Dict[str, Any]:
+        """
+        Update a job record and persist it.
+
+        Args:
+            job_id (str): The job ID.
+            **fields (Any): The fields to update.
+
+        Returns:
+            Dict[str, Any]: A copy of the updated job record.
+        """
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            job = dict(self._jobs[job_id])
+        self._persist(job)
+        return job
+
+    def _work(self) -> None:
+        """
+        Worker loop: take the highest-priority job and run its workflow.
+        """
+        while True:
+            _, _, job_id = self._queue.get()
+            job = self._update(job_id, status='running', started_at=time.time())
+            try:
+                get_workflow_runner(job['workflow'])(job['file_name'])
+                self._update(job_id, status='done', finished_at=time.time())
+                logger.info(f"Job {job_id} finished")
+            except Exception as e:
+                self._update(job_id, status='failed', finished_at=time.time(), error=str(e))
+                logger.error(f"Job {job_id} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+def watch_spool(scheduler: JobScheduler, spool_dir: str, workflow: str, poll_interval: float) -> None:
+    """
+    Submit PDFs dropped into the spool directory.
+
+    Each `<file_name>.pdf` is moved into the docs directory and queued with the default
+    workflow and priority once its size and modification time are unchanged between two
+    scans, so that files still being copied are not picked up. Writers that can should copy
+    to another name (e.g. `<file_name>.pdf.tmp`) and rename. A file that fails to queue is
+    left in the spool and retried.
+
+    Args:
+        scheduler (JobScheduler): The scheduler to submit to.
+        spool_dir (str): The watched directory.
+        workflow (str): The workflow used for spooled documents.
+        poll_interval (float): Seconds between directory scans.
+    """
+    os.makedirs(spool_dir, exist_ok=True)
+    logger.info(f"Watching spool directory {spool_dir}")
+    # Size and modification time of each file at the previous scan
+    pending: Dict[str, Tuple[int, int]] = {}
+    while True:
+        entries = sorted(entry for entry in os.listdir(spool_dir) if entry.endswith('.pdf'))
+        pending = {entry: signature for entry, signature in pending.items() if entry in entries}
+        for entry in entries:
+            source = os.path.join(spool_dir, entry)
+            target = os.path.join(DOCS_DIR, entry)
+            try:
+                stat = os.stat(source)
+            except FileNotFoundError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if pending.get(entry) != signature:
+                pending[entry] = signature
+                continue
+            del pending[entry]
+            try:
+                shutil.move(source, target)
+                scheduler.submit(os.path.splitext(entry)[0], workflow)
+            except QueueFullError as e:
+                shutil.move(target, source)
+                logger.warning(f"Spooled document {entry} deferred: {e}")
+            except Exception as e:
+                logger.error(f"Error submitting spooled document {entry}: {e}")
+        time.sleep(poll_interval)
+
+
+class ExtractionRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the extraction service.
+
+    - POST /jobs with {"file_name", "workflow", "priority"} queues a document in the docs directory.
+    - POST /jobs?file_name=...&workflow=...&priority=... with a PDF body stores and queues a new
+      document (409 if the ID already exists).
+    - GET /jobs lists jobs; GET /jobs/<job_id> returns a job's status and, when done, its rows.
+    - POST /reload clears the template cache.
+    """
+
+    scheduler: JobScheduler = None
+
+    def address_string(self) -> str:
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix-socket'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.info(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, body: Any) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path.rstrip('/')
+        if path == '/jobs':
+            self._send_json(200, self.scheduler.list())
+        elif path.startswith('/jobs/'):
+            job = self.scheduler.get(path[len('/jobs/'):])
+            if job:
+                self._send_json(200, job)
+            else:
+                self._send_json(404, {'error': 'Job not found'})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        if path == '/reload':
+            clear_template_cache()
+            self._send_json(200, {'status': 'reloaded'})
+            return
+        if path != '/jobs':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.headers.get('Content-Type', '').startswith('application/pdf'):
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                file_name = validate_file_name(params.get('file_name') or uuid.uuid4().hex)
+                document = body
+            else:
+                params = json.loads(body or b'{}')
+                file_name = validate_file_name(params['file_name'])
+                document = None
+            job = self.scheduler.submit(file_name, params.get('workflow', config.SERVICE_DEFAULT_WORKFLOW), int(params.get('priority', 0)), document)
+            self._send_json(202, job)
+        except QueueFullError as e:
+            self._send_json(503, {'error': str(e)})
+        except FileExistsError as e:
+            self._send_json(409, {'error': str(e)})
+        except (KeyError, ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {'error': str(e)})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server listening on a Unix domain socket."""
+
+    daemon_threads = True
+
+
+def create_server(scheduler: JobScheduler) -> Tuple[socketserver.BaseServer, str]:
+    """
+    Create the HTTP server on the configured Unix socket, or on host and port otherwise.
+
+    Args:
+        scheduler (JobScheduler): The scheduler the API submits to.
+
+    Returns:
+        Tuple[socketserver.BaseServer, str]: The server and a description of its address.
+    """
+    handler = type('BoundExtractionRequestHandler', (ExtractionRequestHandler,), {'scheduler': scheduler})
+    if config.SERVICE_UNIX_SOCKET:
+        if os.path.exists(config.SERVICE_UNIX_SOCKET):
+            os.remove(config.SERVICE_UNIX_SOCKET)
+        return ThreadingUnixHTTPServer(config.SERVICE_UNIX_SOCKET, handler), f'unix:{config.SERVICE_UNIX_SOCKET}'
+    return ThreadingHTTPServer((config.SERVICE_HOST, config.SERVICE_PORT), handler), f'http://{config.SERVICE_HOST}:{config.SERVICE_PORT}'
+
+
+def main() -> None:
+    """
+    Start the extraction service: the scheduler, the spool watcher and the API server.
+    """
+    try:
+        scheduler = JobScheduler(config.SERVICE_WORKERS, config.SERVICE_QUEUE_SIZE)
+        if config.SERVICE_SPOOL_DIR:
+            threading.Thread(
+                target=watch_spool,
+                args=(scheduler, config.SERVICE_SPOOL_DIR, config.SERVICE_DEFAULT_WORKFLOW, config.SERVICE_POLL_INTERVAL),
+                name='spool-watcher',
+                daemon=True
+            ).start()
+        server, address = create_server(scheduler)
+        logger.info(f"Extraction service listening on {address} with {config.SERVICE_WORKERS} workers")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Extraction service stopped")
+    except Exception as e:
+        logger.critical(f"Critical failure in extraction service: {e}")
+
+
+if __name__ == '__main__':
+    main()
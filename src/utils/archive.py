@@ -0,0 +1,531 @@
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+from typing import Any
+import threading
+import fnmatch
+import struct
+import fcntl
+import mmap
+import json
+import zlib
+import os
+
+try:
+    import zstandard
+except ImportError:  # Without zstandard, archives are written with zlib
+    zstandard = None
+
+
+# File layout: header (the offset and length of the latest index record), then records, each
+# a record header, its key and its compressed data. The index record maps keys to their latest
+# record; records appended after it are found by scanning the tail, so appends never rewrite
+# the index and a torn last record is simply ignored.
+ARCHIVE_SUFFIX = '.esga'
+MAGIC = b'ESGA'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQ')
+RECORD_MAGIC = b'ESGR'
+RECORD = struct.Struct('<4sBHQQI')
+INDEX_KEY = '\0index'
+
+CODECS = {'stored': 0, 'zlib': 1, 'zstd': 2}
+
+# Unindexed records a writer appends before it writes a new index
+INDEX_INTERVAL = 256
+
+# Directories under data_dir packed by default: documents, step outputs and JSONL rows
+PACKED_DIRS = ('docs', 'output', 'validation/generated')
+
+
+def _compress(data: bytes, codec: str, level: int) -> Tuple[int, bytes]:
+    """
+    Compress a member, storing it as is when compression does not make it smaller (e.g. PDFs).
+
+    Args:
+        data (bytes): The member's content.
+        codec (str): 'zstd' or 'zlib'; zstd falls back to zlib without the zstandard package.
+        level (int): The compression level.
+
+    Returns:
+        Tuple[int, bytes]: The codec ID and the stored bytes.
+    """
+    if codec == 'zstd' and zstandard is not None:
+        codec_id, compressed = CODECS['zstd'], zstandard.ZstdCompressor(level=level).compress(data)
+    else:
+        codec_id, compressed = CODECS['zlib'], zlib.compress(data, min(level, 9))
+    if len(compressed) >= len(data):
+        return CODECS['stored'], data
+    return codec_id, compressed
+
+
+def _decompress(codec_id: int, stored: bytes, raw_length: int) -> bytes:
+    if codec_id == CODECS['stored']:
+        return bytes(stored)
+    if codec_id == CODECS['zlib']:
+        return zlib.decompress(stored)
+    if zstandard is None:
+        raise RuntimeError("The zstandard package is required to read zstd archive members")
+    return zstandard.ZstdDecompressor().decompress(stored, max_output_size=raw_length)
+
+
+class Archive:
+    """
+    Single-file archive of documents and outputs, keyed by their path under data_dir.
+
+    Each member is compressed on its own (zstd, or zlib without the zstandard package), so
+    any member is read with one slice of the memory-mapped file and one decompression.
+    Writers append under an exclusive `flock`, so several processes may write one archive;
+    readers pick up appended records on their next lookup. When `compact` has replaced the
+    file, writers and readers reopen it before their next append or missed lookup.
+    """
+
+    def __init__(self, path: str, writable: bool = False):
+        """
+        Open an archive, creating it when opened for writing.
+
+        Args:
+            path (str): The archive path.
+            writable (bool): Whether members are appended.
+
+        Raises:
+            ValueError: If the file is not an archive of the current version.
+        """
+        self.path = path
+        self.writable = writable
+        if writable and not os.path.exists(path):
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'ab') as file:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+                if file.tell() == 0:
+                    file.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, 'r+b' if self.writable else 'rb')
+        self._map: Optional[mmap.mmap] = None
+        self._entries: Dict[str, Tuple[int, int, int, int, int]] = {}
+        self._scanned = 0
+        self._unindexed = 0
+        self._refresh()
+
+    def _follow(self) -> None:
+        """
+        Reopen the archive if `compact` replaced the file since it was opened; the caller holds the lock.
+        """
+        try:
+            replaced = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            replaced = False
+        if replaced:
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+            self._open()
+
+    def _lock_file(self) -> None:
+        """
+        Take the exclusive file lock on the current archive file, following a compaction.
+        """
+        while True:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                replaced = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = False
+            if not replaced:
+                return
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._follow()
+
+    def _remap(self) -> None:
+        size = os.fstat(self._file.fileno()).st_size
+        if self._map is None or len(self._map) != size:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+
+    def _read_record(self, offset: int) -> Optional[Tuple[str, Tuple[int, int, int, int, int], int]]:
+        """
+        Parse the record at an offset.
+
+        Args:
+            offset (int): The record's offset.
+
+        Returns:
+            Optional[Tuple[str, Tuple[int, int, int, int, int], int]]: The key, the entry (data
+            offset, stored length, raw length, codec and CRC-32) and the offset after the record,
+            or None if no complete record starts there.
+        """
+        if offset + RECORD.size > len(self._map):
+            return None
+        magic, codec_id, key_length, stored_length, raw_length, crc = RECORD.unpack_from(self._map, offset)
+        data_offset = offset + RECORD.size + key_length
+        if magic != RECORD_MAGIC or data_offset + stored_length > len(self._map):
+            return None
+        key = self._map[offset + RECORD.size:data_offset].decode('utf-8')
+        return key, (data_offset, stored_length, raw_length, codec_id, crc), data_offset + stored_length
+
+    def _refresh(self) -> None:
+        """
+        Load the index on first use and pick up the records appended since the last scan.
+        """
+        self._remap()
+        if not self._scanned:
+            magic, version, index_offset, _ = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"Not an archive of version {VERSION}: {self.path}")
+            self._scanned = HEADER.size
+            record = self._read_record(index_offset) if index_offset else None
+            if record is not None:
+                _, entry, self._scanned = record
+                self._entries = {key: tuple(value) for key, value in json.loads(self._member(entry)).items()}
+        while self._scanned < len(self._map):
+            record = self._read_record(self._scanned)
+            if record is None:
+                # A torn tail from an interrupted writer; the next append overwrites it
+                break
+            key, entry, self._scanned = record
+            if key != INDEX_KEY:
+                self._entries[key] = entry
+                self._unindexed += 1
+
+    def _member(self, entry: Tuple[int, int, int, int, int]) -> bytes:
+        data_offset, stored_length, raw_length, codec_id, crc = entry
+        data = _decompress(codec_id, self._map[data_offset:data_offset + stored_length], raw_length)
+        if zlib.crc32(data) != crc:
+            raise ValueError(f"Corrupt archive member at offset {data_offset} of {self.path}")
+        return data
+
+    def keys(self, pattern: str = '*') -> List[str]:
+        """
+        List the members matching a glob, in key order.
+
+        Args:
+            pattern (str): The glob over keys, e.g. 'docs/*.pdf'.
+
+        Returns:
+            List[str]: The keys.
+        """
+        with self._lock:
+            self._follow()
+            self._refresh()
+            return sorted(key for key in self._entries if fnmatch.fnmatchcase(key, pattern))
+
+    def read(self, key: str) -> Optional[bytes]:
+        """
+        Read a member.
+
+        Args:
+            key (str): The member's path under data_dir, e.g. 'docs/<id>.pdf'.
+
+        Returns:
+            Optional[bytes]: The content, or None if the archive has no such member.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._follow()
+                self._refresh()
+                entry = self._entries.get(key)
+            return self._member(entry) if entry is not None else None
+
+    def entry(self, key: str) -> Optional[Dict[str, int]]:
+        """
+        Describe a member without reading it.
+
+        Args:
+            key (str): The member's key.
+
+        Returns:
+            Optional[Dict[str, int]]: Its stored and raw sizes and CRC-32, or None if absent.
+        """
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(key)
+        return {'stored_bytes': entry[1], 'raw_bytes': entry[2], 'crc32': entry[4]} if entry else None
+
+    def _append(self, key: str, codec_id: int, stored: bytes, raw_length: int, crc: int) -> Tuple[int, int, int, int, int]:
+        """
+        Append a record at the end of the file, overwriting a torn tail; the caller holds the locks.
+        """
+        self._refresh()
+        encoded = key.encode('utf-8')
+        self._file.seek(self._scanned)
+        self._file.write(RECORD.pack(RECORD_MAGIC, codec_id, len(encoded), len(stored), raw_length, crc) + encoded)
+        data_offset = self._file.tell()
+        self._file.write(stored)
+        self._file.truncate()
+        self._file.flush()
+        if config.FSYNC_POLICY in ('file', 'full'):
+            os.fsync(self._file.fileno())
+        self._remap()
+        self._scanned = data_offset + len(stored)
+        return data_offset, len(stored), raw_length, codec_id, crc
+
+    def write(self, key: str, data: bytes) -> None:
+        """
+        Add or replace a member; the previous version stays in the file until `compact`.
+
+        Args:
+            key (str): The member's key.
+            data (bytes): The content.
+
+        Raises:
+            IOError: If the archive was opened read-only.
+        """
+        if not self.writable:
+            raise IOError(f"Archive {self.path} is open read-only")
+        codec_id, stored = _compress(data, config.ARCHIVE_CODEC, config.ARCHIVE_LEVEL)
+        crc = zlib.crc32(data)
+        with self._lock:
+            self._lock_file()
+            try:
+                self._entries[key] = self._append(key, codec_id, stored, len(data), crc)
+                self._unindexed += 1
+                if self._unindexed >= INDEX_INTERVAL:
+                    self._write_index()
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _write_index(self) -> None:
+        index = json.dumps(self._entries, separators=(',', ':')).encode('utf-8')
+        codec_id, stored = _compress(index, 'zlib', 6)
+        offset = self._scanned
+        self._append(INDEX_KEY, codec_id, stored, len(index), zlib.crc32(index))
+        # The header only ever points at a complete index record
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, offset, self._scanned - offset))
+        self._file.flush()
+        if config.FSYNC_POLICY in ('file', 'full'):
+            os.fsync(self._file.fileno())
+        self._unindexed = 0
+
+    def write_index(self) -> None:
+        """
+        Write the index of all current members, so that readers need not scan the records.
+        """
+        if not self.writable or not self._unindexed:
+            return
+        with self._lock:
+            self._lock_file()
+            try:
+                self._refresh()
+                self._write_index()
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        """
+        Write the index if members were appended, and close the file.
+        """
+        self.write_index()
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+
+
+_archives: Dict[Tuple[str, bool], Archive] = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(path: str, writable: bool = False) -> Archive:
+    """
+    Get the process-wide instance of an archive, opening it on first use.
+
+    Args:
+        path (str): The archive path.
+        writable (bool): Whether members are appended.
+
+    Returns:
+        Archive: The archive.
+    """
+    key = (os.path.abspath(path), writable)
+    with _archives_lock:
+        archive = _archives.get(key)
+        if archive is None:
+            archive = Archive(path, writable)
+            _archives[key] = archive
+    return archive
+
+
+def archive_key(file_path: str) -> Optional[str]:
+    """
+    Get the archive key of a file: its path relative to data_dir.
+
+    Args:
+        file_path (str): The file path.
+
+    Returns:
+        Optional[str]: The key, or None for files outside data_dir.
+    """
+    relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(config.DATA_DIR))
+    if relative.startswith(os.pardir):
+        return None
+    return relative.replace(os.sep, '/')
+
+
+def read_archived(file_path: str) -> Optional[bytes]:
+    """
+    Read a file from the configured archive (`archive.path`).
+
+    Args:
+        file_path (str): The file's path under data_dir.
+
+    Returns:
+        Optional[bytes]: The content, or None without an archive or if it has no such member.
+    """
+    key = archive_key(file_path)
+    if not config.ARCHIVE_PATH or key is None or not os.path.exists(config.ARCHIVE_PATH):
+        return None
+    try:
+        return open_archive(config.ARCHIVE_PATH).read(key)
+    except Exception as e:
+        logger.error(f"Error reading {key} from archive {config.ARCHIVE_PATH}: {e}")
+        return None
+
+
+def archived_paths(pattern: str) -> List[str]:
+    """
+    List the files of the configured archive matching a glob, as paths under data_dir.
+
+    Args:
+        pattern (str): The glob, e.g. './data/docs/*.pdf'.
+
+    Returns:
+        List[str]: The paths, empty without an archive.
+    """
+    key_pattern = archive_key(pattern)
+    if not config.ARCHIVE_PATH or key_pattern is None or not os.path.exists(config.ARCHIVE_PATH):
+        return []
+    return [os.path.join(config.DATA_DIR, key) for key in open_archive(config.ARCHIVE_PATH).keys(key_pattern)]
+
+
+def pack(archive_path: str, directories: Tuple[str, ...] = PACKED_DIRS) -> Dict[str, Any]:
+    """
+    Add the files of data_dir directories to an archive, skipping members already up to date.
+
+    Args:
+        archive_path (str): The archive path, created if missing.
+        directories (Tuple[str, ...]): Directories under data_dir.
+
+    Returns:
+        Dict[str, Any]: The members added and unchanged, and the raw and stored bytes added.
+    """
+    archive = open_archive(archive_path, writable=True)
+    stats = {'added': 0, 'unchanged': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+    for directory in directories:
+        for root, _, file_names in sorted(os.walk(os.path.join(config.DATA_DIR, directory))):
+            for file_name in sorted(file_names):
+                file_path = os.path.join(root, file_name)
+                with open(file_path, 'rb') as file:
+                    data = file.read()
+                key = archive_key(file_path)
+                current = archive.entry(key)
+                if current and current['raw_bytes'] == len(data) and current['crc32'] == zlib.crc32(data):
+                    stats['unchanged'] += 1
+                    continue
+                archive.write(key, data)
+                stats['added'] += 1
+                stats['raw_bytes'] += len(data)
+                stats['stored_bytes'] += archive.entry(key)['stored_bytes']
+    archive.write_index()
+    logger.info(f"Packed {stats['added']} files into {archive_path} ({stats['unchanged']} unchanged)")
+    return stats
+
+
+def compact(archive_path: str) -> Dict[str, int]:
+    """
+    Rewrite an archive with only the latest version of each member.
+
+    The archive's file lock is held for the whole rewrite, so concurrent writers wait and
+    then append to the compacted file instead of the replaced one.
+
+    Args:
+        archive_path (str): The archive path.
+
+    Returns:
+        Dict[str, int]: The members kept and the file size before and after.
+    """
+    source = Archive(archive_path)
+    fcntl.flock(source._file.fileno(), fcntl.LOCK_EX)
+    temp_path = f'{archive_path}.{os.getpid()}.tmp'
+    target = Archive(temp_path, writable=True)
+    try:
+        keys = source.keys()
+        for key in keys:
+            target.write(key, source.read(key))
+        target.close()
+        before = os.path.getsize(archive_path)
+        os.replace(temp_path, archive_path)
+    finally:
+        source.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    with _archives_lock:
+        for key in [key for key in _archives if key[0] == os.path.abspath(archive_path)]:
+            del _archives[key]
+    return {'members': len(keys), 'bytes_before': before, 'bytes_after': os.path.getsize(archive_path)}
+
+
+def member_path(target_dir: str, key: str) -> str:
+    """
+    Get the path a member is extracted to, refusing keys that would escape the directory.
+
+    Args:
+        target_dir (str): The directory members are extracted into.
+        key (str): The member's key.
+
+    Returns:
+        str: The file path under target_dir.
+
+    Raises:
+        ValueError: If the key is absolute, has '..' or empty parts, or resolves outside target_dir.
+    """
+    parts = key.split('/')
+    if key.startswith('/') or '\\' in key or os.path.isabs(key) or any(part in ('', '.', '..') for part in parts):
+        raise ValueError(f"Unsafe archive member key: {key!r}")
+    root = os.path.realpath(target_dir)
+    file_path = os.path.realpath(os.path.join(root, *parts))
+    if os.path.commonpath([root, file_path]) != root:
+        raise ValueError(f"Archive member {key!r} resolves outside {target_dir}")
+    return file_path
+
+
+def unpack(archive_path: str, target_dir: Optional[str] = None, pattern: str = '*') -> int:
+    """
+    Extract the members matching a glob into a directory, at their paths under data_dir.
+
+    Archives are shipped between nodes, so every key is checked before anything is written.
+
+    Args:
+        archive_path (str): The archive path.
+        target_dir (Optional[str]): The directory; defaults to data_dir.
+        pattern (str): The glob over keys, e.g. 'docs/*.pdf'.
+
+    Returns:
+        int: The number of files written.
+
+    Raises:
+        ValueError: If a matching key would be extracted outside the directory.
+    """
+    archive = open_archive(archive_path)
+    target_dir = target_dir or config.DATA_DIR
+    keys = archive.keys(pattern)
+    paths = {key: member_path(target_dir, key) for key in keys}
+    for key in keys:
+        file_path = paths[key]
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Replace links to deduplicated outputs rather than writing through them
+        if os.path.islink(file_path):
+            os.remove(file_path)
+        with open(file_path, 'wb') as file:
+            file.write(archive.read(key))
+    logger.info(f"Unpacked {len(keys)} files from {archive_path} into {target_dir}")
+    return len(keys)
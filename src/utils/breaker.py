@@ -0,0 +1,171 @@
+from src.utils.telemetry import record_event
+from src.config.logging import logger
+from typing import Callable
+from typing import Optional
+from typing import Dict
+from typing import Any
+import collections
+import threading
+import time
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the model while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Shared circuit breaker in front of the model backend.
+
+    Outcomes of model calls that fail because of the backend (quota, unavailability,
+    timeouts) are counted over a sliding time window. The breaker opens when the error rate
+    of the window reaches the threshold over a minimum number of calls; while it is open,
+    calls fail fast. Once the open interval has passed, a single caller probes the backend
+    with a low-cost call; the breaker closes if the probe succeeds and otherwise stays open
+    for twice as long (up to `max_open_seconds`).
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        window: float,
+        min_calls: int,
+        error_threshold: float,
+        open_seconds: float,
+        max_open_seconds: float,
+        probe: Callable[[], bool]
+    ):
+        """
+        Initialize the breaker.
+
+        Args:
+            enabled (bool): Whether the breaker ever opens.
+            window (float): Seconds of call outcomes the error rate is computed over.
+            min_calls (int): Calls in the window needed before the breaker can open.
+            error_threshold (float): Error rate (0-1) at which the breaker opens.
+            open_seconds (float): Seconds before the first probe after opening.
+            max_open_seconds (float): Longest interval between probes.
+            probe (Callable[[], bool]): Low-cost check returning True if the backend is healthy.
+        """
+        self.enabled = enabled
+        self.window = window
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probe = probe
+        self.state = 'closed'
+        self.retry_at = 0.0
+        self._interval = open_seconds
+        self._outcomes: collections.deque = collections.deque()
+        self._probing = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._closed.set()
+
+    def _error_rate(self, now: float) -> Optional[float]:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+        if len(self._outcomes) < self.min_calls:
+            return None
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def _transition(self, state: str, **fields: Any) -> None:
+        self.state = state
+        if state == 'closed':
+            self._closed.set()
+        else:
+            self._closed.clear()
+        logger.warning(f"Circuit breaker {state}: {fields}")
+        record_event('breaker', state=state, **fields)
+
+    def record(self, ok: bool) -> None:
+        """
+        Record the outcome of a model call.
+
+        Args:
+            ok (bool): False if the call failed because of the backend.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._outcomes.append((now, ok))
+            rate = self._error_rate(now)
+            if self.state == 'closed' and rate is not None and rate >= self.error_threshold:
+                self._interval = self.open_seconds
+                self.retry_at = now + self._interval
+                self._transition('open', error_rate=round(rate, 3), calls=len(self._outcomes))
+
+    def check(self) -> None:
+        """
+        Let a call through, or fail fast while the breaker is open.
+
+        Raises:
+            CircuitOpenError: If the breaker is open and the backend has not recovered.
+        """
+        if self.state == 'closed' or self.wait_closed(0):
+            return
+        raise CircuitOpenError(f"Model backend circuit is open; next probe in {max(0.0, self.retry_at - time.monotonic()):.0f} seconds")
+
+    def _try_probe(self) -> None:
+        """
+        Probe the backend if the open interval has passed and no other caller is probing.
+        """
+        with self._lock:
+            if self.state == 'closed' or self._probing or time.monotonic() < self.retry_at:
+                return
+            self._probing = True
+        try:
+            healthy = self.probe()
+        except Exception as e:
+            logger.error(f"Circuit breaker probe failed: {e}")
+            healthy = False
+        with self._lock:
+            self._probing = False
+            if healthy:
+                self._outcomes.clear()
+                self._transition('closed')
+            else:
+                self._interval = min(self._interval * 2, self.max_open_seconds)
+                self.retry_at = time.monotonic() + self._interval
+                record_event('breaker', state='open', probe='failed', interval=self._interval)
+                logger.warning(f"Circuit breaker probe failed; next probe in {self._interval:.0f} seconds")
+
+    def wait_closed(self, timeout: Optional[float]) -> bool:
+        """
+        Wait until the breaker is closed, probing the backend when a probe is due.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait, or None to wait indefinitely.
+
+        Returns:
+            bool: True if the breaker is closed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._try_probe()
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return False
+            wait = max(self.retry_at - now, 0.1)
+            self._closed.wait(wait if deadline is None else min(wait, deadline - now))
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Describe the breaker's state.
+
+        Returns:
+            Dict[str, Any]: The state, the error rate over the window (None below the minimum
+            number of calls) and the seconds until the next probe.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'state': self.state,
+                'error_rate': self._error_rate(now),
+                'calls': len(self._outcomes),
+                'next_probe': max(0.0, self.retry_at - now) if self.state == 'open' else None
+            }
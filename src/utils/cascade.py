@@ -0,0 +1,259 @@
+from src.utils.llm import generate_response
+from src.utils.telemetry import record_event
+from src.utils.telemetry import load_events
+from src.utils.rules import parse_number
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.llm import get_model
+from collections import defaultdict
+from typing import Generator
+from typing import Optional
+from typing import Union
+from typing import List
+from typing import Dict
+from typing import Any
+import contextlib
+import contextvars
+
+
+SCHEMA_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'number': (int, float),
+    'integer': int,
+    'boolean': bool
+}
+
+# Totals that must roughly equal the sum of their parts: 429 = 432 + 711, 819 + 817 = 100 %
+TOTAL_CHECKS = (('429', ('432', '711')),)
+SHARE_CHECKS = (('819', '817'),)
+
+# Model replacing text_gen_model_name for the calls of the current document, e.g. a
+# larger-context model chosen by the preflight planner
+_default_model: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('default_model', default=None)
+
+
+@contextlib.contextmanager
+def default_model(model_name: Optional[str]) -> Generator[None, None, None]:
+    """
+    Use another default model for the routed calls made within the block.
+
+    Args:
+        model_name (Optional[str]): The model name, or None to keep text_gen_model_name.
+    """
+    token = _default_model.set(model_name or _default_model.get())
+    try:
+        yield
+    finally:
+        _default_model.reset(token)
+
+
+def schema_errors(data: Any, schema: Dict[str, Any], path: str = '$') -> List[str]:
+    """
+    Validate data against the subset of JSON schema used by the response schemas.
+
+    Types, required properties, enums and numeric bounds are checked. String patterns are
+    not: they guide generation, and outputs of every model routinely differ in punctuation.
+
+    Args:
+        data (Any): The parsed model output.
+        schema (Dict[str, Any]): The response schema.
+        path (str): The JSON path of the data, used in error messages.
+
+    Returns:
+        List[str]: The validation errors (empty when the data is valid).
+    """
+    expected = SCHEMA_TYPES.get(str(schema.get('type', '')).lower())
+    if expected and (not isinstance(data, expected) or (expected != bool and isinstance(data, bool))):
+        return [f"{path}: expected {schema['type']}, got {type(data).__name__}"]
+
+    errors = []
+    if 'enum' in schema and data not in schema['enum']:
+        errors.append(f"{path}: {data!r} not in {schema['enum']}")
+    if isinstance(data, (int, float)):
+        if 'minimum' in schema and data < schema['minimum']:
+            errors.append(f"{path}: {data} below minimum {schema['minimum']}")
+        if 'maximum' in schema and data > schema['maximum']:
+            errors.append(f"{path}: {data} above maximum {schema['maximum']}")
+    if isinstance(data, dict):
+        errors.extend(f"{path}.{key}: missing" for key in schema.get('required', []) if key not in data)
+        for key, subschema in schema.get('properties', {}).items():
+            if key in data:
+                errors.extend(schema_errors(data[key], subschema, f'{path}.{key}'))
+    if isinstance(data, list) and 'items' in schema:
+        for i, item in enumerate(data):
+            errors.extend(schema_errors(item, schema['items'], f'{path}[{i}]'))
+    return errors
+
+
+def empty_errors(output: Any) -> List[str]:
+    """
+    Check that a step output extracted anything.
+
+    An empty array is valid against every array schema, but a cheap model that finds
+    nothing is more likely to have missed the metrics than a document to have none.
+
+    Args:
+        output (Any): The parsed model output.
+
+    Returns:
+        List[str]: An error per empty metric list (empty when the output has rows).
+    """
+    if isinstance(output, dict) and 'metrics' not in output and output and all(isinstance(part, dict) and 'metrics' in part for part in output.values()):
+        # Packed single-step output: each document must have rows
+        return [f"{document_id}: {error}" for document_id, part in output.items() for error in empty_errors(part)]
+    if isinstance(output, list) and not output:
+        return ["$: empty array"]
+    if isinstance(output, dict) and isinstance(output.get('metrics'), list) and not output['metrics']:
+        return ["$.metrics: empty array"]
+    return []
+
+
+def _rows(output: Any) -> List[Dict[str, Any]]:
+    """
+    Get the metric rows of a step output, flattening the nested sections of merged outputs.
+
+    Rows without a year take the output's top-level year (single-step outputs), if any.
+
+    Args:
+        output (Any): The parsed model output.
+
+    Returns:
+        List[Dict[str, Any]]: The rows holding code, value and unit where present.
+    """
+    rows = output.get('metrics', []) if isinstance(output, dict) else output if isinstance(output, list) else []
+    year = output.get('year') if isinstance(output, dict) else None
+    flat = []
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        merged = {} if year is None else {'year': year}
+        for key, value in row.items():
+            if isinstance(value, dict):
+                merged.update(value)
+            else:
+                merged[key] = value
+        flat.append(merged)
+    return flat
+
+
+def consistency_errors(output: Any, tolerance: float) -> List[str]:
+    """
+    Check extracted values for internal consistency.
+
+    Totals must match the sum of their renewable and non-renewable parts, and renewable and
+    non-renewable shares must add up to 100 %, within a relative tolerance. Values are only
+    compared within the same unit and year. Printed values (single-step outputs) are parsed
+    as numbers. Rows without a year (step 2 outputs) are only compared while each metric has
+    a single value in a unit; differing values may belong to different years.
+
+    Args:
+        output (Any): The parsed model output.
+        tolerance (float): The allowed relative deviation.
+
+    Returns:
+        List[str]: The inconsistencies found (empty when consistent or not checkable).
+    """
+    if isinstance(output, dict) and 'metrics' not in output and output and all(isinstance(part, dict) and 'metrics' in part for part in output.values()):
+        # Packed single-step output: each document is checked on its own
+        return [f"{document_id}: {error}" for document_id, part in output.items() for error in consistency_errors(part, tolerance)]
+    values: Dict[tuple, float] = {}
+    ambiguous = set()
+    errors = []
+    for row in _rows(output):
+        value = row.get('value')
+        if isinstance(value, str):
+            value = parse_number(value)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or 'code' not in row:
+            continue
+        if value < 0:
+            errors.append(f"{row['code']}: negative value {value}")
+        key = (str(row['code']), row.get('unit'), row.get('year'))
+        if key[2] is None and key in values and values[key] != value:
+            ambiguous.add(key)
+        values.setdefault(key, value)
+    for key in ambiguous:
+        del values[key]
+
+    for (code, unit, year), total in values.items():
+        for total_code, parts in TOTAL_CHECKS:
+            if code != total_code or not all((part, unit, year) in values for part in parts):
+                continue
+            parts_sum = sum(values[(part, unit, year)] for part in parts)
+            if abs(parts_sum - total) > tolerance * max(abs(total), abs(parts_sum)):
+                errors.append(f"{total_code} ({total} {unit}) != {' + '.join(parts)} ({parts_sum} {unit})")
+        for share_code, other_code in SHARE_CHECKS:
+            if code == share_code and unit == '%' and (other_code, unit, year) in values:
+                shares = total + values[(other_code, unit, year)]
+                if abs(shares - 100) > tolerance * 100:
+                    errors.append(f"{share_code} + {other_code} = {shares} %")
+    return errors
+
+
+def is_routed(step: Union[int, str]) -> bool:
+    """
+    Check whether a step tries the cheap model first.
+
+    Args:
+        step (Union[int, str]): The step (0-3 for multi-step, 'single' or 'fused').
+
+    Returns:
+        bool: True if the cascade is enabled for the step.
+    """
+    return config.CASCADE_ENABLED and str(step) in config.CASCADE_STEPS
+
+
+def generate_routed(system_instruction: List[str], contents: List[Any], response_schema: Dict[str, Any], step: Union[int, str]) -> Any:
+    """
+    Generate a step's output with the cheap model first, escalating to the default model if needed.
+
+    The cheap model's output is accepted when it is valid against the response schema, not
+    empty and internally consistent. Otherwise, or if the cheap call fails, the step is re-run with the
+    default model. Each routing decision is recorded in the telemetry as a 'route' event.
+    Within `default_model`, calls go straight to that model without the cascade.
+
+    Args:
+        system_instruction (List[str]): The system instruction(s) for the step.
+        contents (List[Any]): The contents to be processed by the model.
+        response_schema (Dict[str, Any]): The schema for the response.
+        step (Union[int, str]): The step (0-3 for multi-step, 'single' or 'fused').
+
+    Returns:
+        Any: The generated response.
+    """
+    model_name = _default_model.get()
+    if not is_routed(step) or model_name:
+        return generate_response(get_model(system_instruction, model_name), contents, response_schema)
+
+    try:
+        output = generate_response(get_model(system_instruction, config.CASCADE_MODEL_NAME), contents, response_schema)
+        reasons = schema_errors(output, response_schema) + empty_errors(output) + consistency_errors(output, config.CASCADE_TOLERANCE)
+    except Exception as e:
+        output, reasons = None, [f"error: {type(e).__name__}"]
+
+    if not reasons:
+        record_event('route', step=str(step), model=config.CASCADE_MODEL_NAME, escalated=False)
+        return output
+
+    logger.info(f"Escalating step {step} from {config.CASCADE_MODEL_NAME} to {config.TEXT_GEN_MODEL_NAME}: {reasons[:3]}")
+    record_event('route', step=str(step), model=config.TEXT_GEN_MODEL_NAME, escalated=True, reasons=reasons[:10])
+    return generate_response(get_model(system_instruction), contents, response_schema)
+
+
+def escalation_rates(workflow: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Compute how often each step escalated from the cheap model.
+
+    Args:
+        workflow (Optional[str]): Only count routing decisions of this workflow if given.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Per step, the number of routed calls, escalations and the escalation rate.
+    """
+    counts = defaultdict(lambda: {'calls': 0, 'escalated': 0})
+    for event in load_events('route'):
+        if workflow is None or event.get('workflow') == workflow:
+            counts[event['step']]['calls'] += 1
+            counts[event['step']]['escalated'] += int(event['escalated'])
+    return {step: {**count, 'rate': count['escalated'] / count['calls']} for step, count in sorted(counts.items())}
@@ -0,0 +1,136 @@
+from google.api_core import exceptions as google_exceptions
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import Future
+from src.utils.telemetry import bind_context
+from src.config.setup import config
+from typing import Generator
+from typing import Callable
+from typing import Optional
+from typing import Any
+import contextlib
+import contextvars
+import threading
+import time
+
+
+# Absolute deadline (time.monotonic) of the current document run, inherited by the threads
+# that copy the caller's context (asyncio.to_thread, hedged attempts)
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('deadline', default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds: Optional[float]) -> Generator[None, None, None]:
+    """
+    Bound the model calls made within the block by a deadline.
+
+    Nested deadlines never extend an enclosing one.
+
+    Args:
+        seconds (Optional[float]): Seconds from now, or None for no deadline.
+    """
+    if seconds is None:
+        yield
+        return
+    current = _deadline.get()
+    target = time.monotonic() + seconds
+    token = _deadline.set(target if current is None else min(current, target))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def run_with_deadline(function: Callable[..., Any], seconds: Optional[float], *args: Any) -> Any:
+    """
+    Run a function under a deadline, e.g. a workflow's `run` on a worker thread.
+
+    Args:
+        function (Callable[..., Any]): The function.
+        seconds (Optional[float]): Seconds from now, or None for no deadline.
+        *args (Any): Its arguments.
+
+    Returns:
+        Any: The function's result.
+    """
+    with deadline(seconds):
+        return function(*args)
+
+
+def remaining() -> Optional[float]:
+    """
+    Get the time left until the current deadline.
+
+    Returns:
+        Optional[float]: Seconds left (negative once passed), or None without a deadline.
+    """
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+def call_timeout() -> Optional[float]:
+    """
+    Get the timeout of the next model call: the per-call timeout, capped by the document deadline.
+
+    Returns:
+        Optional[float]: Seconds, or None if calls are unbounded.
+
+    Raises:
+        google_exceptions.DeadlineExceeded: If the document deadline has already passed.
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise google_exceptions.DeadlineExceeded("Document deadline exceeded before the model call")
+    timeouts = [timeout for timeout in (config.CALL_TIMEOUT, left) if timeout is not None]
+    return min(timeouts) if timeouts else None
+
+
+def run_with_timeout(function: Callable[..., Any], timeout: Optional[float], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a blocking call, giving up on it after a timeout.
+
+    The call runs on a worker thread in a copy of the caller's context. A call that times
+    out keeps its thread until the underlying request returns, but the caller is released
+    immediately; only a subprocess run (`timeouts.isolation: process`) is torn down at once.
+
+    Args:
+        function (Callable[..., Any]): The call.
+        timeout (Optional[float]): Seconds to wait, or None to wait indefinitely.
+        *args (Any): Positional arguments of the call.
+        **kwargs (Any): Keyword arguments of the call.
+
+    Returns:
+        Any: The call's result.
+
+    Raises:
+        google_exceptions.DeadlineExceeded: If the call did not finish in time.
+    """
+    if timeout is None:
+        return function(*args, **kwargs)
+    future: Future = Future()
+    bound = bind_context(function)
+
+    def target() -> None:
+        try:
+            future.set_result(bound(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    # A thread per call rather than a pool, so that abandoned calls never starve later ones
+    threading.Thread(target=target, name='model-call', daemon=True).start()
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        raise google_exceptions.DeadlineExceeded(f"Model call did not finish within {timeout:.1f} seconds") from None
+
+
+def is_timeout(error: BaseException) -> bool:
+    """
+    Check whether an error means that a deadline was exceeded.
+
+    Args:
+        error (BaseException): The error.
+
+    Returns:
+        bool: True for deadline and timeout errors.
+    """
+    return isinstance(error, (google_exceptions.DeadlineExceeded, TimeoutError))
@@ -0,0 +1,330 @@
+from src.utils.pdf import extract_page_texts
+from src.utils.archive import read_archived
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from collections import Counter
+from collections import defaultdict
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+from typing import Any
+import hashlib
+import shutil
+import heapq
+import json
+import re
+import os
+
+
+INDEX_PATH = os.path.join(config.DATA_DIR, 'index/fingerprints.json')
+
+# Bottom-k sketch size and word shingle length for near-duplicate detection
+SKETCH_SIZE = 128
+SHINGLE_LENGTH = 5
+
+# Sketch hashes shared by more documents than this are boilerplate and do not pick candidates
+MAX_POSTING_LENGTH = 100
+
+# Years a report can be about; the most mentioned one tells editions apart
+YEAR_PATTERN = re.compile(r'\b(?:19[89]\d|20\d\d)\b')
+
+
+def file_sha256(file_path: str) -> str:
+    """
+    Compute the SHA-256 of a file's bytes, reading archived files from the configured archive.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The hex digest.
+    """
+    if not os.path.exists(file_path):
+        content = read_archived(file_path)
+        if content is not None:
+            return hashlib.sha256(content).hexdigest()
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_sketch(page_texts: List[str]) -> List[int]:
+    """
+    Build a bottom-k MinHash sketch of a document's word shingles.
+
+    The sketch keeps the SKETCH_SIZE smallest 64-bit hashes of all word shingles, which
+    estimates the Jaccard similarity of two documents' shingle sets.
+
+    Args:
+        page_texts (List[str]): The text of each page.
+
+    Returns:
+        List[int]: The sorted sketch (shorter than SKETCH_SIZE for very short documents).
+    """
+    words = re.findall(r'\w+', ' '.join(page_texts).lower())
+    hashes = set()
+    for i in range(max(len(words) - SHINGLE_LENGTH + 1, 0)):
+        shingle = ' '.join(words[i:i + SHINGLE_LENGTH]).encode('utf-8')
+        hashes.add(int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'big'))
+    return heapq.nsmallest(SKETCH_SIZE, hashes)
+
+
+def main_year(page_texts: List[str]) -> Optional[int]:
+    """
+    Find the year a document mentions most, usually its reporting year.
+
+    Args:
+        page_texts (List[str]): The text of each page.
+
+    Returns:
+        Optional[int]: The most mentioned year (the latest on ties), or None if no year is mentioned.
+    """
+    counts = Counter(int(year) for year in YEAR_PATTERN.findall(' '.join(page_texts)))
+    if not counts:
+        return None
+    return max(counts, key=lambda year: (counts[year], year))
+
+
+def sketch_similarity(sketch1: List[int], sketch2: List[int]) -> float:
+    """
+    Estimate the Jaccard similarity of two documents from their bottom-k sketches.
+
+    Args:
+        sketch1 (List[int]): The first sketch.
+        sketch2 (List[int]): The second sketch.
+
+    Returns:
+        float: The estimated similarity in [0, 1].
+    """
+    if not sketch1 or not sketch2:
+        return 0.0
+    k = min(SKETCH_SIZE, len(set(sketch1) | set(sketch2)))
+    union_sketch = set(heapq.nsmallest(k, set(sketch1) | set(sketch2)))
+    shared = union_sketch & set(sketch1) & set(sketch2)
+    return len(shared) / len(union_sketch)
+
+
+def load_index() -> Dict[str, Dict[str, Any]]:
+    """
+    Load the fingerprint index.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Fingerprints keyed by document ID.
+    """
+    if not os.path.exists(INDEX_PATH):
+        return {}
+    try:
+        with open(INDEX_PATH, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (IOError, json.JSONDecodeError) as e:
+        logger.error(f"Error loading fingerprint index {INDEX_PATH}, rebuilding it: {e}")
+        return {}
+
+
+def update_index(directory: str, file_names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Fingerprint new or changed documents and persist the index.
+
+    Documents whose size and modification time are unchanged keep their fingerprint,
+    so re-running over a large corpus only reads the new files. A fingerprint holds the
+    SHA-256 of the bytes, the text sketch, the page count and the most mentioned year.
+
+    Args:
+        directory (str): The directory containing the PDF files.
+        file_names (List[str]): The document IDs (file names without extension).
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The updated fingerprints keyed by document ID.
+    """
+    index = load_index()
+    changed = False
+    for file_name in file_names:
+        file_path = os.path.join(directory, f'{file_name}.pdf')
+        stat = os.stat(file_path)
+        entry = index.get(file_name)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime and 'pages' in entry:
+            continue
+
+        logger.info(f"Fingerprinting {file_path}")
+        page_texts = extract_page_texts(file_path) or []
+        index[file_name] = {
+            'sha256': file_sha256(file_path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sketch': text_sketch(page_texts),
+            'pages': len(page_texts),
+            'year': main_year(page_texts)
+        }
+        changed = True
+
+    if changed:
+        atomic_write(INDEX_PATH, json.dumps(index))
+    return index
+
+
+def find_duplicate_groups(index: Dict[str, Dict[str, Any]], file_names: List[str], threshold: float) -> Dict[str, List[str]]:
+    """
+    Group documents that are byte-identical or near-duplicates by text.
+
+    Near-duplicates must also have the same page count and most mentioned year, since
+    consecutive editions of a report share most of their text but not their values.
+    Candidate pairs are found through an inverted index over sketch hashes, so only
+    documents sharing shingles are compared. Hashes shared by more than MAX_POSTING_LENGTH
+    documents (cover pages, legal notices) are skipped when counting pairs, which keeps the
+    counting linear in the number of documents; they still count towards the candidates'
+    similarity. Near-duplicates that share nothing else, such as a group of more than
+    MAX_POSTING_LENGTH near-identical reports, are therefore not grouped. Groups are merged
+    transitively, and the canonical document of each group is its smallest ID so that the
+    choice is stable.
+
+    Args:
+        index (Dict[str, Dict[str, Any]]): Fingerprints keyed by document ID.
+        file_names (List[str]): The documents to group.
+        threshold (float): The minimum estimated Jaccard similarity for near-duplicates.
+
+    Returns:
+        Dict[str, List[str]]: The duplicates of each canonical document (groups of one are omitted).
+    """
+    parent = {file_name: file_name for file_name in file_names}
+
+    def find(file_name: str) -> str:
+        while parent[file_name] != file_name:
+            parent[file_name] = parent[parent[file_name]]
+            file_name = parent[file_name]
+        return file_name
+
+    def union(first: str, second: str) -> None:
+        root1, root2 = find(first), find(second)
+        if root1 != root2:
+            parent[max(root1, root2)] = min(root1, root2)
+
+    by_hash = defaultdict(list)
+    postings = defaultdict(list)
+    for file_name in file_names:
+        by_hash[index[file_name]['sha256']].append(file_name)
+        for value in index[file_name]['sketch']:
+            postings[value].append(file_name)
+
+    # Exact duplicates
+    for group in by_hash.values():
+        for file_name in group[1:]:
+            union(group[0], file_name)
+
+    # Near duplicates: only compare documents that share at least one uncommon sketch hash
+    shared_counts = defaultdict(int)
+    common_counts = Counter()
+    for documents in postings.values():
+        if len(documents) > MAX_POSTING_LENGTH:
+            common_counts.update(documents)
+            continue
+        for i in range(len(documents)):
+            for j in range(i + 1, len(documents)):
+                shared_counts[tuple(sorted((documents[i], documents[j])))] += 1
+    for (first, second), shared in shared_counts.items():
+        if (index[first]['pages'], index[first]['year']) != (index[second]['pages'], index[second]['year']):
+            continue
+        sketch1, sketch2 = index[first]['sketch'], index[second]['sketch']
+        # Both documents may share all of the smaller number of common hashes they hold
+        shared += min(common_counts[first], common_counts[second])
+        if shared >= threshold * min(len(sketch1), len(sketch2)) / 2 and sketch_similarity(sketch1, sketch2) >= threshold:
+            union(first, second)
+
+    groups = defaultdict(list)
+    for file_name in file_names:
+        root = find(file_name)
+        if root != file_name:
+            groups[root].append(file_name)
+    return dict(groups)
+
+
+def deduplicate(directory: str, file_names: List[str]) -> Tuple[List[str], Dict[str, List[str]]]:
+    """
+    Reduce a document list to one canonical document per duplicate group.
+
+    Args:
+        directory (str): The directory containing the PDF files.
+        file_names (List[str]): The document IDs to process.
+
+    Returns:
+        Tuple[List[str], Dict[str, List[str]]]: The documents to process and the duplicates of each canonical document.
+    """
+    if not config.DEDUP_ENABLED:
+        return file_names, {}
+    try:
+        index = update_index(directory, file_names)
+        groups = find_duplicate_groups(index, file_names, config.DEDUP_NEAR_DUPLICATE_THRESHOLD)
+        duplicates = {file_name for members in groups.values() for file_name in members}
+        canonical = [file_name for file_name in file_names if file_name not in duplicates]
+        logger.info(f"Deduplication kept {len(canonical)} of {len(file_names)} documents ({len(duplicates)} duplicates)")
+        return canonical, groups
+    except Exception as e:
+        # Deduplication only saves calls; never block a run because of it
+        logger.error(f"Error deduplicating documents in {directory}, processing all of them: {e}")
+        return file_names, {}
+
+
+def _link_or_copy(source: str, target: str, link_mode: str) -> None:
+    """
+    Materialise a canonical output at a duplicate's location.
+
+    A directory is never linked as a whole: the duplicate gets its own directory with a
+    link per file. Outputs are written atomically (to a temporary file renamed over the
+    target), so a later run of the duplicate itself replaces its links instead of writing
+    through them into the canonical outputs.
+
+    Args:
+        source (str): The canonical output (file or directory).
+        target (str): The duplicate's output path.
+        link_mode (str): 'symlink' for relative symbolic links, or 'copy'.
+    """
+    if os.path.islink(target) or os.path.isfile(target):
+        os.remove(target)
+    elif os.path.isdir(target):
+        shutil.rmtree(target)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    if link_mode == 'symlink' and os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            target_root = os.path.join(target, os.path.relpath(root, source))
+            os.makedirs(target_root, exist_ok=True)
+            for name in files:
+                os.symlink(os.path.relpath(os.path.join(root, name), target_root), os.path.join(target_root, name))
+    elif link_mode == 'symlink':
+        os.symlink(os.path.relpath(source, os.path.dirname(target)), target)
+    elif os.path.isdir(source):
+        shutil.copytree(source, target)
+    else:
+        shutil.copy2(source, target)
+
+
+def materialize_duplicates(workflow: str, groups: Dict[str, List[str]], link_mode: Optional[str] = None) -> None:
+    """
+    Link or copy each canonical extraction into its duplicates' output and validation locations.
+
+    Args:
+        workflow (str): The workflow whose outputs are materialised.
+        groups (Dict[str, List[str]]): The duplicates of each canonical document.
+        link_mode (Optional[str]): 'symlink' or 'copy'; defaults to the configured mode.
+    """
+    link_mode = link_mode or config.DEDUP_LINK_MODE
+    output_dir = os.path.join(config.DATA_DIR, f'output/{workflow}')
+    generated_dir = os.path.join(config.DATA_DIR, f'validation/generated/{workflow}')
+
+    for canonical, duplicates in groups.items():
+        canonical_output = os.path.join(output_dir, canonical)
+        canonical_jsonl = os.path.join(generated_dir, f'{canonical}.jsonl')
+        if not os.path.exists(canonical_jsonl):
+            logger.warning(f"No extraction for canonical document {canonical}; skipping its duplicates {duplicates}")
+            continue
+        for duplicate in duplicates:
+            try:
+                if os.path.isdir(canonical_output):
+                    _link_or_copy(canonical_output, os.path.join(output_dir, duplicate), link_mode)
+                _link_or_copy(canonical_jsonl, os.path.join(generated_dir, f'{duplicate}.jsonl'), link_mode)
+                logger.info(f"Materialised {workflow} extraction of {canonical} for duplicate {duplicate} ({link_mode})")
+            except OSError as e:
+                logger.error(f"Error materialising {canonical} for duplicate {duplicate}: {e}")
@@ -1,16 +1,30 @@
 from src.config.logging import logger 
+from src.config.setup import config
+from src.utils.record import records_from_output
+from src.utils.archive import read_archived
+from src.utils.telemetry import bind_context
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
 from typing import Generator
 from typing import Optional 
+from typing import Union
 from typing import List 
 from typing import Dict 
 from typing import Any 
+import tempfile
 import json 
 import os 
 
 
+FSYNC_POLICIES = ('none', 'file', 'full')
+
+# Background writer used to persist intermediates off the critical path
+_json_writer = ThreadPoolExecutor(max_workers=4, thread_name_prefix='json-writer')
+
+
 def load_file(file_path: str) -> Optional[str]:
     """
-    Load text content from a file.
+    Load text content from a file, or from the configured archive if it is not on disk.
 
     Args:
         file_path (str): The path to the file to be loaded.
@@ -25,6 +39,10 @@ def load_file(file_path: str) -> Optional[str]:
             logger.info(f"Successfully loaded file: {file_path}")
             return content
     except FileNotFoundError:
+        content = read_archived(file_path)
+        if content is not None:
+            logger.info(f"Loaded {file_path} from the archive")
+            return content.decode('utf-8')
         logger.error(f"File not found: {file_path}")
     except IOError as e:
         logger.error(f"IO error occurred while reading file {file_path}: {e}")
@@ -35,7 +53,7 @@ def load_file(file_path: str) -> Optional[str]:
 
 def load_binary_file(file_path: str) -> Optional[bytes]:
     """
-    Load binary content from a file.
+    Load binary content from a file, or from the configured archive if it is not on disk.
 
     Args:
         file_path (str): The path to the file to be loaded.
@@ -50,12 +68,77 @@ def load_binary_file(file_path: str) -> Optional[bytes]:
             logger.info(f"Successfully loaded binary file: {file_path}")
             return content
     except FileNotFoundError:
+        content = read_archived(file_path)
+        if content is not None:
+            logger.info(f"Loaded {file_path} from the archive")
+            return content
         logger.error(f"File not found: {file_path}")
     except IOError as e:
         logger.error(f"Error reading file {file_path}: {e}")
     return None
 
 
+def _fsync_directory(directory: str) -> None:
+    """
+    Flush a directory entry to disk so that a preceding rename survives a crash.
+
+    Args:
+        directory (str): The directory containing the renamed file.
+    """
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(file_path: str, content: Union[str, bytes], fsync_policy: Optional[str] = None) -> None:
+    """
+    Write content to a file atomically by writing to a temporary file in the same
+    directory and renaming it over the target. Readers either see the previous
+    complete file or the new complete file, never a partially written one.
+
+    The fsync policy trades throughput for durability:
+    - 'none': rely on the OS page cache (fastest, may lose the file on power loss).
+    - 'file': fsync the temporary file before the rename.
+    - 'full': additionally fsync the parent directory after the rename.
+
+    Args:
+        file_path (str): The path to the file to be written.
+        content (Union[str, bytes]): The text or binary content to write.
+        fsync_policy (Optional[str]): Overrides the configured fsync policy.
+
+    Raises:
+        ValueError: If the fsync policy is unknown.
+        IOError: If writing or renaming the file fails.
+    """
+    fsync_policy = fsync_policy or config.FSYNC_POLICY
+    if fsync_policy not in FSYNC_POLICIES:
+        raise ValueError(f"Unknown fsync policy: {fsync_policy}. Expected one of {FSYNC_POLICIES}")
+
+    directory = os.path.dirname(file_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(file_path)}.', suffix='.tmp')
+    try:
+        mode = 'wb' if isinstance(content, bytes) else 'w'
+        encoding = None if isinstance(content, bytes) else 'utf-8'
+        with os.fdopen(fd, mode, encoding=encoding) as file:
+            file.write(content)
+            file.flush()
+            if fsync_policy in ('file', 'full'):
+                os.fsync(file.fileno())
+        # mkstemp creates the file as 0600; keep the target's mode or use the usual 0644
+        mode = os.stat(file_path).st_mode & 0o777 if os.path.exists(file_path) else 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, file_path)
+        if fsync_policy == 'full':
+            _fsync_directory(directory)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def save_json(data: Any, file_path: str) -> bool:
     """
     Save JSON data to a file.
@@ -69,16 +152,29 @@ def save_json(data: Any, file_path: str) -> bool:
     """
     try:
         logger.info(f"Attempting to save JSON data to {file_path}")
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, 'w', encoding='utf-8') as file:
-            json.dump(data, file, indent=4)
-            logger.info(f"Successfully saved JSON data to {file_path}")
-            return True
+        atomic_write(file_path, json.dumps(data, indent=4))
+        logger.info(f"Successfully saved JSON data to {file_path}")
+        return True
     except IOError as e:
         logger.error(f"Error saving JSON data to {file_path}: {e}")
     return False
 
 
+def save_json_async(data: Any, file_path: str) -> Future:
+    """
+    Save JSON data to a file on a background writer thread.
+
+    Args:
+        data (Any): The JSON data to be saved. It must not be mutated until the future completes.
+        file_path (str): The path to the file where the data should be saved.
+
+    Returns:
+        Future: A future resolving to the result of `save_json`.
+    """
+    logger.info(f"Scheduling asynchronous save of JSON data to {file_path}")
+    return _json_writer.submit(bind_context(save_json), data, file_path)
+
+
 def load_jsonl(file_path: str) -> List[Dict]:
     """
     Reads a JSONL (JSON Lines) file and returns a list of dictionaries.
@@ -115,6 +211,28 @@ def load_jsonl(file_path: str) -> List[Dict]:
     return json_list
 
 
+def save_jsonl(data: Any, output_file: str, workflow: str) -> None:
+    """
+    Write in-memory JSON output to a JSONL file with branching based on the workflow.
+
+    Args:
+        data (Any): The parsed JSON output of the workflow, as dicts or `MetricRecord`s.
+        output_file (str): The path to the output JSONL file.
+        workflow (str): The workflow type; 'single_step' and 'merged_step' outputs hold their rows under "metrics".
+    """
+    try:
+        logger.info(f"Writing data to the output JSONL file: {output_file}")
+        records = records_from_output(data, workflow)
+        atomic_write(output_file, ''.join(json.dumps(record.to_dict()) + '\n' for record in records))
+        logger.info(f"Successfully wrote JSONL: {output_file}")
+    except IOError as e:
+        logger.error(f"Error writing file {output_file}: {e}")
+        raise
+    except KeyError as e:
+        logger.error(f"Missing expected key in JSON data: {e}")
+        raise
+
+
 def convert_json_to_jsonl(input_file: str, output_file: str, workflow: str) -> None:
     """
     Convert a JSON file to a JSONL file with branching based on the workflow.
@@ -122,27 +240,14 @@ def convert_json_to_jsonl(input_file: str, output_file: str, workflow: str) -> N
     Args:
         input_file (str): The path to the input JSON file.
         output_file (str): The path to the output JSONL file.
-        workflow (str): The workflow type, either 'single_step' or other.
+        workflow (str): The workflow type; 'single_step' and 'merged_step' outputs hold their rows under "metrics".
     """
     try:
         logger.info(f"Reading the input JSON file: {input_file}")
         with open(input_file, 'r', encoding='utf-8') as f:
             data = json.load(f)
 
-        # Ensure the output directory exists
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        logger.info(f"Ensured the output directory exists: {os.path.dirname(output_file)}")
-
-        logger.info(f"Writing data to the output JSONL file: {output_file}")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            if workflow == 'single_step':
-                for item in data["metrics"]:
-                    json_line = json.dumps(item)
-                    f.write(json_line + '\n')
-            else:
-                for item in data:
-                    json_line = json.dumps(item)
-                    f.write(json_line + '\n')
+        save_jsonl(data, output_file, workflow)
         logger.info(f"Successfully converted JSON to JSONL: {output_file}")
 
     except FileNotFoundError:
@@ -0,0 +1,972 @@
+from vertexai.generative_models import HarmBlockThreshold
+from vertexai.generative_models import GenerationConfig
+from vertexai.generative_models import GenerativeModel
+from vertexai.generative_models import HarmCategory
+from vertexai.generative_models import Part
+from google.api_core import exceptions as google_exceptions
+from src.utils.telemetry import current_tags
+from src.utils.telemetry import bind_context
+from src.utils.telemetry import record_event
+from src.utils.telemetry import load_events
+from src.utils.deadline import run_with_timeout
+from src.utils.deadline import call_timeout
+from src.utils.deadline import remaining
+from src.utils.breaker import CircuitBreaker
+from src.utils.io import atomic_write
+from src.config.logging import logger
+from src.config.setup import config
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+from types import SimpleNamespace
+from typing import Generator
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import List
+from typing import Dict 
+from typing import Any 
+import collections
+import contextlib
+import statistics
+import threading
+import hashlib
+import random
+import json
+import time
+import os
+
+
+# Model clients are created once per (model name, system instruction) and reused
+_models: Dict[Tuple[str, Tuple[str, ...]], GenerativeModel] = {}
+_models_lock = threading.Lock()
+
+CACHE_MODES = ('off', 'read', 'write', 'readwrite')
+CACHE_DIR = os.path.join(config.DATA_DIR, 'cache/responses')
+
+
+class RateLimiter:
+    """
+    Token bucket limiting model calls per minute across all threads of the process.
+    """
+
+    def __init__(self, calls_per_minute: Optional[float]):
+        """
+        Initialize the limiter.
+
+        Args:
+            calls_per_minute (Optional[float]): The sustained call rate; None or 0 disables limiting.
+        """
+        self._lock = threading.Lock()
+        self.set_rate(calls_per_minute)
+
+    def set_rate(self, calls_per_minute: Optional[float]) -> None:
+        """
+        Change the call rate. The bucket holds at most one minute's worth of calls.
+
+        Args:
+            calls_per_minute (Optional[float]): The sustained call rate; None or 0 disables limiting.
+        """
+        with self._lock:
+            self.rate = calls_per_minute / 60 if calls_per_minute else None
+            self.capacity = max(calls_per_minute or 0, 1)
+            self.tokens = self.capacity
+            self.updated_at = time.monotonic()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until a call may be made.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait at most, or None to wait indefinitely.
+
+        Returns:
+            bool: True once the call may be made, False if the timeout passed first.
+        """
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self.rate is None:
+                    return True
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if give_up_at is not None and now + wait > give_up_at:
+                return False
+            time.sleep(wait)
+
+    def wait_time(self) -> float:
+        """
+        Get the seconds until a call may be made, without reserving it.
+
+        Returns:
+            float: 0 when a call may be made now.
+        """
+        with self._lock:
+            if self.rate is None:
+                return 0.0
+            tokens = min(self.capacity, self.tokens + (time.monotonic() - self.updated_at) * self.rate)
+            return max(0.0, (1 - tokens) / self.rate)
+
+
+rate_limiter = RateLimiter(config.RATE_LIMIT_CALLS_PER_MINUTE)
+_cache_mode = config.CACHE_MODE
+
+
+def set_cache_mode(mode: str) -> None:
+    """
+    Set how model responses are cached: off, read (replay only), write (record only) or readwrite.
+
+    Args:
+        mode (str): The cache mode.
+
+    Raises:
+        ValueError: If the mode is unknown.
+    """
+    global _cache_mode
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unknown cache mode: {mode}. Expected one of {CACHE_MODES}")
+    _cache_mode = mode
+
+
+def get_cache_mode() -> str:
+    """
+    Get the current response cache mode.
+
+    Returns:
+        str: One of CACHE_MODES.
+    """
+    return _cache_mode
+
+
+def _part_payload(part: Any) -> Any:
+    """
+    Convert a content part to a JSON-serialisable form for cache keys.
+
+    Inline data such as the PDF is represented by the SHA-256 digest of its bytes rather
+    than by its base64 encoding, so a key costs one pass over the bytes.
+
+    Args:
+        part (Any): A Part or a string.
+
+    Returns:
+        Any: The serialisable form of the part.
+    """
+    inline_data = getattr(part, 'inline_data', None)
+    data = getattr(inline_data, 'data', None)
+    if isinstance(data, bytes) and data:
+        return {'mime_type': inline_data.mime_type, 'sha256': hashlib.sha256(data).hexdigest()}
+    return part.to_dict() if hasattr(part, 'to_dict') else str(part)
+
+
+def response_cache_key(model: GenerativeModel, contents: List[Part], response_schema: Dict[str, Any]) -> str:
+    """
+    Compute the cache key of a call from the model name, system instruction, contents and schema.
+
+    Args:
+        model (GenerativeModel): The generative model.
+        contents (List[Part]): The contents of the call.
+        response_schema (Dict[str, Any]): The schema for the response.
+
+    Returns:
+        str: The SHA-256 hex digest identifying the call.
+    """
+    payload = {
+        'model': getattr(model, '_model_name', None),
+        'system_instruction': _part_payload(getattr(model, '_system_instruction', None)),
+        'contents': [_part_payload(part) for part in contents],
+        'response_schema': response_schema
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], f'{key}.json')
+
+
+def get_model(system_instruction: List[str], model_name: Optional[str] = None) -> GenerativeModel:
+    """
+    Get a generative model client for a system instruction, creating it on first use.
+
+    Args:
+        system_instruction (List[str]): The system instruction(s) for the model.
+        model_name (Optional[str]): The model name. Defaults to the configured text generation model.
+
+    Returns:
+        GenerativeModel: The cached model client.
+    """
+    key = (model_name or config.TEXT_GEN_MODEL_NAME, tuple(system_instruction))
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            logger.info(f"Creating generative model client for {key[0]}")
+            model = GenerativeModel(key[0], system_instruction=system_instruction)
+            _models[key] = model
+    return model
+
+
+def create_generation_config(response_schema: Dict[str, Any]) -> GenerationConfig:
+    """
+    Create a GenerationConfig instance.
+
+    The output token limit is `preflight.max_output_tokens`, the same limit the preflight
+    plans chunking against.
+
+    Args:
+        response_schema (Dict[str, Any]): The schema for the response.
+
+    Returns:
+        GenerationConfig: An instance of GenerationConfig with the specified parameters.
+    """
+    try:
+        logger.info("Creating generation configuration")
+        generation_config = GenerationConfig(
+            temperature=0.0, 
+            top_p=0.0, 
+            top_k=1, 
+            candidate_count=1, 
+            max_output_tokens=config.PREFLIGHT_MAX_OUTPUT_TOKENS,
+            response_mime_type="application/json",
+            response_schema=response_schema
+        )
+        logger.info("Successfully created generation configuration")
+        return generation_config
+    except Exception as e:
+        logger.error(f"Error creating generation configuration: {e}")
+        raise
+
+
+def create_safety_settings() -> Dict[HarmCategory, HarmBlockThreshold]:
+    """
+    Create a safety settings dictionary.
+
+    Returns:
+        Dict[HarmCategory, HarmBlockThreshold]: A dictionary mapping harm categories to block thresholds.
+    """
+    try:
+        logger.info("Creating safety settings")
+        safety_settings = {
+            HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE
+        }
+        logger.info("Successfully created safety settings")
+        return safety_settings
+    except Exception as e:
+        logger.error(f"Error creating safety settings: {e}")
+        raise  # Re-raise the exception after logging
+
+
+def usage_fields(response: Any) -> Dict[str, Any]:
+    """
+    Extract token usage from a model response for telemetry.
+
+    Args:
+        response (Any): The response returned by `generate_content`.
+
+    Returns:
+        Dict[str, Any]: Prompt, output and total token counts (None when not reported).
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_token_count', None),
+        'output_tokens': getattr(usage, 'candidates_token_count', None),
+        'total_tokens': getattr(usage, 'total_token_count', None)
+    }
+
+
+class HedgingPolicy:
+    """
+    Decides when a slow call gets a duplicate (hedge) request.
+
+    The hedge delay is a percentile of the recent latencies of successful calls to the same
+    model, and hedges are capped at a fraction of all calls so that they cannot multiply
+    the request volume. Whether a call may be hedged can be set per workflow, taken from the
+    telemetry tags of the run making the call.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        percentile: float,
+        min_samples: int,
+        window: int,
+        budget: float,
+        workflows: Optional[Dict[str, bool]] = None
+    ):
+        """
+        Initialize the policy.
+
+        Args:
+            enabled (bool): Whether hedging is used by default.
+            percentile (float): The latency percentile after which a hedge is issued.
+            min_samples (int): The number of recent calls needed before hedging starts.
+            window (int): The number of recent latencies kept per model.
+            budget (float): The maximum ratio of hedges to calls.
+            workflows (Optional[Dict[str, bool]]): Per-workflow overrides of `enabled`.
+        """
+        self.enabled = enabled
+        self.workflows = dict(workflows or {})
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self._latencies: Dict[str, collections.deque] = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def observe(self, model_name: str, latency: float) -> None:
+        """
+        Record the latency of a successful call.
+
+        Args:
+            model_name (str): The model name.
+            latency (float): The call latency in seconds.
+        """
+        with self._lock:
+            self._latencies[model_name].append(latency)
+
+    def delay(self, model_name: str) -> Optional[float]:
+        """
+        Count a new call that may be hedged and get the delay after which it is.
+
+        Only calls of workflows with hedging enabled count towards the hedge budget.
+
+        Args:
+            model_name (str): The model name.
+
+        Returns:
+            Optional[float]: The hedge delay in seconds, or None if the call must not be hedged.
+        """
+        if not self.workflows.get(current_tags().get('workflow'), self.enabled):
+            return None
+        with self._lock:
+            self._calls += 1
+            latencies = self._latencies[model_name]
+            if len(latencies) < max(self.min_samples, 2):
+                return None
+            return statistics.quantiles(latencies, n=100, method='inclusive')[int(self.percentile) - 1]
+
+    def reset(self) -> None:
+        """
+        Forget the recorded latencies and the hedge budget, e.g. between tuning trials.
+        """
+        with self._lock:
+            self._latencies.clear()
+            self._calls = 0
+            self._hedges = 0
+
+    def try_acquire(self) -> bool:
+        """
+        Reserve a hedge if the budget allows it.
+
+        Returns:
+            bool: True if a hedge may be issued.
+        """
+        with self._lock:
+            if self._hedges + 1 > self.budget * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+
+hedging = HedgingPolicy(
+    config.HEDGING_ENABLED,
+    config.HEDGING_PERCENTILE,
+    config.HEDGING_MIN_SAMPLES,
+    config.HEDGING_WINDOW,
+    config.HEDGING_BUDGET,
+    config.HEDGING_WORKFLOWS
+)
+# Hedged attempts run here; a losing attempt cannot be cancelled and finishes in the background
+_hedge_executor = ThreadPoolExecutor(thread_name_prefix='hedged-call')
+
+# Errors after which a call is retried on another endpoint; other errors are specific to the request
+FAILOVER_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    ConnectionError,
+    TimeoutError
+)
+
+
+class Endpoint:
+    """
+    One (project, region) endpoint of the model backend, or a local stand-in for one.
+
+    Local stand-ins replay responses from the response cache with a simulated latency and
+    error rate, so that routing and failover can be exercised without the backend. The
+    latency is drawn around a mean, or from latencies recorded on the backend when given.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        project: Optional[str],
+        region: Optional[str],
+        models: Optional[List[str]] = None,
+        quota: Optional[float] = None,
+        local: bool = False,
+        latency: float = 1.0,
+        error_rate: float = 0.0,
+        latencies: Optional[List[float]] = None
+    ):
+        """
+        Initialize the endpoint.
+
+        Args:
+            name (str): The name used in logs and telemetry.
+            project (Optional[str]): The Google Cloud project.
+            region (Optional[str]): The Vertex AI region.
+            models (Optional[List[str]]): The model names served; None serves all models.
+            quota (Optional[float]): The endpoint's calls per minute; None for no limit.
+            local (bool): Whether this is a local stand-in.
+            latency (float): The mean simulated latency of a local stand-in, in seconds.
+            error_rate (float): The simulated error rate of a local stand-in.
+            latencies (Optional[List[float]]): Recorded call latencies a local stand-in replays instead of its mean latency.
+        """
+        self.name = name
+        self.project = project
+        self.region = region
+        self.models = set(models) if models else None
+        self.limiter = RateLimiter(quota)
+        self.local = local
+        self.simulated_latency = latency
+        self.simulated_error_rate = error_rate
+        self.replayed_latencies = latencies
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.down_until = 0.0
+        self.probing = False
+        self.in_flight = 0
+
+    @property
+    def is_default(self) -> bool:
+        """Whether the endpoint is the configured project and region, which `get_model` clients use."""
+        return not self.local and self.project == config.PROJECT_ID and self.region == config.REGION
+
+    def serves(self, model_name: Optional[str]) -> bool:
+        """
+        Check whether the endpoint serves a model.
+
+        Args:
+            model_name (Optional[str]): The model name.
+
+        Returns:
+            bool: True if calls to the model may be sent here.
+        """
+        return self.models is None or model_name in self.models
+
+
+class EndpointPool:
+    """
+    Spreads model calls across the configured endpoints.
+
+    A call goes to the available endpoint with the lowest expected completion time: the wait
+    for its quota plus its smoothed latency divided by its success rate. Endpoints without
+    measurements are tried first, and ties go to the endpoint with fewer calls in flight.
+    After `failure_threshold` consecutive failures an endpoint is taken out of rotation for
+    `cooldown` seconds, after which a single call is let through as a probe.
+    """
+
+    def __init__(self, endpoints: List[Endpoint], failure_threshold: int, cooldown: float, smoothing: float):
+        """
+        Initialize the pool.
+
+        Args:
+            endpoints (List[Endpoint]): The endpoints.
+            failure_threshold (int): Consecutive failures before an endpoint is taken out of rotation.
+            cooldown (float): Seconds an endpoint stays out of rotation.
+            smoothing (float): Weight of the latest call in the smoothed latency and error rate.
+        """
+        self.endpoints = endpoints
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def expected_time(endpoint: Endpoint) -> float:
+        """
+        Estimate the seconds until a call sent to an endpoint completes successfully.
+
+        Args:
+            endpoint (Endpoint): The endpoint.
+
+        Returns:
+            float: The quota wait plus the latency inflated by the expected retries.
+        """
+        return endpoint.limiter.wait_time() + (endpoint.latency or 0.0) / max(1 - endpoint.error_rate, 0.05)
+
+    def acquire(self, model_name: Optional[str], exclude: Set[str], timeout: Optional[float] = None) -> Optional[Endpoint]:
+        """
+        Choose an endpoint for a call and wait for its quota.
+
+        If every endpoint serving the model is out of rotation, the one that comes back first is
+        used rather than failing the call.
+
+        Args:
+            model_name (Optional[str]): The model name.
+            exclude (Set[str]): Names of endpoints already tried for this call.
+            timeout (Optional[float]): Seconds to wait for the quota at most, or None to wait indefinitely.
+
+        Returns:
+            Optional[Endpoint]: The endpoint, or None if no untried endpoint serves the model.
+
+        Raises:
+            google_exceptions.DeadlineExceeded: If the quota does not free up within the timeout.
+        """
+        with self._lock:
+            now = time.monotonic()
+            serving = [endpoint for endpoint in self.endpoints if endpoint.name not in exclude and endpoint.serves(model_name)]
+            if not serving:
+                return None
+            available = [endpoint for endpoint in serving if endpoint.down_until <= now and not endpoint.probing]
+            if available:
+                endpoint = min(available, key=lambda endpoint: (self.expected_time(endpoint), endpoint.in_flight, random.random()))
+            else:
+                endpoint = min(serving, key=lambda endpoint: endpoint.down_until)
+            # The first call after a cooldown probes whether the endpoint has recovered
+            endpoint.probing = endpoint.down_until > 0
+            endpoint.in_flight += 1
+        if not endpoint.limiter.acquire(timeout):
+            self.cancel(endpoint)
+            raise google_exceptions.DeadlineExceeded(f"Document deadline exceeded waiting for the quota of {endpoint.name}")
+        return endpoint
+
+    def cancel(self, endpoint: Endpoint) -> None:
+        """
+        Give back an endpoint acquired for a call that was never sent.
+
+        Args:
+            endpoint (Endpoint): The endpoint.
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.probing = False
+
+    def release(self, endpoint: Endpoint, latency: float, ok: bool) -> None:
+        """
+        Record the outcome of a call and update the endpoint's health.
+
+        Args:
+            endpoint (Endpoint): The endpoint the call was sent to.
+            latency (float): The call latency in seconds.
+            ok (bool): False if the call failed because of the endpoint.
+        """
+        state = None
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.error_rate += self.smoothing * ((0.0 if ok else 1.0) - endpoint.error_rate)
+            if ok:
+                endpoint.latency = latency if endpoint.latency is None else endpoint.latency + self.smoothing * (latency - endpoint.latency)
+                if endpoint.down_until:
+                    state = 'up'
+                endpoint.failures = 0
+                endpoint.down_until = 0.0
+            else:
+                endpoint.failures += 1
+                if endpoint.probing or endpoint.failures >= self.failure_threshold:
+                    endpoint.down_until = time.monotonic() + self.cooldown
+                    state = 'down'
+            endpoint.probing = False
+        if state is not None:
+            logger.info(f"Endpoint {endpoint.name} is {state}")
+            record_event('endpoint', endpoint=endpoint.name, state=state, failures=endpoint.failures)
+
+    @contextlib.contextmanager
+    def substitute(self, endpoints: List[Endpoint]) -> Generator[None, None, None]:
+        """
+        Send all calls made within the context to other endpoints, e.g. a local stand-in.
+
+        Args:
+            endpoints (List[Endpoint]): The endpoints used instead of the configured ones.
+        """
+        with self._lock:
+            configured, self.endpoints = self.endpoints, endpoints
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.endpoints = configured
+
+    def check_health(self) -> List[Dict[str, Any]]:
+        """
+        Probe every endpoint with a token count call (no generation) and update its health;
+        an endpoint failing the probe is taken out of rotation.
+
+        Returns:
+            List[Dict[str, Any]]: The status of each endpoint after the probe.
+        """
+        for endpoint in self.endpoints:
+            with self._lock:
+                endpoint.in_flight += 1
+                endpoint.probing = True
+            start_time = time.perf_counter()
+            try:
+                if endpoint.local:
+                    _simulate_local_call(endpoint)
+                else:
+                    endpoint_client(endpoint, get_model(['Health check'])).count_tokens(['ping'])
+                self.release(endpoint, time.perf_counter() - start_time, ok=True)
+            except Exception as e:
+                logger.error(f"Health check of endpoint {endpoint.name} failed: {e}")
+                self.release(endpoint, time.perf_counter() - start_time, ok=False)
+        return self.status()
+
+    def status(self) -> List[Dict[str, Any]]:
+        """
+        Describe the endpoints' current health and measurements.
+
+        Returns:
+            List[Dict[str, Any]]: Per endpoint, its name, availability, smoothed latency and error rate, and calls in flight.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return [{
+                'endpoint': endpoint.name,
+                'available': endpoint.down_until <= now,
+                'latency': endpoint.latency,
+                'error_rate': endpoint.error_rate,
+                'failures': endpoint.failures,
+                'in_flight': endpoint.in_flight
+            } for endpoint in self.endpoints]
+
+
+def create_endpoints(specs: List[Dict[str, Any]]) -> List[Endpoint]:
+    """
+    Create the endpoints described in the configuration.
+
+    Args:
+        specs (List[Dict[str, Any]]): The endpoint entries (project, region, model(s), quota, local, latency, error_rate, name).
+
+    Returns:
+        List[Endpoint]: The endpoints.
+    """
+    endpoints = []
+    for index, spec in enumerate(specs):
+        project = spec.get('project', config.PROJECT_ID)
+        region = spec.get('region', config.REGION)
+        local = spec.get('local', False)
+        name = spec.get('name') or (f'local-{index}' if local else f'{project}/{region}')
+        models = spec.get('models') or ([spec['model']] if spec.get('model') else None)
+        endpoints.append(Endpoint(
+            name, project, region, models, spec.get('quota'), local, spec.get('latency', 1.0), spec.get('error_rate', 0.0)
+        ))
+    return endpoints
+
+
+endpoint_pool = EndpointPool(
+    create_endpoints(config.ENDPOINTS),
+    config.ENDPOINT_FAILURE_THRESHOLD,
+    config.ENDPOINT_COOLDOWN,
+    config.ENDPOINT_SMOOTHING
+)
+
+
+def _probe_backend() -> bool:
+    """
+    Check whether any endpoint answers a token count call, the circuit breaker's low-cost probe.
+
+    Returns:
+        bool: True if at least one endpoint is healthy.
+    """
+    return any(status['available'] for status in endpoint_pool.check_health())
+
+
+circuit_breaker = CircuitBreaker(
+    config.BREAKER_ENABLED,
+    config.BREAKER_WINDOW,
+    config.BREAKER_MIN_CALLS,
+    config.BREAKER_ERROR_THRESHOLD,
+    config.BREAKER_OPEN_SECONDS,
+    config.BREAKER_MAX_OPEN_SECONDS,
+    _probe_backend
+)
+
+
+def endpoint_client(endpoint: Endpoint, model: GenerativeModel) -> GenerativeModel:
+    """
+    Get the client of a model bound to an endpoint's project and region, creating it on first use.
+
+    The client is created from the model's full resource name in the endpoint's project and
+    region, so the global Vertex AI configuration, which other threads' clients read, is
+    never switched.
+
+    Args:
+        endpoint (Endpoint): The endpoint.
+        model (GenerativeModel): The model client from `get_model`.
+
+    Returns:
+        GenerativeModel: The client for the endpoint.
+    """
+    if endpoint.is_default:
+        return model
+    # The SDK may hold the model as a full resource name of the default project and region
+    model_name = str(getattr(model, '_model_name', None)).rsplit('/', 1)[-1]
+    system_instruction = getattr(model, '_system_instruction', None)
+    key = (f'{endpoint.name}:{model_name}', tuple(system_instruction or ()))
+    with _models_lock:
+        client = _models.get(key)
+        if client is None:
+            logger.info(f"Creating generative model client for {model_name} on {endpoint.name}")
+            resource_name = f'projects/{endpoint.project}/locations/{endpoint.region}/publishers/google/models/{model_name}'
+            client = GenerativeModel(resource_name, system_instruction=system_instruction)
+            # The API host follows the client's location, which defaults to the global region
+            client._location = endpoint.region
+            _models[key] = client
+    return client
+
+
+def _simulate_local_call(endpoint: Endpoint) -> None:
+    """
+    Wait for a local stand-in's simulated latency and fail at its simulated error rate.
+
+    Args:
+        endpoint (Endpoint): The local endpoint.
+
+    Raises:
+        google_exceptions.ServiceUnavailable: For a simulated failure.
+    """
+    if endpoint.replayed_latencies:
+        time.sleep(random.choice(endpoint.replayed_latencies))
+    else:
+        time.sleep(endpoint.simulated_latency * random.uniform(0.5, 1.5))
+    if random.random() < endpoint.simulated_error_rate:
+        raise google_exceptions.ServiceUnavailable(f"Simulated failure of local endpoint {endpoint.name}")
+
+
+def _local_response(endpoint: Endpoint, model: GenerativeModel, contents: List[Part], response_schema: Dict[str, Any]) -> Any:
+    """
+    Answer a call on a local stand-in by replaying the response recorded in the response cache.
+
+    Args:
+        endpoint (Endpoint): The local endpoint.
+        model (GenerativeModel): The generative model.
+        contents (List[Part]): The contents of the call.
+        response_schema (Dict[str, Any]): The schema for the response.
+
+    Returns:
+        Any: A response object with the fields read from `generate_content` responses.
+
+    Raises:
+        LookupError: If no response was recorded for the call (record with cache mode 'write').
+    """
+    _simulate_local_call(endpoint)
+    path = _cache_path(response_cache_key(model, contents, response_schema))
+    if not os.path.exists(path):
+        raise LookupError(f"No recorded response for this call on local endpoint {endpoint.name}")
+    with open(path, 'r', encoding='utf-8') as file:
+        text = file.read()
+    return SimpleNamespace(text=text, usage_metadata=None, candidates=[SimpleNamespace(finish_reason='STOP', safety_ratings=[])])
+
+
+def endpoint_stats() -> List[Dict[str, Any]]:
+    """
+    Summarise the recorded model calls per endpoint.
+
+    Returns:
+        List[Dict[str, Any]]: Per endpoint, the calls, errors, error rate and median and p95 latency of successful calls.
+    """
+    calls = collections.defaultdict(list)
+    for event in load_events('call'):
+        if event.get('endpoint'):
+            calls[event['endpoint']].append(event)
+    stats = []
+    for name, events in sorted(calls.items()):
+        latencies = sorted(event['latency'] for event in events if event['status'] == 'ok')
+        errors = sum(1 for event in events if event['status'] == 'error')
+        stats.append({
+            'endpoint': name,
+            'calls': len(events),
+            'errors': errors,
+            'error_rate': errors / len(events),
+            'latency_p50': statistics.median(latencies) if latencies else None,
+            'latency_p95': statistics.quantiles(latencies, n=100, method='inclusive')[94] if len(latencies) >= 2 else None
+        })
+    return stats
+
+
+def _call_model(
+    model: GenerativeModel,
+    contents: List[Part],
+    response_schema: Dict[str, Any],
+    attempt: str,
+    sent: Optional[threading.Event] = None
+) -> Any:
+    """
+    Make one model call on the best available endpoint and parse its JSON output.
+
+    Calls that fail because of the endpoint (quota, unavailability, timeouts) fail over to
+    the next best endpoint that has not been tried yet. Waiting for the endpoint quota and
+    the rate limit is bounded by the deadline of the current document, if any, and each
+    attempt by the per-call timeout and whatever is left of the deadline after the waits.
+
+    Args:
+        model (GenerativeModel): The generative model to use.
+        contents (List[Part]): The contents to be processed by the model.
+        response_schema (Dict[str, Any]): The schema for the response.
+        attempt (str): 'primary' or 'hedge', recorded in the telemetry.
+        sent (Optional[threading.Event]): Set once the request is sent, after the waits for quota and the rate limit.
+
+    Returns:
+        Any: The parsed response.
+
+    Raises:
+        google_exceptions.DeadlineExceeded: If the call times out on every endpoint tried, or the document
+            deadline passes (including while waiting for quota or the rate limit).
+    """
+    model_name = getattr(model, '_model_name', None)
+    tried: Set[str] = set()
+    error: Optional[Exception] = None
+    while True:
+        endpoint = endpoint_pool.acquire(model_name, tried, remaining())
+        if endpoint is None:
+            if error is None:
+                raise ValueError(f"No endpoint serves model {model_name}")
+            raise error
+        tried.add(endpoint.name)
+        try:
+            if not rate_limiter.acquire(remaining()):
+                raise google_exceptions.DeadlineExceeded("Document deadline exceeded waiting for the rate limit")
+            # Taken after the waits, so that the call gets only what is left of the deadline
+            timeout = call_timeout()
+        except google_exceptions.DeadlineExceeded:
+            endpoint_pool.cancel(endpoint)
+            raise
+        if sent:
+            sent.set()
+        start_time = time.perf_counter()
+        try:
+            logger.info(f"Generating response using the generative model on {endpoint.name}")
+            if endpoint.local:
+                response = run_with_timeout(_local_response, timeout, endpoint, model, contents, response_schema)
+            else:
+                response = run_with_timeout(
+                    endpoint_client(endpoint, model).generate_content,
+                    timeout,
+                    contents,
+                    generation_config=create_generation_config(response_schema),
+                    safety_settings=create_safety_settings()
+                )
+        except Exception as e:
+            latency = time.perf_counter() - start_time
+            error = e
+            failover = isinstance(e, FAILOVER_ERRORS)
+            # Errors specific to the request say nothing about the endpoint's health
+            endpoint_pool.release(endpoint, latency, ok=not failover)
+            circuit_breaker.record(ok=not failover)
+            record_event('call', model=model_name, latency=latency, status='error', attempt=attempt, endpoint=endpoint.name, error=type(e).__name__)
+            logger.error(f"Error generating response on {endpoint.name}: {e}")
+            if failover:
+                continue
+            raise  # Re-raise the exception after logging
+
+        latency = time.perf_counter() - start_time
+        endpoint_pool.release(endpoint, latency, ok=True)
+        circuit_breaker.record(ok=True)
+        record_event('call', model=model_name, latency=latency, status='ok', attempt=attempt, endpoint=endpoint.name, **usage_fields(response))
+        hedging.observe(model_name, latency)
+        try:
+            output_json = json.loads(response.text.strip())
+        except json.JSONDecodeError as e:
+            logger.error(f"Error decoding JSON response: {e}")
+            raise  # Re-raise the exception after logging
+        logger.info(f"Response generated: {output_json}")
+        logger.info(f"Finish reason: {response.candidates[0].finish_reason}")
+        logger.info(f"Safety ratings: {response.candidates[0].safety_ratings}")
+        return output_json
+
+
+def _hedged_call(model: GenerativeModel, contents: List[Part], response_schema: Dict[str, Any], delay: float) -> Any:
+    """
+    Make a call and, if it is still running after the delay, race it against a duplicate.
+
+    The delay counts from when the request is sent, so that time spent waiting for quota
+    or the rate limit does not trigger a hedge. The generation config is deterministic (temperature 0), so both attempts are equivalent
+    and the first valid response wins. If the first attempt to finish fails, the other one
+    is awaited.
+
+    Args:
+        model (GenerativeModel): The generative model to use.
+        contents (List[Part]): The contents to be processed by the model.
+        response_schema (Dict[str, Any]): The schema for the response.
+        delay (float): Seconds to wait for the primary request before hedging.
+
+    Returns:
+        Any: The parsed response of the winning attempt.
+    """
+    # Each attempt runs in a copy of the caller's context so its telemetry keeps the run tags
+    sent = threading.Event()
+    primary = _hedge_executor.submit(bind_context(_call_model), model, contents, response_schema, 'primary', sent)
+    primary.add_done_callback(lambda _: sent.set())
+    sent.wait()
+    done, _ = wait([primary], timeout=delay)
+    if done or not hedging.try_acquire():
+        return primary.result()
+
+    logger.info(f"Call still running after {delay:.2f} seconds; issuing a hedged request")
+    hedge = _hedge_executor.submit(bind_context(_call_model), model, contents, response_schema, 'hedge')
+    attempts = {primary: 'primary', hedge: 'hedge'}
+    pending = set(attempts)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                record_event('hedge', model=getattr(model, '_model_name', None), delay=delay, winner=attempts[future])
+                return future.result()
+            error = future.exception()
+    record_event('hedge', model=getattr(model, '_model_name', None), delay=delay, winner=None)
+    raise error
+
+
+def generate_response(model: GenerativeModel, contents: List[Part], response_schema: Dict[str, Any]) -> Any:
+    """
+    Generate content using the generative model.
+
+    Each call is recorded in the telemetry with its latency and token usage. Calls wait for
+    the rate limiter and are spread across the configured endpoints, and responses are
+    replayed from or recorded to the response cache according to the cache mode. When
+    hedging is enabled, a call slower than the learned latency percentile is raced against a
+    duplicate request. While the circuit breaker is open, calls that are not served from the
+    cache fail fast with CircuitOpenError.
+
+    Args:
+        model (GenerativeModel): The generative model to use.
+        contents (List[Part]): The contents to be processed by the model.
+        response_schema (Dict[str, Any]): The schema for the response.
+
+    Returns:
+        Any: The generated response.
+
+    Raises:
+        CircuitOpenError: If the circuit breaker is open.
+    """
+    model_name = getattr(model, '_model_name', None)
+    cache_key = response_cache_key(model, contents, response_schema) if _cache_mode != 'off' else None
+    if _cache_mode in ('read', 'readwrite') and os.path.exists(_cache_path(cache_key)):
+        with open(_cache_path(cache_key), 'r', encoding='utf-8') as file:
+            output_json = json.load(file)
+        record_event('call', model=model_name, latency=0.0, status='cached')
+        logger.info(f"Response replayed from cache: {cache_key}")
+        return output_json
+
+    circuit_breaker.check()
+    delay = hedging.delay(model_name)
+    if delay is None:
+        output_json = _call_model(model, contents, response_schema, 'primary')
+    else:
+        output_json = _hedged_call(model, contents, response_schema, delay)
+    if _cache_mode in ('write', 'readwrite'):
+        atomic_write(_cache_path(cache_key), json.dumps(output_json))
+    return output_json
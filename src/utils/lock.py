@@ -0,0 +1,54 @@
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Generator
+from typing import Optional
+import contextlib
+import fcntl
+import time
+import os
+
+
+LOCK_DIR = os.path.join(config.DATA_DIR, 'locks')
+
+
+@contextlib.contextmanager
+def document_lock(file_name: str, workflow: str, timeout: Optional[float] = None) -> Generator[None, None, None]:
+    """
+    Hold an exclusive, cross-process lock for a single document within a workflow.
+
+    Concurrent or duplicate invocations for the same document are serialised so that
+    one run never reads intermediates another run is still producing. The lock is an
+    advisory `flock` on a per-document lock file and is released automatically if the
+    holding process dies.
+
+    Args:
+        file_name (str): The name of the PDF file (without extension) being processed.
+        workflow (str): The workflow name, e.g. 'single_step' or 'multi_step'.
+        timeout (Optional[float]): Seconds to wait for the lock, or a negative value to wait
+            indefinitely. None uses the configured `lock_timeout`.
+
+    Raises:
+        TimeoutError: If the lock could not be acquired within the timeout.
+    """
+    timeout = config.LOCK_TIMEOUT if timeout is None else timeout
+    lock_path = os.path.join(LOCK_DIR, workflow, f'{file_name}.lock')
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+
+    with open(lock_path, 'a') as lock_file:
+        start_time = time.monotonic()
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if timeout is not None and timeout >= 0 and time.monotonic() - start_time >= timeout:
+                    logger.error(f"Timed out after {timeout}s waiting for lock on {workflow}/{file_name}")
+                    raise TimeoutError(f"Could not acquire lock for {workflow}/{file_name}")
+                time.sleep(0.1)
+
+        logger.info(f"Acquired lock for {workflow}/{file_name}")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            logger.info(f"Released lock for {workflow}/{file_name}")
@@ -0,0 +1,310 @@
+from src.utils.record import MetricRecord
+from src.utils.record import load_records
+from src.utils.units import parse_unit
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+from typing import Any
+import contextlib
+import sqlite3
+import json
+import os
+
+
+INDEX_DB_PATH = os.path.join(config.DATA_DIR, 'index/metrics.sqlite')
+VALIDATION_DIR = os.path.join(config.DATA_DIR, 'validation')
+OUTPUT_DIR = os.path.join(config.DATA_DIR, 'output')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    workflow TEXT,
+    document_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    workflow TEXT,
+    document_id TEXT NOT NULL,
+    code TEXT,
+    item TEXT,
+    value REAL,
+    unit TEXT,
+    unit_key TEXT,
+    year INTEGER,
+    page_number INTEGER,
+    scope TEXT,
+    flag TEXT,
+    consumption_type TEXT,
+    source TEXT,
+    canonical_value REAL,
+    canonical_unit TEXT
+);
+CREATE TABLE IF NOT EXISTS documents (
+    document_id TEXT PRIMARY KEY,
+    company_id TEXT,
+    company_name TEXT,
+    country TEXT,
+    sector TEXT
+);
+CREATE INDEX IF NOT EXISTS metrics_code_year_unit ON metrics (code, year, unit_key);
+CREATE INDEX IF NOT EXISTS metrics_document ON metrics (document_id);
+CREATE INDEX IF NOT EXISTS metrics_path ON metrics (path);
+CREATE INDEX IF NOT EXISTS documents_sector ON documents (sector);
+CREATE INDEX IF NOT EXISTS documents_company ON documents (company_name);
+"""
+
+METRIC_COLUMNS = ('code', 'item', 'value', 'unit', 'year', 'page_number', 'scope', 'flag', 'consumption_type', 'source', 'canonical_value', 'canonical_unit')
+
+# Bumped whenever the schema changes; an index with another version is rebuilt from scratch
+SCHEMA_VERSION = 3
+
+
+@contextlib.contextmanager
+def connect(db_path: str = INDEX_DB_PATH):
+    """
+    Open the metric index, creating its schema on first use, and commit on success.
+
+    Args:
+        db_path (str): The path of the SQLite database.
+
+    Yields:
+        sqlite3.Connection: The connection, returning rows as sqlite3.Row.
+    """
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        connection.execute('PRAGMA foreign_keys = ON')
+        if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            connection.executescript('DROP TABLE IF EXISTS metrics; DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS documents;')
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        connection.executescript(SCHEMA)
+        yield connection
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def source_files() -> List[Tuple[str, str, Optional[str], str]]:
+    """
+    List the JSONL files covered by the index.
+
+    Returns:
+        List[Tuple[str, str, Optional[str], str]]: Per file, its path, kind ('generated' or
+        'expected'), workflow (None for expected rows) and document ID.
+    """
+    files = []
+    expected_dir = os.path.join(VALIDATION_DIR, 'expected')
+    generated_dir = os.path.join(VALIDATION_DIR, 'generated')
+    if os.path.isdir(expected_dir):
+        for name in sorted(os.listdir(expected_dir)):
+            if name.endswith('.jsonl'):
+                files.append((os.path.join(expected_dir, name), 'expected', None, name[:-len('.jsonl')]))
+    if os.path.isdir(generated_dir):
+        for workflow in sorted(os.listdir(generated_dir)):
+            workflow_dir = os.path.join(generated_dir, workflow)
+            if not os.path.isdir(workflow_dir):
+                continue
+            for name in sorted(os.listdir(workflow_dir)):
+                if name.endswith('.jsonl'):
+                    files.append((os.path.join(workflow_dir, name), 'generated', workflow, name[:-len('.jsonl')]))
+    return files
+
+
+def _as_int(value: Optional[float]) -> Optional[int]:
+    return int(value) if value is not None else None
+
+
+def unit_key(unit: Optional[str]) -> Optional[str]:
+    """
+    Get the key on which units are filtered, so that spellings of one unit match.
+
+    Args:
+        unit (Optional[str]): The raw unit string.
+
+    Returns:
+        Optional[str]: The parsed unit and its scale (e.g. 'tons x1000' for 'ktonnes' and 'kt'),
+        the trimmed spelling of an unrecognised unit, or None without a unit.
+    """
+    parsed = parse_unit(unit)
+    if parsed is not None:
+        return f"{parsed.name} x{parsed.factor:.6g}"
+    if isinstance(unit, str) and unit.strip():
+        return unit.strip()
+    return None
+
+
+def output_year(workflow: Optional[str], document_id: str) -> Optional[int]:
+    """
+    Read the reporting year of a workflow output that holds it once for all its rows.
+
+    Single-step outputs carry the year at the top level, next to "metrics", and their
+    JSONL rows have none.
+
+    Args:
+        workflow (Optional[str]): The workflow name.
+        document_id (str): The document ID.
+
+    Returns:
+        Optional[int]: The output's year, or None if the output has no top-level year.
+    """
+    path = os.path.join(OUTPUT_DIR, f'{workflow}/{document_id}/out.txt')
+    if workflow is None or not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            output = json.load(file)
+    except (IOError, json.JSONDecodeError) as e:
+        logger.error(f"Error reading the year of {path}: {e}")
+        return None
+    year = output.get('year') if isinstance(output, dict) else None
+    return int(year) if isinstance(year, (int, float)) and not isinstance(year, bool) else None
+
+
+def _ingest(connection: sqlite3.Connection, path: str, kind: str, workflow: Optional[str], document_id: str) -> int:
+    """
+    Replace the indexed rows of one JSONL file.
+
+    Args:
+        connection (sqlite3.Connection): The index connection.
+        path (str): The JSONL file path.
+        kind (str): 'generated' or 'expected'.
+        workflow (Optional[str]): The workflow of generated rows.
+        document_id (str): The document ID.
+
+    Returns:
+        int: The number of indexed rows.
+    """
+    records: List[MetricRecord] = load_records(path)
+    year = output_year(workflow, document_id) if kind == 'generated' else None
+    stat = os.stat(path)
+    connection.execute('DELETE FROM metrics WHERE path = ?', (path,))
+    connection.execute(
+        'INSERT OR REPLACE INTO files (path, kind, workflow, document_id, size, mtime) VALUES (?, ?, ?, ?, ?, ?)',
+        (path, kind, workflow, document_id, stat.st_size, stat.st_mtime)
+    )
+    connection.executemany(
+        f"INSERT INTO metrics (path, kind, workflow, document_id, unit_key, {', '.join(METRIC_COLUMNS)}) VALUES ({', '.join('?' * (5 + len(METRIC_COLUMNS)))})",
+        [
+            (path, kind, workflow, document_id, unit_key(record.unit), record.code, record.item, record.value, record.unit,
+             _as_int(record.year if record.year is not None else year), _as_int(record.page_number), record.scope, record.flag,
+             record.consumption_type, record.source, record.canonical_value, record.canonical_unit)
+            for record in records
+        ]
+    )
+    # Expected rows carry the company attributes that generated rows are queried by
+    company = next((record for record in records if record.company_id is not None or record.sector is not None), None)
+    if company is not None:
+        connection.execute(
+            'INSERT OR REPLACE INTO documents (document_id, company_id, company_name, country, sector) VALUES (?, ?, ?, ?, ?)',
+            (document_id, None if company.company_id is None else str(company.company_id), company.company_name, company.country, company.sector)
+        )
+    return len(records)
+
+
+def update_index(db_path: str = INDEX_DB_PATH) -> Dict[str, int]:
+    """
+    Bring the index up to date with the generated and expected JSONL files.
+
+    Only files that are new or whose size or modification time changed are re-read, and
+    rows of deleted files are removed, so updates after a batch run are cheap.
+
+    Args:
+        db_path (str): The path of the SQLite database.
+
+    Returns:
+        Dict[str, int]: The number of files added or updated, removed and unchanged, and of rows ingested.
+    """
+    stats = {'updated': 0, 'removed': 0, 'unchanged': 0, 'rows': 0}
+    with connect(db_path) as connection:
+        indexed = {row['path']: (row['size'], row['mtime']) for row in connection.execute('SELECT path, size, mtime FROM files')}
+        current = source_files()
+        for path, kind, workflow, document_id in current:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                logger.error(f"Error reading {path}: {e}")
+                continue
+            if indexed.get(path) == (stat.st_size, stat.st_mtime):
+                stats['unchanged'] += 1
+                continue
+            try:
+                stats['rows'] += _ingest(connection, path, kind, workflow, document_id)
+                stats['updated'] += 1
+            except Exception as e:
+                logger.error(f"Error indexing {path}: {e}")
+        for path in set(indexed) - {path for path, _, _, _ in current}:
+            connection.execute('DELETE FROM metrics WHERE path = ?', (path,))
+            connection.execute('DELETE FROM files WHERE path = ?', (path,))
+            stats['removed'] += 1
+    logger.info(f"Metric index updated: {stats}")
+    return stats
+
+
+def query_metrics(
+    code: Optional[str] = None,
+    year: Optional[int] = None,
+    unit: Optional[str] = None,
+    sector: Optional[str] = None,
+    company: Optional[str] = None,
+    country: Optional[str] = None,
+    kind: Optional[str] = None,
+    workflow: Optional[str] = None,
+    document_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    db_path: str = INDEX_DB_PATH
+) -> List[Dict[str, Any]]:
+    """
+    Query indexed metrics across documents.
+
+    All filters are optional and combined with AND. Units match by their parsed unit and
+    scale, so 'tonnes' finds rows reported in 't' or 'metric tons' (see `unit_key`).
+    Company matches the company name case-insensitively as a substring, or the company ID exactly. Rows carry the value in
+    its canonical unit (GJ, cubic meters, tons or %) for aggregation across documents.
+
+    Args:
+        code (Optional[str]): The metric code, e.g. '429'.
+        year (Optional[int]): The reporting year.
+        unit (Optional[str]): The unit, e.g. 'GJ'.
+        sector (Optional[str]): The company sector, e.g. 'Food'.
+        company (Optional[str]): The company name (substring) or ID.
+        country (Optional[str]): The company country.
+        kind (Optional[str]): 'generated' or 'expected'.
+        workflow (Optional[str]): The workflow of generated rows.
+        document_id (Optional[str]): The document ID.
+        limit (Optional[int]): The maximum number of rows.
+        db_path (str): The path of the SQLite database.
+
+    Returns:
+        List[Dict[str, Any]]: The matching metrics with their document's company attributes.
+    """
+    conditions, parameters = [], []
+    for column, value in (('m.code', code), ('m.year', year), ('m.unit_key', unit_key(unit)), ('d.sector', sector), ('d.country', country),
+                          ('m.kind', kind), ('m.workflow', workflow), ('m.document_id', document_id)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            parameters.append(value)
+    if company is not None:
+        conditions.append("(d.company_name LIKE ? OR d.company_id = ?)")
+        parameters.extend([f'%{company}%', company])
+
+    sql = (
+        f"SELECT m.kind, m.workflow, m.document_id, {', '.join('m.' + column for column in METRIC_COLUMNS)}, "
+        "d.company_id, d.company_name, d.country, d.sector "
+        "FROM metrics m LEFT JOIN documents d ON d.document_id = m.document_id"
+    )
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY m.document_id, m.kind, m.workflow, m.code'
+    if limit:
+        sql += f' LIMIT {int(limit)}'
+
+    with connect(db_path) as connection:
+        return [dict(row) for row in connection.execute(sql, parameters)]
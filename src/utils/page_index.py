@@ -0,0 +1,318 @@
+from src.utils.pdf import extract_page_texts
+from src.utils.rules import normalize_text
+from src.utils.rules import parse_number
+from src.utils.dedup import file_sha256
+from src.utils.rules import NUMBER
+from src.utils.telemetry import record_event
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from collections import Counter
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+from typing import Any
+import numpy as np
+import functools
+import struct
+import mmap
+import re
+import os
+
+
+PAGES_DIR = os.path.join(config.DATA_DIR, 'index/pages')
+
+# File layout: header, page table (text offset and length per page), value table sorted by
+# value (value, page, byte offset in the page text), then the normalised page texts
+MAGIC = b'ESGP'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+PAGE_ENTRY = struct.Struct('<QI')
+NUMBER_DTYPE = np.dtype([('value', '<f8'), ('page', '<u4'), ('offset', '<u4')])
+NUMBER_PATTERN = re.compile(NUMBER.encode('ascii'))
+
+# Bytes between a snippet and a value for the value to count as near it
+NEAR_WINDOW = 200
+# Relative tolerance when comparing an extracted value with a printed number
+VALUE_TOLERANCE = 1e-6
+
+VERIFICATION_STATUSES = ('verified', 'corrected', 'unverified', 'absent', 'no_text')
+
+# Snippets of rows for metrics the model did not find in the document
+ABSENT_SNIPPETS = ('', 'null', 'none', 'n/a')
+
+
+def index_path(file_path: str) -> str:
+    """
+    Get the index path of a document, keyed by its content hash so that copies share it.
+
+    Args:
+        file_path (str): The PDF path.
+
+    Returns:
+        str: The index path.
+    """
+    return os.path.join(PAGES_DIR, f'{file_sha256(file_path)}.idx')
+
+
+def build_page_index(file_path: str) -> Optional[str]:
+    """
+    Build the page index of a document once: its normalised page texts and every number
+    printed on each page, parsed as in the step 2 instructions.
+
+    Args:
+        file_path (str): The PDF path.
+
+    Returns:
+        Optional[str]: The index path, or None if the document has no usable text layer.
+    """
+    path = index_path(file_path)
+    if os.path.exists(path):
+        return path
+    page_texts = extract_page_texts(file_path)
+    if not page_texts or not any(text.strip() for text in page_texts):
+        return None
+
+    texts = [normalize_text(text).lower().encode('utf-8') for text in page_texts]
+    numbers = []
+    for page, text in enumerate(texts, start=1):
+        for match in NUMBER_PATTERN.finditer(text):
+            value = parse_number(match.group().decode('ascii'))
+            if value is not None:
+                numbers.append((value, page, match.start()))
+    table = np.array(numbers, dtype=NUMBER_DTYPE)
+    table.sort(order='value')
+
+    header_size = HEADER.size + PAGE_ENTRY.size * len(texts)
+    numbers_offset = header_size + (-header_size % NUMBER_DTYPE.alignment)
+    text_offset = numbers_offset + table.nbytes
+    page_table, offset = [], text_offset
+    for text in texts:
+        page_table.append(PAGE_ENTRY.pack(offset, len(text)))
+        offset += len(text)
+    content = b''.join([
+        HEADER.pack(MAGIC, VERSION, len(texts), len(table)),
+        *page_table,
+        b'\0' * (numbers_offset - header_size),
+        table.tobytes(),
+        *texts
+    ])
+    atomic_write(path, content)
+    logger.info(f"Built page index of {file_path}: {len(texts)} pages, {len(table)} numbers")
+    return path
+
+
+class PageIndex:
+    """
+    Read-only, memory-mapped view of a document's page index.
+
+    The value table is a zero-copy NumPy view of the mapping, so looking up a value is a
+    binary search and snippet searches run over the mapped page text without decoding it.
+    """
+
+    def __init__(self, path: str):
+        """
+        Map an index file.
+
+        Args:
+            path (str): The index path.
+
+        Raises:
+            ValueError: If the file is not a page index of the current version.
+        """
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.page_count, number_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a page index of version {VERSION}: {path}")
+        self._pages = [PAGE_ENTRY.unpack_from(self._map, HEADER.size + PAGE_ENTRY.size * i) for i in range(self.page_count)]
+        header_size = HEADER.size + PAGE_ENTRY.size * self.page_count
+        numbers_offset = header_size + (-header_size % NUMBER_DTYPE.alignment)
+        self.numbers = np.frombuffer(self._map, dtype=NUMBER_DTYPE, count=number_count, offset=numbers_offset)
+
+    def page_text(self, page: int) -> bytes:
+        """
+        Get the normalised, lower-cased text of a page.
+
+        Args:
+            page (int): The page number (1-based).
+
+        Returns:
+            bytes: The UTF-8 page text.
+        """
+        offset, length = self._pages[page - 1]
+        return self._map[offset:offset + length]
+
+    def occurrences(self, value: float) -> np.ndarray:
+        """
+        Find where a value is printed in the document.
+
+        Args:
+            value (float): The value.
+
+        Returns:
+            np.ndarray: The matching rows (value, page, offset) of the value table.
+        """
+        tolerance = VALUE_TOLERANCE * max(1.0, abs(value))
+        values = self.numbers['value']
+        return self.numbers[np.searchsorted(values, value - tolerance, 'left'):np.searchsorted(values, value + tolerance, 'right')]
+
+    def find(self, page: int, needle: bytes) -> int:
+        """
+        Find a normalised text in a page.
+
+        Args:
+            page (int): The page number (1-based).
+            needle (bytes): The normalised, lower-cased UTF-8 text.
+
+        Returns:
+            int: The byte offset in the page text, or -1 if absent.
+        """
+        offset, length = self._pages[page - 1]
+        position = self._map.find(needle, offset, offset + length)
+        return position - offset if position >= 0 else -1
+
+
+@functools.lru_cache(maxsize=64)
+def _open_index(path: str) -> PageIndex:
+    return PageIndex(path)
+
+
+def load_page_index(file_path: str) -> Optional[PageIndex]:
+    """
+    Get the page index of a document, building it on first use.
+
+    Args:
+        file_path (str): The PDF path.
+
+    Returns:
+        Optional[PageIndex]: The index, or None if the document has no usable text layer.
+    """
+    try:
+        path = build_page_index(file_path)
+        return _open_index(path) if path else None
+    except Exception as e:
+        logger.error(f"Error loading page index of {file_path}: {e}")
+        return None
+
+
+def _row_value(value: Any) -> Optional[float]:
+    if isinstance(value, str):
+        return parse_number(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+        return float(value)
+    return None
+
+
+def verify_row(index: PageIndex, row: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+    """
+    Check that a row's value is printed on its claimed page, near its snippet.
+
+    A page scores 2 when the value is printed near the snippet, 1 when it is printed
+    elsewhere on the page and 0 otherwise. A row is verified when its claimed page has the
+    best score; when a single other page scores higher, that page is proposed instead, and
+    when several do, the row is unverified.
+
+    Args:
+        index (PageIndex): The document's page index.
+        row (Dict[str, Any]): A row with value, page_number and snippet.
+
+    Returns:
+        Tuple[str, Optional[int]]: 'verified', 'corrected', 'unverified' or 'absent' (no snippet,
+        i.e. the model reported the metric as not found), and the proposed page for 'corrected'.
+    """
+    if str(row.get('snippet') or '').strip().lower() in ABSENT_SNIPPETS:
+        return 'absent', None
+    value = _row_value(row.get('value'))
+    if value is None:
+        return 'unverified', None
+    hits = index.occurrences(value)
+    if not len(hits):
+        return 'unverified', None
+
+    snippet = normalize_text(str(row.get('snippet') or '')).lower().encode('utf-8')
+    scores: Dict[int, int] = {}
+    for page in np.unique(hits['page']).tolist():
+        scores[page] = 1
+        if snippet:
+            at = index.find(page, snippet)
+            offsets = hits['offset'][hits['page'] == page].astype(np.int64)
+            if at >= 0 and np.any((offsets >= at - NEAR_WINDOW) & (offsets <= at + len(snippet) + NEAR_WINDOW)):
+                scores[page] = 2
+
+    try:
+        claimed = int(row.get('page_number'))
+    except (TypeError, ValueError):
+        claimed = None
+    best = max(scores.values())
+    if scores.get(claimed, 0) == best:
+        return 'verified', None
+    best_pages = [page for page, score in scores.items() if score == best]
+    if len(best_pages) == 1:
+        return 'corrected', best_pages[0]
+    # Several pages beat the claimed one, so the claim cannot be confirmed nor corrected
+    return 'unverified', None
+
+
+def verify_rows(file_path: str, rows: List[Dict[str, Any]], correct_pages: bool) -> List[str]:
+    """
+    Verify rows against a document's page index, optionally moving them to the page their
+    value and snippet were found on.
+
+    Args:
+        file_path (str): The PDF path.
+        rows (List[Dict[str, Any]]): The rows, updated in place when pages are corrected.
+        correct_pages (bool): Whether to replace page numbers of 'corrected' rows.
+
+    Returns:
+        List[str]: The status of each row ('no_text' for all rows if the document has no text layer).
+    """
+    index = load_page_index(file_path)
+    if index is None:
+        return ['no_text'] * len(rows)
+    statuses = []
+    for row in rows:
+        status, page = verify_row(index, row)
+        if status == 'corrected' and correct_pages:
+            logger.info(f"Moving metric {row.get('code')} from page {row.get('page_number')} to page {page}")
+            row['page_number'] = page
+        statuses.append(status)
+    return statuses
+
+
+def summarize_statuses(statuses: List[str]) -> Dict[str, int]:
+    """
+    Count verification statuses.
+
+    Args:
+        statuses (List[str]): The status of each row.
+
+    Returns:
+        Dict[str, int]: The count of each status.
+    """
+    counts = Counter(statuses)
+    return {status: counts.get(status, 0) for status in VERIFICATION_STATUSES}
+
+
+def mark_rows(file_path: str, rows: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Verify a run's final rows, correcting page numbers if configured, and record the outcome.
+
+    Each row gets a 'verification' field with its status, and the status counts are
+    recorded in the telemetry as a 'verify' event.
+
+    Args:
+        file_path (str): The PDF path.
+        rows (List[Dict[str, Any]]): The final rows, updated in place.
+
+    Returns:
+        Dict[str, int]: The count of each status.
+    """
+    statuses = verify_rows(file_path, rows, config.VERIFICATION_CORRECT_PAGES)
+    for row, status in zip(rows, statuses):
+        row['verification'] = status
+    summary = summarize_statuses(statuses)
+    record_event('verify', **summary)
+    logger.info(f"Verified {len(rows)} rows against the text layer of {file_path}: {summary}")
+    return summary
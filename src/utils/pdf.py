@@ -0,0 +1,80 @@
+from src.utils.archive import read_archived
+from src.config.logging import logger
+from typing import Optional
+from typing import List
+import io
+import os
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf is only needed for the offline text-layer features
+    PdfReader = None
+
+
+def _open_reader(file_path: str) -> 'PdfReader':
+    """
+    Open a PDF from disk, or from the configured archive if it is not on disk.
+
+    Args:
+        file_path (str): The path to the PDF file.
+
+    Returns:
+        PdfReader: The reader.
+
+    Raises:
+        FileNotFoundError: If the file is neither on disk nor archived.
+    """
+    if os.path.exists(file_path):
+        return PdfReader(file_path)
+    content = read_archived(file_path)
+    if content is None:
+        raise FileNotFoundError(file_path)
+    return PdfReader(io.BytesIO(content))
+
+
+def extract_page_texts(file_path: str) -> Optional[List[str]]:
+    """
+    Extract the text layer of each page of a PDF document.
+
+    Args:
+        file_path (str): The path to the PDF file.
+
+    Returns:
+        Optional[List[str]]: The text of each page (index 0 is page 1), or None if the
+        text layer could not be extracted (missing dependency, encrypted or corrupt file).
+    """
+    if PdfReader is None:
+        logger.warning("pypdf is not installed; the PDF text layer is unavailable")
+        return None
+    try:
+        logger.info(f"Extracting text layer from {file_path}")
+        reader = _open_reader(file_path)
+        page_texts = [page.extract_text() or '' for page in reader.pages]
+        logger.info(f"Extracted text from {len(page_texts)} pages of {file_path}")
+        return page_texts
+    except FileNotFoundError:
+        logger.error(f"File not found: {file_path}")
+    except Exception as e:
+        logger.error(f"Error extracting text from {file_path}: {e}")
+    return None
+
+
+def count_pages(file_path: str) -> Optional[int]:
+    """
+    Count the pages of a PDF document without extracting its text.
+
+    Args:
+        file_path (str): The path to the PDF file.
+
+    Returns:
+        Optional[int]: The number of pages, or None if the file could not be read.
+    """
+    if PdfReader is None:
+        logger.warning("pypdf is not installed; page counts are unavailable")
+        return None
+    try:
+        return len(_open_reader(file_path).pages)
+    except Exception as e:
+        logger.error(f"Error counting pages of {file_path}: {e}")
+    return None
+
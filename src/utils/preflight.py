@@ -0,0 +1,460 @@
+from src.utils.template import load_system_instruction
+from src.utils.template import load_user_instruction
+from src.utils.template import load_response_schema
+from src.utils.template import load_merged_templates
+from src.utils.template import load_metric_catalogue
+from vertexai.generative_models import Part
+from src.utils.pdf import extract_page_texts
+from src.utils.rules import metric_labels
+from src.utils.rules import normalize_text
+from src.utils.telemetry import record_event
+from src.utils.cascade import is_routed
+from src.utils.slim import upload_path
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from src.utils.llm import get_model
+from src.utils.rules import GRI_302_1
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+from typing import Any
+import functools
+import threading
+import hashlib
+import json
+import math
+import re
+import os
+
+try:
+    from pypdf import PdfReader
+    from pypdf import PdfWriter
+except ImportError:  # pypdf is only needed for the offline text-layer features
+    PdfReader = PdfWriter = None
+
+
+TOKEN_CACHE_PATH = os.path.join(config.DATA_DIR, 'cache/tokens.json')
+FILTERED_DIR = os.path.join(config.DATA_DIR, 'cache/filtered')
+OUTPUT_DIR = os.path.join(config.DATA_DIR, 'output')
+
+# Local estimator: Gemini bills each PDF page as an image of 258 tokens, and text at about
+# 4 characters per token
+TOKENS_PER_PAGE = 258
+CHARS_PER_TOKEN = 4
+
+# Output tokens per metric row and fixed output tokens of each step, and input tokens per
+# metric of the upstream output handed to steps 2 and 3, measured on the stored outputs
+OUTPUT_TOKENS_PER_METRIC = {'1': 15, '2': 55, '3': 110, 'single': 115, 'fused': 230}
+OUTPUT_TOKENS_FIXED = {'0': 60, '1': 5, '2': 5, '3': 5, 'single': 10, 'fused': 10}
+INPUT_TOKENS_PER_METRIC = {'2': 15, '3': 55}
+
+# Model calls of each workflow, in order; the hybrid workflow is planned as if the rules
+# resolved nothing, its worst case
+WORKFLOW_STEPS = {
+    'single_step': ('single',),
+    'multi_step': ('0', '1', '2', '3'),
+    'merged_step': ('0', 'fused'),
+    'hybrid': ('1', '2', '3')
+}
+
+# Steps whose metrics can be split over several calls (multi-step pipelined chains)
+CHUNKED_STEPS = ('2', '3')
+
+# Share of max_output_tokens a predicted output may use before the step is chunked
+OUTPUT_HEADROOM = 0.8
+
+_token_cache: Optional[Dict[str, int]] = None
+_token_cache_lock = threading.Lock()
+
+
+def _load_token_cache() -> Dict[str, int]:
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = {}
+        if os.path.exists(TOKEN_CACHE_PATH):
+            try:
+                with open(TOKEN_CACHE_PATH, 'r', encoding='utf-8') as file:
+                    _token_cache = json.load(file)
+            except (IOError, json.JSONDecodeError) as e:
+                logger.error(f"Error loading token cache {TOKEN_CACHE_PATH}, starting a new one: {e}")
+    return _token_cache
+
+
+def count_tokens(contents: List[Any], key: str, model_name: str, mode: str, estimate: int) -> int:
+    """
+    Count the input tokens of some contents, cached by content hash.
+
+    Args:
+        contents (List[Any]): The contents as sent to the model (parts or strings).
+        key (str): The content hash of the contents.
+        model_name (str): The model whose tokenizer counts.
+        mode (str): 'count_tokens' to ask the model, 'local' to use the estimate.
+        estimate (int): The local estimate, also used if the count call fails.
+
+    Returns:
+        int: The number of tokens.
+    """
+    if mode != 'count_tokens':
+        return estimate
+    cache_key = f'{model_name}:{key}'
+    with _token_cache_lock:
+        cached = _load_token_cache().get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        tokens = get_model(['Token count'], model_name).count_tokens(contents).total_tokens
+    except Exception as e:
+        logger.error(f"Error counting tokens with {model_name}, using the local estimate: {e}")
+        return estimate
+    with _token_cache_lock:
+        cache = _load_token_cache()
+        cache[cache_key] = tokens
+        atomic_write(TOKEN_CACHE_PATH, json.dumps(cache))
+    return tokens
+
+
+def text_tokens(text: str, model_name: str, mode: str) -> int:
+    """
+    Count the tokens of a text.
+
+    Args:
+        text (str): The text.
+        model_name (str): The model whose tokenizer counts.
+        mode (str): 'count_tokens' or 'local'.
+
+    Returns:
+        int: The number of tokens.
+    """
+    key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    return count_tokens([text], key, model_name, mode, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def pdf_tokens(file_path: str, model_name: str, mode: str) -> Tuple[int, Optional[int]]:
+    """
+    Count the tokens of a PDF as it is uploaded.
+
+    Args:
+        file_path (str): The PDF file that is uploaded.
+        model_name (str): The model whose tokenizer counts.
+        mode (str): 'count_tokens' or 'local'.
+
+    Returns:
+        Tuple[int, Optional[int]]: The number of tokens, and of pages (None if unreadable).
+    """
+    with open(file_path, 'rb') as file:
+        pdf_bytes = file.read()
+    pages = None
+    if PdfReader is not None:
+        try:
+            pages = len(PdfReader(file_path).pages)
+        except Exception as e:
+            logger.error(f"Error counting pages of {file_path}: {e}")
+    # Without a page count, assume a typical 100 KB per page
+    estimate = TOKENS_PER_PAGE * (pages if pages is not None else max(1, len(pdf_bytes) // 100_000))
+    contents = [Part.from_data(data=pdf_bytes, mime_type='application/pdf')]
+    return count_tokens(contents, hashlib.sha256(pdf_bytes).hexdigest(), model_name, mode, estimate), pages
+
+
+@functools.lru_cache(maxsize=None)
+def _step_template(step: str) -> str:
+    """
+    Get the text a step sends besides the document: system and user instructions and schema.
+
+    Args:
+        step (str): The step (0-3, 'single' or 'fused').
+
+    Returns:
+        str: The concatenated template text.
+    """
+    if step == 'fused':
+        system_instruction, user_instruction, response_schema = load_merged_templates()
+    else:
+        workflow, number = ('single_step', None) if step == 'single' else ('multi_step', int(step))
+        system_instruction = load_system_instruction(workflow=workflow, step=number)
+        user_instruction = load_user_instruction(workflow=workflow, step=number)
+        response_schema = load_response_schema(workflow=workflow, step=number)
+    return '\n'.join(system_instruction + [user_instruction, json.dumps(response_schema)])
+
+
+def metric_count(file_name: str) -> Tuple[int, str]:
+    """
+    Predict how many metrics a document yields.
+
+    Args:
+        file_name (str): The document ID.
+
+    Returns:
+        Tuple[int, str]: The count and its source: 'step_1' (a stored multi-step step 1
+        output of the document) or 'catalogue' (every catalogue metric, the upper bound).
+    """
+    for workflow in ('multi_step', 'hybrid'):
+        path = os.path.join(OUTPUT_DIR, f'{workflow}/{file_name}/out_step_1.txt')
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return len(json.load(file)), 'step_1'
+        except (IOError, json.JSONDecodeError, TypeError):
+            continue
+    return len(load_metric_catalogue()), 'catalogue'
+
+
+def context_tokens(model_name: str) -> int:
+    """
+    Get the input token limit of a model.
+
+    Args:
+        model_name (str): The model name.
+
+    Returns:
+        int: The limit from `preflight.context_tokens`, or the default for unlisted models.
+    """
+    return config.PREFLIGHT_CONTEXT_TOKENS.get(model_name, config.PREFLIGHT_DEFAULT_CONTEXT_TOKENS)
+
+
+def relevant_pages(file_path: str) -> Optional[List[int]]:
+    """
+    Select the pages likely to disclose metrics: those naming a catalogue metric or the
+    GRI 302-1 disclosure.
+
+    Args:
+        file_path (str): The PDF path.
+
+    Returns:
+        Optional[List[int]]: The page numbers (1-based), or None without a usable text layer.
+    """
+    page_texts = extract_page_texts(file_path)
+    if not page_texts or not any(text.strip() for text in page_texts):
+        return None
+    labels = [label for entry in load_metric_catalogue() for label in metric_labels(entry)]
+    label_pattern = re.compile('|'.join(re.escape(label) for label in sorted(labels, key=len, reverse=True)))
+    pages = []
+    for page, text in enumerate(page_texts, start=1):
+        text = normalize_text(text)
+        if GRI_302_1.search(text) or label_pattern.search(text.lower()):
+            pages.append(page)
+    return pages
+
+
+def plan_document(workflow: str, file_name: str, mode: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Estimate the tokens of each model call of a document and decide how to run it.
+
+    Each step's input is the uploaded PDF, its templates and, for steps 2 and 3, the
+    upstream output; its output is predicted from the metric count. The plan then:
+    - routes the document to `text_gen_model_name` without the cascade, or to
+      `preflight.large_context_model`, when an input exceeds the context of the models that
+      would serve it;
+    - filters the PDF down to the pages likely to disclose metrics when no model fits, or
+      when the PDF has more than `preflight.max_pages` pages;
+    - chunks steps 2 and 3 when their output would come close to max_output_tokens.
+    Single-call workflows cannot be chunked; a likely truncation is reported as a warning.
+    Chunked steps (planned or from `multi_step.pipelining`) count the PDF once per chunk.
+
+    Args:
+        workflow (str): The workflow name.
+        file_name (str): The document ID.
+        mode (Optional[str]): 'count_tokens' or 'local'; defaults to `preflight.mode`.
+
+    Returns:
+        Dict[str, Any]: The plan: pages, metrics, per-step and total tokens and calls, the
+        actions, and the chunk size, model and kept pages they set.
+    """
+    mode = mode or config.PREFLIGHT_MODE
+    file_path = os.path.join(config.DATA_DIR, f'docs/{file_name}.pdf')
+    steps = [step for step in WORKFLOW_STEPS[workflow] if step != '0' or workflow != 'merged_step' or config.MERGED_INCLUDE_METADATA]
+    model_name = config.TEXT_GEN_MODEL_NAME
+    document, pages = pdf_tokens(upload_path(file_path), model_name, mode)
+    metrics, metrics_source = metric_count(file_name)
+    plan: Dict[str, Any] = {
+        'document': file_name, 'workflow': workflow, 'mode': mode, 'pages': pages,
+        'metrics': metrics, 'metrics_source': metrics_source, 'document_tokens': document,
+        'actions': [], 'chunk_size': None, 'model': None, 'kept_pages': None, 'warnings': []
+    }
+
+    # Routed steps must also fit the cheaper cascade model
+    limits = [context_tokens(config.CASCADE_MODEL_NAME) if is_routed(step) else math.inf for step in steps]
+    templates = [text_tokens(_step_template(step), model_name, mode) + INPUT_TOKENS_PER_METRIC.get(step, 0) * metrics for step in steps]
+    largest = document + max(templates)
+    if any(document + template > min(limit, context_tokens(model_name)) for template, limit in zip(templates, limits)):
+        fitting = [name for name in (model_name, config.PREFLIGHT_LARGE_CONTEXT_MODEL) if name and largest <= context_tokens(name)]
+        if fitting:
+            plan['actions'].append('route')
+            plan['model'] = fitting[0]
+        else:
+            plan['actions'].append('filter_pages')
+    if pages is not None and pages > config.PREFLIGHT_MAX_PAGES and 'filter_pages' not in plan['actions']:
+        plan['actions'].append('filter_pages')
+    if 'filter_pages' in plan['actions']:
+        kept = relevant_pages(file_path)
+        if kept:
+            plan['kept_pages'] = kept
+            document = document * len(kept) // max(pages or len(kept), 1)
+            if document + max(templates) > context_tokens(model_name):
+                plan['warnings'].append(f"the {len(kept)} kept pages may still exceed the context of {model_name}")
+        else:
+            plan['actions'].remove('filter_pages')
+            plan['warnings'].append('input exceeds the context of every model and no pages could be selected')
+
+    limit = int(config.PREFLIGHT_MAX_OUTPUT_TOKENS * OUTPUT_HEADROOM)
+    chunked = [step for step in steps if step in CHUNKED_STEPS and OUTPUT_TOKENS_FIXED[step] + OUTPUT_TOKENS_PER_METRIC[step] * metrics > limit]
+    if chunked:
+        plan['actions'].append('chunk')
+        plan['chunk_size'] = max(1, min((limit - OUTPUT_TOKENS_FIXED[step]) // OUTPUT_TOKENS_PER_METRIC[step] for step in chunked))
+    # Every chunk's step 2 and step 3 call resends the whole PDF, including configured pipelining
+    chunk_size = plan['chunk_size'] or (config.MULTI_STEP_PIPELINE_CHUNK_SIZE if workflow == 'multi_step' and config.MULTI_STEP_PIPELINING else None)
+    chunks = math.ceil(metrics / chunk_size) if chunk_size else 1
+
+    plan['steps'] = []
+    for step, template in zip(steps, templates):
+        calls = chunks if step in CHUNKED_STEPS else 1
+        output = OUTPUT_TOKENS_FIXED[step] + OUTPUT_TOKENS_PER_METRIC.get(step, 0) * metrics
+        if output > limit and step not in CHUNKED_STEPS:
+            plan['warnings'].append(f"step {step} output of ~{output} tokens may be truncated at {config.PREFLIGHT_MAX_OUTPUT_TOKENS}")
+        plan['steps'].append({'step': step, 'calls': calls, 'input_tokens': calls * document + template, 'output_tokens': output})
+    plan['input_tokens'] = sum(step['input_tokens'] for step in plan['steps'])
+    plan['output_tokens'] = sum(step['output_tokens'] for step in plan['steps'])
+    plan['calls'] = sum(step['calls'] for step in plan['steps'])
+    return plan
+
+
+def plan_run(workflow: str, file_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Plan a document run when the preflight is enabled, recording the plan in the telemetry.
+
+    A failing preflight never stops the run; it then runs as without the preflight.
+
+    Args:
+        workflow (str): The workflow name.
+        file_name (str): The document ID.
+
+    Returns:
+        Optional[Dict[str, Any]]: The plan, or None if the preflight is disabled or failed.
+    """
+    if not config.PREFLIGHT_ENABLED:
+        return None
+    try:
+        plan = plan_document(workflow, file_name)
+    except Exception as e:
+        logger.error(f"Error in preflight of {file_name}, running without a plan: {e}")
+        return None
+    record_event('preflight', input_tokens=plan['input_tokens'], output_tokens=plan['output_tokens'],
+                 calls=plan['calls'], actions=plan['actions'])
+    if plan['actions'] or plan['warnings']:
+        logger.info(f"Preflight of {file_name}: actions {plan['actions']}, warnings {plan['warnings']}")
+    return plan
+
+
+def planned_upload_path(file_path: str, plan: Optional[Dict[str, Any]]) -> str:
+    """
+    Get the file to upload for a document under its plan.
+
+    Args:
+        file_path (str): The original PDF.
+        plan (Optional[Dict[str, Any]]): The document's plan.
+
+    Returns:
+        str: A copy with only the kept pages when the plan filters pages (cached under
+        `data/cache/filtered`), otherwise the usual upload file.
+    """
+    path = upload_path(file_path)
+    if not plan or not plan['kept_pages'] or PdfWriter is None:
+        return path
+    with open(path, 'rb') as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    pages = hashlib.sha256(json.dumps(plan['kept_pages']).encode('utf-8')).hexdigest()[:8]
+    target_path = os.path.join(FILTERED_DIR, f'{digest}-{pages}.pdf')
+    if not os.path.exists(target_path):
+        reader = PdfReader(path)
+        writer = PdfWriter()
+        for page in plan['kept_pages']:
+            writer.add_page(reader.pages[page - 1])
+        os.makedirs(FILTERED_DIR, exist_ok=True)
+        temp_path = f'{target_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as file:
+            writer.write(file)
+        os.replace(temp_path, target_path)
+        logger.info(f"Filtered {file_path} to {len(plan['kept_pages'])} pages")
+    return target_path
+
+
+def restore_page_numbers(rows: List[Dict[str, Any]], plan: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Map the page numbers of rows extracted from a filtered PDF back to the original pages.
+
+    Args:
+        rows (List[Dict[str, Any]]): The rows, left unchanged.
+        plan (Optional[Dict[str, Any]]): The document's plan.
+
+    Returns:
+        List[Dict[str, Any]]: The rows, copied with original page numbers if pages were filtered.
+    """
+    if not plan or not plan['kept_pages']:
+        return rows
+    kept = plan['kept_pages']
+    restored = []
+    for row in rows:
+        try:
+            page = kept[int(row.get('page_number')) - 1]
+        except (TypeError, ValueError, IndexError):
+            page = row.get('page_number')
+        restored.append({**row, 'page_number': page})
+    return restored
+
+
+def plan_corpus(workflow: str, file_names: List[str], mode: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Plan every document of a batch.
+
+    Args:
+        workflow (str): The workflow name.
+        file_names (List[str]): The document IDs.
+        mode (Optional[str]): 'count_tokens' or 'local'; defaults to `preflight.mode`.
+
+    Returns:
+        List[Dict[str, Any]]: The plan of each document that could be read.
+    """
+    plans = []
+    for file_name in file_names:
+        try:
+            plans.append(plan_document(workflow, file_name, mode))
+        except Exception as e:
+            logger.error(f"Error in preflight of {file_name}: {e}")
+    return plans
+
+
+def format_budget_report(plans: List[Dict[str, Any]], rate_limit: Optional[float] = None) -> str:
+    """
+    Render the token and call budget of a batch.
+
+    Args:
+        plans (List[Dict[str, Any]]): The document plans.
+        rate_limit (Optional[float]): Model calls per minute, to project the batch's shortest duration.
+
+    Returns:
+        str: The report text.
+    """
+    lines = [f"{'document':<24} {'pages':>6} {'metrics':>8} {'input':>10} {'output':>8} {'calls':>6}  actions"]
+    for plan in plans:
+        pages = plan['pages'] if plan['pages'] is not None else '-'
+        metrics = f"{plan['metrics']}{'*' if plan['metrics_source'] == 'catalogue' else ''}"
+        actions = ', '.join(plan['actions'])
+        if plan['chunk_size']:
+            actions = actions.replace('chunk', f"chunk({plan['chunk_size']})")
+        if plan['model']:
+            actions = actions.replace('route', f"route({plan['model']})")
+        if plan['kept_pages']:
+            actions = actions.replace('filter_pages', f"filter_pages({len(plan['kept_pages'])})")
+        lines.append(f"{plan['document']:<24} {pages:>6} {metrics:>8} {plan['input_tokens']:>10} {plan['output_tokens']:>8} {plan['calls']:>6}  {actions or '-'}")
+        lines.extend(f"  warning: {warning}" for warning in plan['warnings'])
+    calls = sum(plan['calls'] for plan in plans)
+    input_tokens = sum(plan['input_tokens'] for plan in plans)
+    output_tokens = sum(plan['output_tokens'] for plan in plans)
+    lines.append(f"{'total':<24} {'':>6} {'':>8} {input_tokens:>10} {output_tokens:>8} {calls:>6}")
+    if any(plan['metrics_source'] == 'catalogue' for plan in plans):
+        lines.append("* no step 1 output yet; every catalogue metric assumed")
+    if rate_limit:
+        lines.append(f"At {rate_limit:g} calls per minute the batch needs at least {calls / rate_limit:.1f} minutes "
+                     f"({input_tokens / max(calls, 1) * rate_limit:.0f} input tokens per minute).")
+    lines.append("Excludes cascade escalations, retries and hedged requests.")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,299 @@
+from src.utils.telemetry import telemetry_context
+from src.utils.telemetry import current_tags
+from src.utils.telemetry import thread_tags
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from collections import Counter
+from typing import Generator
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+import contextlib
+import threading
+import random
+import time
+import sys
+import os
+
+
+PROFILES_DIR = os.path.join(config.DATA_DIR, 'profiles')
+
+# Deepest stack kept per sample; deeper frames are cut at the root side
+MAX_STACK_DEPTH = 128
+
+
+def frame_label(frame) -> str:
+    """
+    Label a frame as 'function (file:first line)', which identifies the function across samples.
+
+    Args:
+        frame: The Python frame.
+
+    Returns:
+        str: The frame label.
+    """
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame) -> str:
+    """
+    Render a thread's stack in collapsed form, from the root to the innermost frame.
+
+    Args:
+        frame: The innermost frame of the thread.
+
+    Returns:
+        str: The frames joined by ';'.
+    """
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def _thread_cpu_time(ident: int) -> Optional[float]:
+    """
+    Read another thread's CPU time where the platform exposes per-thread clocks.
+
+    Args:
+        ident (int): The thread identifier.
+
+    Returns:
+        Optional[float]: The thread's CPU time in seconds, or None if unavailable.
+    """
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread working for a registered profile at a fixed interval
+    from a background thread.
+
+    A thread works for a profile while its published telemetry tags carry the profile's
+    key, which follows the run onto the worker threads it hands work to (see
+    `bind_context`). Each sample is prefixed with the thread's telemetry step, so collapsed
+    stacks group by step. Wall samples count every such thread on every tick (including
+    threads waiting on the network); CPU samples weight the stack by the CPU time the
+    thread used since the previous tick, in microseconds.
+    """
+
+    def __init__(self, interval: float):
+        """
+        Initialize the profiler; the sampling thread starts with the first registered profile.
+
+        Args:
+            interval (float): Seconds between samples.
+        """
+        self.interval = interval
+        self._profiles: Dict[str, Tuple[Counter, Counter]] = {}
+        self._cpu_times: Dict[Tuple[str, int], Optional[float]] = {}
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+    def register(self, key: str) -> None:
+        """
+        Start sampling the threads tagged with a profile key.
+
+        Args:
+            key (str): The value of the threads' 'profile' tag.
+        """
+        with self._lock:
+            self._profiles[key] = (Counter(), Counter())
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_forever, name='sampling-profiler', daemon=True)
+                self._sampler.start()
+
+    def unregister(self, key: str) -> Tuple[Counter, Counter]:
+        """
+        Stop sampling a profile and return its samples.
+
+        Args:
+            key (str): The profile key.
+
+        Returns:
+            Tuple[Counter, Counter]: The wall sample counts and CPU microseconds per collapsed stack.
+        """
+        with self._lock:
+            for thread in [thread for thread in self._cpu_times if thread[0] == key]:
+                del self._cpu_times[thread]
+            return self._profiles.pop(key, (Counter(), Counter()))
+
+    def _sample_forever(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            if not self._profiles:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    tags = thread_tags(ident)
+                    samples = self._profiles.get(tags.get('profile'))
+                    if samples is None:
+                        continue
+                    wall, cpu = samples
+                    step = tags.get('step')
+                    stack = f"step {step};{collapse_stack(frame)}" if step is not None else collapse_stack(frame)
+                    wall[stack] += 1
+                    # A thread's CPU time counts from its first sample for the profile
+                    thread = (tags['profile'], ident)
+                    cpu_time = _thread_cpu_time(ident)
+                    previous = self._cpu_times.get(thread)
+                    if cpu_time is not None and previous is not None and cpu_time > previous:
+                        cpu[stack] += int((cpu_time - previous) * 1e6)
+                    self._cpu_times[thread] = cpu_time
+
+
+profiler = SamplingProfiler(config.PROFILING_INTERVAL)
+_sample_fraction = config.PROFILING_SAMPLE_FRACTION if config.PROFILING_ENABLED else 0.0
+
+
+def set_sample_fraction(fraction: float) -> None:
+    """
+    Set the fraction of document runs that are profiled (0 disables profiling).
+
+    Args:
+        fraction (float): The fraction in [0, 1].
+    """
+    global _sample_fraction
+    _sample_fraction = fraction
+
+
+def format_collapsed(samples: Counter) -> str:
+    """
+    Render samples in the collapsed stack format read by speedscope and flamegraph.pl.
+
+    Args:
+        samples (Counter): The weight of each collapsed stack.
+
+    Returns:
+        str: One 'stack weight' line per stack.
+    """
+    return ''.join(f"{stack} {weight}\n" for stack, weight in sorted(samples.items()) if weight)
+
+
+def top_self_time(wall: Counter, cpu: Counter, limit: int = 20) -> List[Tuple[str, int, int]]:
+    """
+    Rank functions by self time, i.e. the samples in which they are the innermost frame.
+
+    Args:
+        wall (Counter): The wall sample counts per collapsed stack.
+        cpu (Counter): The CPU microseconds per collapsed stack.
+        limit (int): The number of functions to return.
+
+    Returns:
+        List[Tuple[str, int, int]]: The function label, its wall samples and its CPU microseconds.
+    """
+    wall_self, cpu_self = Counter(), Counter()
+    for stack, weight in wall.items():
+        wall_self[stack.rsplit(';', 1)[-1]] += weight
+    for stack, weight in cpu.items():
+        cpu_self[stack.rsplit(';', 1)[-1]] += weight
+    return [(label, samples, cpu_self[label]) for label, samples in wall_self.most_common(limit)]
+
+
+def format_summary(wall: Counter, cpu: Counter, interval: float, limit: int = 20) -> str:
+    """
+    Render the top self-time functions as a text table.
+
+    Args:
+        wall (Counter): The wall sample counts per collapsed stack.
+        cpu (Counter): The CPU microseconds per collapsed stack.
+        interval (float): The sampling interval in seconds.
+        limit (int): The number of functions to list.
+
+    Returns:
+        str: The summary text.
+    """
+    total = sum(wall.values()) or 1
+    lines = [f"samples: {sum(wall.values())} every {interval * 1000:.1f} ms, cpu: {sum(cpu.values()) / 1e3:.1f} ms",
+             f"{'wall %':>7}  {'wall s':>8}  {'cpu ms':>9}  function"]
+    for label, samples, cpu_us in top_self_time(wall, cpu, limit):
+        lines.append(f"{samples / total * 100:7.2f}  {samples * interval:8.2f}  {cpu_us / 1e3:9.1f}  {label}")
+    return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def profile_run() -> Generator[None, None, None]:
+    """
+    Profile the current document run, for the configured fraction of runs.
+
+    Must be entered inside `run_context`. The run's thread and the threads it hands work to
+    through `bind_context` (hedged attempts, timed model calls, multi-step chains, JSON
+    writers) are sampled. The profile is written to
+    `data/profiles/<workflow>/<file_name>-<run_id>` as collapsed wall and CPU stacks and a
+    summary of the top self-time functions.
+    """
+    if not _sample_fraction or random.random() >= _sample_fraction:
+        yield
+        return
+
+    key = current_tags().get('run_id') or f"{threading.get_ident()}-{time.monotonic()}"
+    profiler.register(key)
+    try:
+        with telemetry_context(profile=key):
+            yield
+    finally:
+        wall, cpu = profiler.unregister(key)
+        try:
+            tags = current_tags()
+            prefix = os.path.join(PROFILES_DIR, tags.get('workflow', 'unknown'), f"{tags.get('file_name')}-{tags.get('run_id')}")
+            atomic_write(f'{prefix}.wall.collapsed', format_collapsed(wall))
+            atomic_write(f'{prefix}.cpu.collapsed', format_collapsed(cpu))
+            atomic_write(f'{prefix}.summary.txt', format_summary(wall, cpu, profiler.interval))
+            logger.info(f"Profile of {tags.get('file_name')} written to {prefix}.*")
+        except Exception as e:
+            # Profiling is diagnostic only; never fail a run because of it
+            logger.error(f"Error writing profile: {e}")
+
+
+def load_collapsed(path: str) -> Counter:
+    """
+    Load a collapsed stack file.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        Counter: The weight of each collapsed stack.
+    """
+    samples = Counter()
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            stack, _, weight = line.rstrip('\n').rpartition(' ')
+            if stack:
+                samples[stack] += int(weight)
+    return samples
+
+
+def summarize_profiles(workflow: Optional[str] = None, limit: int = 20) -> str:
+    """
+    Merge all stored profiles (optionally of one workflow) and summarise their top self-time functions.
+
+    The merged stacks are also written to `data/profiles/merged.{wall,cpu}.collapsed`.
+
+    Args:
+        workflow (Optional[str]): Only merge profiles of this workflow if given.
+        limit (int): The number of functions to list.
+
+    Returns:
+        str: The summary text.
+    """
+    wall, cpu = Counter(), Counter()
+    for root, _, files in os.walk(os.path.join(PROFILES_DIR, workflow) if workflow else PROFILES_DIR):
+        for name in files:
+            if name.startswith('merged.'):
+                continue
+            if name.endswith('.wall.collapsed'):
+                wall.update(load_collapsed(os.path.join(root, name)))
+            elif name.endswith('.cpu.collapsed'):
+                cpu.update(load_collapsed(os.path.join(root, name)))
+    atomic_write(os.path.join(PROFILES_DIR, 'merged.wall.collapsed'), format_collapsed(wall))
+    atomic_write(os.path.join(PROFILES_DIR, 'merged.cpu.collapsed'), format_collapsed(cpu))
+    return format_summary(wall, cpu, profiler.interval, limit)
@@ -0,0 +1,236 @@
+from src.utils.evaluate import normalize_to_float
+from src.utils.units import round_significant
+from src.utils.units import to_canonical
+from src.config.logging import logger
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+from typing import Any
+import numpy as np
+import math
+import json
+import sys
+
+
+# Repeated low-cardinality strings are interned so that corpus-scale record sets share them
+INTERNED_FIELDS = ('code', 'unit', 'scope', 'flag', 'consumption_type', 'source', 'country', 'sector', 'canonical_unit')
+NUMERIC_FIELDS = ('value', 'year', 'page_number', 'canonical_value')
+INTEGER_FIELDS = ('year', 'page_number')
+
+# Source column names of the expected (analyst) rows, mapped to record fields
+FIELD_ALIASES = {
+    'Country': 'country',
+    'Sector': 'sector',
+    'Name': 'company_name'
+}
+
+
+def _clean(value: Any) -> Any:
+    """
+    Map NaN placeholders (as exported in the expected rows) to None.
+
+    Args:
+        value (Any): The raw field value.
+
+    Returns:
+        Any: The value, or None for NaN.
+    """
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def _to_number(value: Any) -> Optional[float]:
+    """
+    Convert a numeric field to a number, keeping None for missing or non-numeric values.
+
+    Args:
+        value (Any): The raw field value.
+
+    Returns:
+        Optional[float]: The number (ints stay ints), or None.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+class MetricRecord:
+    """
+    Compact record of one extracted or expected metric.
+
+    Records use __slots__ and interned strings, so corpus-scale result sets take a fraction
+    of the memory of the parsed JSON dicts. Fields outside the known set are kept in
+    `extra` (None when there are none) unless they are dropped on load. `value` holds the
+    parsed number; a value given as text (e.g. '8678068 GJ') is also kept in `raw_value` so
+    that it is written back as it was.
+    """
+
+    __slots__ = (
+        'code', 'item', 'value', 'unit', 'year', 'page_number', 'snippet', 'scope', 'flag',
+        'flag_reasoning', 'consumption_type', 'source', 'file_id', 'company_id', 'company_name',
+        'country', 'sector', 'canonical_value', 'canonical_unit', 'raw_value', 'extra'
+    )
+    FIELDS = __slots__[:-2]
+
+    def __init__(self, **fields: Any):
+        """
+        Initialize a record; unknown fields go to `extra`.
+
+        Args:
+            **fields (Any): The record fields.
+        """
+        extra = {}
+        self.raw_value = None
+        for name in self.FIELDS:
+            setattr(self, name, None)
+        for name, value in fields.items():
+            if name in self.FIELDS:
+                setattr(self, name, value)
+            else:
+                extra[name] = value
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, row: Dict[str, Any], keep_extra: bool = True) -> 'MetricRecord':
+        """
+        Build a record from a model output row or a JSONL row.
+
+        Args:
+            row (Dict[str, Any]): The parsed row.
+            keep_extra (bool): Keep fields outside the record's own fields (such as the schema's
+                relevant_information); the evaluator drops them, e.g. the analyst columns of expected rows.
+
+        Returns:
+            MetricRecord: The record.
+        """
+        fields = {}
+        raw_value = None
+        for name, value in row.items():
+            name = FIELD_ALIASES.get(name, name)
+            if name not in cls.FIELDS and not keep_extra:
+                continue
+            value = _clean(value)
+            if name == 'value' and isinstance(value, str):
+                raw_value = value
+            if name in NUMERIC_FIELDS:
+                value = _to_number(value)
+                if name in INTEGER_FIELDS and isinstance(value, float) and value.is_integer():
+                    value = int(value)
+            elif name == 'code' and value is not None:
+                value = str(value)
+            if name in INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            fields[name] = value
+        record = cls(**fields)
+        record.raw_value = raw_value
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert the record to a JSON-serialisable dict, omitting unset fields.
+
+        Returns:
+            Dict[str, Any]: The row, with the value as it was given.
+        """
+        row = {}
+        for name in self.FIELDS:
+            value = self.raw_value if name == 'value' and self.raw_value is not None else getattr(self, name)
+            if value is not None:
+                row[name] = value
+        if self.extra:
+            row.update(self.extra)
+        return row
+
+    def __repr__(self) -> str:
+        return f"MetricRecord({self.to_dict()!r})"
+
+
+def load_records(file_path: str, keep_extra: bool = False) -> List[MetricRecord]:
+    """
+    Read a JSONL file of metric rows into records.
+
+    Args:
+        file_path (str): The path to the JSONL file.
+        keep_extra (bool): Keep fields outside the record's own fields.
+
+    Returns:
+        List[MetricRecord]: The records; undecodable lines are logged and skipped.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    records = []
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                records.append(MetricRecord.from_dict(json.loads(line), keep_extra))
+            except (json.JSONDecodeError, AttributeError) as e:
+                logger.error(f"Error decoding JSON from line: {line.strip()} - {e}")
+    return normalize_records(records)
+
+
+def normalize_records(records: List[MetricRecord]) -> List[MetricRecord]:
+    """
+    Set the canonical value and unit (GJ, cubic meters, tons or %) of each record in one vectorised pass.
+
+    Args:
+        records (List[MetricRecord]): The records to normalise in place.
+
+    Returns:
+        List[MetricRecord]: The same records.
+    """
+    values, units = to_canonical([record.value for record in records], [record.unit for record in records])
+    for record, value, unit in zip(records, values.tolist(), units.tolist()):
+        record.canonical_value = None if unit is None or math.isnan(value) else value
+        record.canonical_unit = unit if record.canonical_value is not None else None
+    return records
+
+
+def match_keys(records: List[MetricRecord]) -> List[Tuple[str, Optional[str], Optional[float]]]:
+    """
+    Get the keys on which generated and expected metrics are matched.
+
+    Records with a recognised unit match on their code and canonical value (rounded to six
+    significant digits), so a value reported in MWh matches the same quantity in GJ. Zero
+    matches zero in any unit. Other records fall back to the raw value, normalised as in
+    `compare_json_objects`.
+
+    Args:
+        records (List[MetricRecord]): Records normalised by `normalize_records`.
+
+    Returns:
+        List[Tuple[str, Optional[str], Optional[float]]]: The code, canonical unit and value of each record.
+    """
+    canonical = [np.nan if record.canonical_value is None else record.canonical_value for record in records]
+    rounded = round_significant(np.array(canonical, dtype=np.float64)).tolist() if records else []
+    keys = []
+    for record, value in zip(records, rounded):
+        if record.canonical_unit is not None and value != 0:
+            keys.append((record.code or '', record.canonical_unit, value))
+        else:
+            raw = normalize_to_float(-1 if record.value is None else record.value)
+            keys.append((record.code or '', None, 0.0 if raw == 0 else raw))
+    return keys
+
+
+def records_from_output(data: Any, workflow: str) -> List[MetricRecord]:
+    """
+    Build records from the parsed output of a workflow.
+
+    Args:
+        data (Any): The workflow output; 'single_step' and 'merged_step' outputs hold their rows under "metrics".
+        workflow (str): The workflow name.
+
+    Returns:
+        List[MetricRecord]: The records, keeping every field of the output rows, with canonical values set.
+    """
+    rows = data["metrics"] if workflow in ('single_step', 'merged_step') else data
+    return normalize_records([row if isinstance(row, MetricRecord) else MetricRecord.from_dict(row) for row in rows])
@@ -0,0 +1,256 @@
+from src.config.logging import logger
+from typing import Optional
+from typing import Tuple
+from typing import List
+from typing import Dict
+from typing import Any
+import re
+
+
+# Surface forms of units as they appear in report tables, mapped to catalogue units
+UNIT_SURFACE_FORMS = {
+    'GWh': 'GWh', 'MWh': 'MWh', 'kWh': 'kWh', 'KWh': 'kWh',
+    'TJ': 'TJ', 'GJ': 'GJ', 'MJ': 'MJ',
+    '%': '%',
+    'liters': 'liters', 'litres': 'liters', 'kl': 'liters', 'kL': 'liters',
+    'gallons': 'gallons',
+    'm3': 'cubic meters', 'm³': 'cubic meters', 'cubic meters': 'cubic meters', 'cubic metres': 'cubic meters',
+    'tons': 'tons', 'tonnes': 'tons', 't': 'tons',
+    'barrels': 'barrels', 'bbl': 'barrels'
+}
+
+# Additional labels under which the headline metrics are commonly disclosed
+METRIC_ALIASES = {
+    '429': ['total energy consumption', 'total energy use', 'energy consumption within the organization'],
+    '711': ['total non-renewable energy consumption', 'non-renewable energy consumption', 'total energy consumption from non-renewable sources'],
+    '432': ['total renewable energy consumption', 'renewable energy consumption', 'total energy consumption from renewable sources'],
+    '817': ['share of non-renewable energy', 'percentage of non-renewable energy'],
+    '819': ['share of renewable energy', 'percentage of renewable energy'],
+    '1701': ['total electricity consumption', 'total electricity use', 'electricity consumption'],
+    '1702': ['renewable electricity consumption', 'electricity from renewable sources']
+}
+
+# GRI 302-1 is the disclosure for energy consumption within the organisation
+GRI_302_1 = re.compile(r'302\s*[-－–]\s*1')
+
+NUMBER = r'(?:\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d{1,3}(?:\.\d{3}){2,}(?:,\d+)?|\d+(?:[.,]\d+)?|-)'
+UNIT = '|'.join(sorted((re.escape(unit) for unit in UNIT_SURFACE_FORMS), key=len, reverse=True))
+# Table rows print either the values before the unit ("8,678,068 GJ") or after it ("TJ 5,102 5,277")
+ROW_PATTERNS = (
+    re.compile(rf'(?<![\w.,])(?P<numbers>{NUMBER}(?:\s+{NUMBER})*)\s*(?P<unit>{UNIT})(?![\w/])'),
+    re.compile(rf'(?<![\w/])(?P<unit>{UNIT})\s+(?P<numbers>{NUMBER}(?:\s+{NUMBER})*)(?![\w.,/])')
+)
+YEAR_HEADER = re.compile(r'\b((?:(?:FY\s?)?(?:19|20)\d{2}\s+){1,}(?:FY\s?)?(?:19|20)\d{2})\b')
+SENTENCE_END = re.compile(r'[.;。](?:\s|$)')
+
+# How far after a label a table row may start, in characters of normalised text
+LABEL_WINDOW = 200
+# Another row this close after the matched one means the label has a breakdown (e.g. by scope)
+BREAKDOWN_WINDOW = 60
+
+
+def parse_number(token: str) -> Optional[float]:
+    """
+    Parse a number as printed in a report, removing thousand separators.
+
+    Follows the step 2 instructions: "8,505,686" and "8.505.686" both become 8505686,
+    and the remaining separator (if any) is treated as the decimal separator.
+
+    Args:
+        token (str): The printed number.
+
+    Returns:
+        Optional[float]: The parsed value, or None for placeholders such as '-'.
+    """
+    token = token.strip()
+    if not token or token == '-':
+        return None
+    if ',' in token and '.' in token:
+        decimal = ',' if token.rfind(',') > token.rfind('.') else '.'
+        thousands = '.' if decimal == ',' else ','
+        token = token.replace(thousands, '').replace(decimal, '.')
+    elif token.count(',') > 1 or re.fullmatch(r'\d{1,3}(?:,\d{3})+', token):
+        token = token.replace(',', '')
+    elif token.count('.') > 1:
+        token = token.replace('.', '')
+    else:
+        token = token.replace(',', '.')
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+
+def metric_labels(entry: Dict[str, Any]) -> List[str]:
+    """
+    Build the lower-cased labels under which a catalogue metric may appear in a document.
+
+    Args:
+        entry (Dict[str, Any]): A catalogue entry with 'code' and 'item' keys.
+
+    Returns:
+        List[str]: Candidate labels, longest first.
+    """
+    item = re.sub(r'\([^)]*\)', '', entry['item']).strip()
+    labels = {item.lower()}
+    if ':' in item:
+        _, members = item.split(':', 1)
+        for member in members.split(','):
+            member = member.strip()
+            if len(member) > 3:
+                labels.add(member.lower())
+    labels.update(METRIC_ALIASES.get(entry['code'], []))
+    return sorted(labels, key=len, reverse=True)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapse all whitespace (including line breaks inside table cells) to single spaces.
+
+    Args:
+        text (str): The raw page text.
+
+    Returns:
+        str: The normalised text.
+    """
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _first_row(text: str) -> Optional[re.Match]:
+    """
+    Find the earliest table row (numbers with a unit on either side) in a text window.
+
+    Args:
+        text (str): The normalised text to search.
+
+    Returns:
+        Optional[re.Match]: The earliest row match, or None if there is none.
+    """
+    matches = [match for match in (pattern.search(text) for pattern in ROW_PATTERNS) if match]
+    return min(matches, key=lambda match: match.start()) if matches else None
+
+
+def _find_candidates(entry: Dict[str, Any], page_number: int, page_text: str) -> List[Dict[str, Any]]:
+    """
+    Find candidate values for one catalogue metric on one page.
+
+    Args:
+        entry (Dict[str, Any]): The catalogue entry.
+        page_number (int): The 1-based page number.
+        page_text (str): The normalised page text.
+
+    Returns:
+        List[Dict[str, Any]]: Candidates with value, unit, snippet, year and confidence.
+    """
+    candidates = []
+    lowered = page_text.lower()
+    year_header = YEAR_HEADER.search(page_text)
+    header_years = [int(year) for year in re.findall(r'\d{4}', year_header.group(1))] if year_header else []
+    has_gri = bool(GRI_302_1.search(page_text))
+
+    for label in metric_labels(entry):
+        for label_match in re.finditer(rf'(?<![a-z-]){re.escape(label)}(?![a-z-])', lowered):
+            # A longer label (e.g. "... from renewable sources") belongs to another metric
+            if entry['code'] == '429' and re.match(r'\s+from\b', lowered[label_match.end():]):
+                continue
+            window = page_text[label_match.end():label_match.end() + LABEL_WINDOW]
+            row = _first_row(window)
+            # The row must follow the label within the same table cell, not a later sentence
+            if not row or SENTENCE_END.search(window[:row.start()]):
+                continue
+            unit = UNIT_SURFACE_FORMS[row.group('unit')]
+            if unit not in entry['units']:
+                continue
+            tokens = row.group('numbers').split()
+            value = parse_number(tokens[-1])
+            if value is None:
+                continue
+
+            confidence = 0.5
+            year = None
+            if header_years and len(tokens) == len(header_years) and header_years == sorted(header_years):
+                # Columns align with an ascending year header; the last column is the latest year
+                year = header_years[-1]
+                confidence += 0.2
+            elif header_years:
+                year = max(header_years)
+            trailing = page_text[label_match.end() + row.end():label_match.end() + row.end() + BREAKDOWN_WINDOW]
+            if GRI_302_1.search(trailing[:20]):
+                confidence += 0.2
+            elif has_gri:
+                confidence += 0.1
+            if _first_row(trailing):
+                # e.g. "Non-consolidated TJ 1,495 Consolidated TJ 5,277": which row is the total is unclear
+                confidence -= 0.3
+
+            snippet_end = label_match.end() + row.end()
+            candidates.append({
+                'value': value,
+                'unit': unit,
+                'page_number': page_number,
+                'snippet': page_text[label_match.start():snippet_end][:500],
+                'year': year,
+                'confidence': confidence
+            })
+    return candidates
+
+
+def extract_with_rules(page_texts: List[str], catalogue: List[Dict[str, Any]], threshold: float) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Resolve catalogue metrics from the PDF text layer using table and regex rules.
+
+    Each metric label is searched for on every page, and the first table row following
+    it (a run of numbers ending in an accepted unit) yields a candidate whose value is the
+    latest column. Candidates score higher when the columns align with a year header and
+    when the row carries the GRI 302-1 reference. A metric is resolved when its best
+    candidate reaches the threshold and no competing candidate disagrees on the value.
+
+    Args:
+        page_texts (List[str]): The raw text of each page.
+        catalogue (List[Dict[str, Any]]): The metric catalogue from `load_metric_catalogue`.
+        threshold (float): The minimum confidence for a metric to be resolved without the LLM.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]: The resolved metrics (in the
+        step 2 output shape plus 'year' and 'confidence') and every other catalogue entry,
+        with 'mentioned' telling whether one of its labels appears in the document (an
+        unmentioned metric may still be reported under another wording).
+    """
+    normalized_pages = [normalize_text(text) for text in page_texts]
+    lowered_document = ' '.join(normalized_pages).lower()
+
+    resolved: List[Dict[str, Any]] = []
+    unresolved: List[Dict[str, Any]] = []
+    resolved_codes = set()
+
+    for entry in catalogue:
+        if entry['code'] in resolved_codes:
+            continue
+        labels = metric_labels(entry)
+        if not any(re.search(rf'(?<![a-z-]){re.escape(label)}(?![a-z-])', lowered_document) for label in labels):
+            unresolved.append({'code': entry['code'], 'item': entry['item'], 'mentioned': False})
+            continue
+
+        candidates = []
+        for page_number, page_text in enumerate(normalized_pages, start=1):
+            candidates.extend(_find_candidates(entry, page_number, page_text))
+
+        if candidates:
+            best = max(candidates, key=lambda candidate: candidate['confidence'])
+            distinct_values = {(candidate['value'], candidate['unit']) for candidate in candidates}
+            if len(distinct_values) == 1:
+                best['confidence'] = min(1.0, best['confidence'] + 0.1)
+            else:
+                # Competing values (other years, sub-totals, other units) make the row ambiguous
+                best['confidence'] -= 0.2
+            if best['confidence'] >= threshold:
+                resolved_codes.add(entry['code'])
+                resolved.append({'code': entry['code'], 'item': entry['item'], **best})
+                continue
+
+        unresolved.append({'code': entry['code'], 'item': entry['item'], 'mentioned': True})
+
+    # Entries sharing a code (e.g. natural, city and town gas) are resolved by any of them
+    unresolved = [entry for entry in unresolved if entry['code'] not in resolved_codes]
+    logger.info(f"Rule-based extraction resolved {len(resolved)} metrics; {len(unresolved)} need the LLM")
+    return resolved, unresolved
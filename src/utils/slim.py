@@ -0,0 +1,255 @@
+from src.utils.pdf import extract_page_texts
+from src.config.logging import logger
+from src.config.setup import config
+from src.utils.io import atomic_write
+from typing import Optional
+from typing import List
+from typing import Dict
+from typing import Any
+import hashlib
+import json
+import glob
+import io
+import os
+import re
+
+try:
+    from pypdf import PdfWriter
+except ImportError:  # pypdf is only needed for the offline text-layer features
+    PdfWriter = None
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow, images are kept as they are
+    Image = None
+
+
+SLIM_DIR = os.path.join(config.DATA_DIR, 'cache/slim')
+
+# Image modes that re-encode as JPEG without losing transparency or palettes
+JPEG_MODES = ('RGB', 'L')
+
+
+def slim_settings() -> Dict[str, Any]:
+    """
+    Get the settings that determine a slimmed file, part of its cache key.
+
+    Returns:
+        Dict[str, Any]: The maximum image side and JPEG quality.
+    """
+    return {'max_image_side': config.SLIMMING_MAX_IMAGE_SIDE, 'jpeg_quality': config.SLIMMING_JPEG_QUALITY}
+
+
+def slim_key(pdf_bytes: bytes) -> str:
+    """
+    Compute the cache key of a slimmed file from the content hash of the original and the settings.
+
+    Args:
+        pdf_bytes (bytes): The original PDF.
+
+    Returns:
+        str: The key.
+    """
+    settings = hashlib.sha256(json.dumps(slim_settings(), sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    return f"{hashlib.sha256(pdf_bytes).hexdigest()}-{settings}"
+
+
+def _normalize_text(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _recompress_images(writer: 'PdfWriter', max_side: int, quality: int) -> int:
+    """
+    Downsample and re-encode the opaque RGB and greyscale images of a document as JPEG.
+
+    An image is only replaced when its new encoding is smaller; images with a soft mask are
+    left alone, since JPEG cannot carry their transparency.
+
+    Args:
+        writer (PdfWriter): The document being rewritten.
+        max_side (int): The longest side in pixels of downsampled images.
+        quality (int): The JPEG quality.
+
+    Returns:
+        int: The number of images replaced.
+    """
+    replaced, seen = 0, set()
+    for page in writer.pages:
+        for image in page.images:
+            reference = image.indirect_reference
+            if reference is None or reference.idnum in seen:
+                continue
+            seen.add(reference.idnum)
+            if '/SMask' in reference.get_object() or image.image is None or image.image.mode not in JPEG_MODES:
+                continue
+            picture = image.image
+            if max(picture.size) > max_side:
+                picture = picture.copy()
+                picture.thumbnail((max_side, max_side), Image.LANCZOS)
+            buffer = io.BytesIO()
+            picture.save(buffer, 'JPEG', quality=quality, optimize=True)
+            if buffer.tell() < len(image.data):
+                image.replace(picture, quality=quality)
+                replaced += 1
+    return replaced
+
+
+def _rewrite(source_path: str, target_path: str) -> int:
+    """
+    Rewrite a PDF without metadata, duplicate or unreferenced objects, and with compressed
+    content streams and images.
+
+    Args:
+        source_path (str): The original PDF.
+        target_path (str): Where to write the slimmed PDF.
+
+    Returns:
+        int: The number of images replaced.
+    """
+    writer = PdfWriter(clone_from=source_path)
+    replaced = 0
+    if Image is not None:
+        replaced = _recompress_images(writer, config.SLIMMING_MAX_IMAGE_SIDE, config.SLIMMING_JPEG_QUALITY)
+    for page in writer.pages:
+        page.compress_content_streams()
+    writer.metadata = None
+    if '/Metadata' in writer.root_object:
+        del writer.root_object['/Metadata']
+    writer.compress_identical_objects()
+    with open(target_path, 'wb') as file:
+        writer.write(file)
+    return replaced
+
+
+def _text_intact(original_path: str, slimmed_path: str) -> bool:
+    """
+    Check that a slimmed PDF has the same pages and text layer as the original.
+
+    Args:
+        original_path (str): The original PDF.
+        slimmed_path (str): The slimmed PDF.
+
+    Returns:
+        bool: True if the page count and the text of every page (up to whitespace) are unchanged.
+    """
+    original = extract_page_texts(original_path)
+    slimmed = extract_page_texts(slimmed_path)
+    if original is None or slimmed is None or len(original) != len(slimmed):
+        return False
+    return all(_normalize_text(a) == _normalize_text(b) for a, b in zip(original, slimmed))
+
+
+def slim_pdf(file_path: str) -> Dict[str, Any]:
+    """
+    Slim a PDF for upload, reusing the cached result for the same content and settings.
+
+    The slimmed file is kept only if it is smaller and its pages and text layer are unchanged;
+    otherwise the original is used. The result is stored under
+    `data/cache/slim/<content hash>-<settings>.pdf` with a JSON report next to it, which also
+    records a decision to keep the original.
+
+    Args:
+        file_path (str): The original PDF.
+
+    Returns:
+        Dict[str, Any]: The report: the slimmed path (None if the original is kept), original
+        and slimmed sizes, images replaced, and whether the slimmed file is used.
+
+    Raises:
+        RuntimeError: If pypdf is not installed.
+    """
+    if PdfWriter is None:
+        raise RuntimeError("pypdf is required to slim PDFs")
+    with open(file_path, 'rb') as file:
+        pdf_bytes = file.read()
+    key = slim_key(pdf_bytes)
+    target_path = os.path.join(SLIM_DIR, f'{key}.pdf')
+    report_path = os.path.join(SLIM_DIR, f'{key}.json')
+    if os.path.exists(report_path):
+        with open(report_path, 'r', encoding='utf-8') as file:
+            report = json.load(file)
+        if not report['slimmed'] or os.path.exists(target_path):
+            # Identical documents share the cached file under different names
+            return {**report, 'source': os.path.basename(file_path)}
+
+    os.makedirs(SLIM_DIR, exist_ok=True)
+    temp_path = f'{target_path}.{os.getpid()}.tmp'
+    report = {'source': os.path.basename(file_path), 'path': None, 'original_bytes': len(pdf_bytes),
+              'slimmed_bytes': len(pdf_bytes), 'images_replaced': 0, 'slimmed': False}
+    try:
+        logger.info(f"Slimming {file_path}")
+        replaced = _rewrite(file_path, temp_path)
+        size = os.path.getsize(temp_path)
+        if size < len(pdf_bytes) and _text_intact(file_path, temp_path):
+            os.replace(temp_path, target_path)
+            report.update(path=target_path, slimmed_bytes=size, images_replaced=replaced, slimmed=True)
+        else:
+            logger.info(f"Keeping the original of {file_path}: the slimmed file is not smaller or its text changed")
+    except Exception as e:
+        # Not cached, so that the document is retried on the next run
+        logger.error(f"Error slimming {file_path}: {e}")
+        return report
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    atomic_write(report_path, json.dumps(report, indent=4))
+    logger.info(f"Slimmed {file_path}: {report['original_bytes']} -> {report['slimmed_bytes']} bytes")
+    return report
+
+
+def upload_path(file_path: str) -> str:
+    """
+    Get the file whose bytes are sent to the model for a document.
+
+    Args:
+        file_path (str): The original PDF.
+
+    Returns:
+        str: The slimmed copy when slimming is enabled, otherwise (or if slimming fails) the original.
+    """
+    if not config.SLIMMING_ENABLED:
+        return file_path
+    try:
+        return slim_pdf(file_path)['path'] or file_path
+    except Exception as e:
+        logger.error(f"Error preparing slimmed copy of {file_path}, sending the original: {e}")
+        return file_path
+
+
+def slim_documents(pattern: str) -> List[Dict[str, Any]]:
+    """
+    Slim every PDF matching a glob and collect the reports.
+
+    Args:
+        pattern (str): The glob of PDFs.
+
+    Returns:
+        List[Dict[str, Any]]: The report of each document.
+    """
+    return [slim_pdf(path) for path in sorted(glob.glob(pattern))]
+
+
+def format_slim_report(reports: List[Dict[str, Any]], coverage: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Render the byte savings of slimmed documents, optionally with their current coverage.
+
+    Args:
+        reports (List[Dict[str, Any]]): The slimming reports.
+        coverage (Optional[Dict[str, Any]]): Per document ID, the evaluator's matches and expected counts.
+
+    Returns:
+        str: The report text.
+    """
+    lines = [f"{'document':<24} {'original':>12} {'slimmed':>12} {'saved %':>8} {'images':>7}" + (f" {'coverage':>9}" if coverage else '')]
+    for report in reports:
+        saved = (1 - report['slimmed_bytes'] / report['original_bytes']) * 100 if report['original_bytes'] else 0.0
+        line = f"{report['source'][:-len('.pdf')]:<24} {report['original_bytes']:>12} {report['slimmed_bytes']:>12} {saved:>8.1f} {report['images_replaced']:>7}"
+        if coverage:
+            accuracy = coverage.get(report['source'][:-len('.pdf')])
+            line += f" {accuracy['matches'] / accuracy['expected'] * 100:>8.1f}%" if accuracy and accuracy.get('expected') else f" {'-':>9}"
+        lines.append(line)
+    original = sum(report['original_bytes'] for report in reports)
+    slimmed = sum(report['slimmed_bytes'] for report in reports)
+    if original:
+        lines.append(f"{'total':<24} {original:>12} {slimmed:>12} {(1 - slimmed / original) * 100:>8.1f}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,161 @@
+from src.config.logging import logger
+from src.config.setup import config
+from typing import Generator
+from typing import Callable
+from typing import Optional
+from typing import Dict
+from typing import List
+from typing import Any
+import contextvars
+import contextlib
+import threading
+import uuid
+import json
+import time
+import os
+
+
+TELEMETRY_PATH = os.path.join(config.DATA_DIR, 'telemetry/events.jsonl')
+
+# Tags (workflow, file_name, step, ...) attached to every event recorded in the current context.
+# asyncio.to_thread copies the context, so tags set by a batch runner reach the pipeline threads.
+_tags: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('telemetry_tags', default={})
+_write_lock = threading.Lock()
+# Tags of each thread, published so that another thread (the sampling profiler) can read them.
+# Threads without tags have no entry, so the map only holds threads busy with a run.
+_thread_tags: Dict[int, Dict[str, Any]] = {}
+
+
+def _publish(ident: int, tags: Dict[str, Any]) -> None:
+    if tags:
+        _thread_tags[ident] = tags
+    else:
+        _thread_tags.pop(ident, None)
+
+
+@contextlib.contextmanager
+def telemetry_context(**tags: Any) -> Generator[None, None, None]:
+    """
+    Attach tags to all telemetry events recorded within the context.
+
+    Args:
+        **tags (Any): Tags such as workflow, file_name or step.
+    """
+    token = _tags.set({**_tags.get(), **tags})
+    ident = threading.get_ident()
+    _publish(ident, _tags.get())
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+        _publish(ident, _tags.get())
+
+
+def bind_context(function: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Bind a function to a copy of the current context, for running it on another thread.
+
+    Besides the context variables (tags, deadline, default model), the worker thread
+    publishes the tags while the function runs, so the sampling profiler follows a run
+    onto the threads it hands work to.
+
+    Args:
+        function (Callable[..., Any]): The function to run on a worker thread.
+
+    Returns:
+        Callable[..., Any]: A callable running the function in the copied context.
+    """
+    context = contextvars.copy_context()
+
+    def published(*args: Any, **kwargs: Any) -> Any:
+        ident = threading.get_ident()
+        previous = _thread_tags.get(ident, {})
+        _publish(ident, _tags.get())
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _publish(ident, previous)
+
+    return lambda *args, **kwargs: context.run(published, *args, **kwargs)
+
+
+def run_context(workflow: str, file_name: str) -> contextlib.AbstractContextManager:
+    """
+    Tag all events of one document run with its workflow, file name and a fresh run id.
+
+    Args:
+        workflow (str): The workflow name.
+        file_name (str): The name of the PDF file (without extension).
+
+    Returns:
+        contextlib.AbstractContextManager: The telemetry context for the run.
+    """
+    return telemetry_context(workflow=workflow, file_name=file_name, run_id=uuid.uuid4().hex)
+
+
+def current_tags() -> Dict[str, Any]:
+    """
+    Get the telemetry tags of the current context.
+
+    Returns:
+        Dict[str, Any]: The active tags.
+    """
+    return dict(_tags.get())
+
+
+def thread_tags(ident: int) -> Dict[str, Any]:
+    """
+    Get the telemetry tags last set by a thread.
+
+    Args:
+        ident (int): The thread identifier.
+
+    Returns:
+        Dict[str, Any]: The thread's active tags (empty if it never set any).
+    """
+    return dict(_thread_tags.get(ident, {}))
+
+
+def record_event(event: str, **fields: Any) -> None:
+    """
+    Append a telemetry event, tagged with the current context, to the events file.
+
+    Telemetry must never break an extraction, so failures are logged and swallowed.
+
+    Args:
+        event (str): The event type, e.g. 'call' for a model call or 'run' for a document run.
+        **fields (Any): Measurements such as latency or token counts.
+    """
+    try:
+        record = {'event': event, 'timestamp': time.time(), **current_tags(), **fields}
+        with _write_lock:
+            os.makedirs(os.path.dirname(TELEMETRY_PATH), exist_ok=True)
+            with open(TELEMETRY_PATH, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(record) + '\n')
+    except Exception as e:
+        logger.error(f"Error recording telemetry event {event}: {e}")
+
+
+def load_events(event: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Load recorded telemetry events.
+
+    Args:
+        event (Optional[str]): Only return events of this type if given.
+
+    Returns:
+        List[Dict[str, Any]]: The recorded events in order of recording.
+    """
+    if not os.path.exists(TELEMETRY_PATH):
+        return []
+    events = []
+    with open(TELEMETRY_PATH, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a truncated last line in the append-only log
+                continue
+            if event is None or record.get('event') == event:
+                events.append(record)
+    return events
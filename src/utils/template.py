@@ -2,11 +2,47 @@ from src.config.logging import logger
 from src.config.setup import config
 from src.utils.io import load_file
 from typing import Optional 
+from typing import Tuple
 from typing import List 
 from typing import Dict 
 from typing import Any 
+import threading
 import json 
 import os 
+import re
+
+
+# Templates are read once per process; long-running workers keep them warm
+_template_cache: Dict[str, str] = {}
+_template_cache_lock = threading.Lock()
+
+
+def load_template_file(file_path: str) -> Optional[str]:
+    """
+    Load a template file, serving repeated loads from an in-process cache.
+
+    Args:
+        file_path (str): The path to the template file.
+
+    Returns:
+        Optional[str]: The template content, or None if it could not be loaded (not cached).
+    """
+    content = _template_cache.get(file_path)
+    if content is None:
+        content = load_file(file_path)
+        if content is not None:
+            with _template_cache_lock:
+                _template_cache[file_path] = content
+    return content
+
+
+def clear_template_cache() -> None:
+    """
+    Drop all cached templates so that edited templates are picked up.
+    """
+    with _template_cache_lock:
+        _template_cache.clear()
+    logger.info("Template cache cleared")
 
 
 def load_system_instruction(workflow: str, step: Optional[int] = None) -> List[str]:
@@ -23,10 +59,10 @@ def load_system_instruction(workflow: str, step: Optional[int] = None) -> List[s
     try:
         if step is not None:
             logger.info(f"Loading multi-step system instruction for workflow: {workflow}, step: {step}")
-            system_instruction = [load_file(os.path.join(config.DATA_DIR, f'templates/{workflow}/system_instruction/system_instruction_step_{step}.txt'))]
+            system_instruction = [load_template_file(os.path.join(config.DATA_DIR, f'templates/{workflow}/system_instruction/system_instruction_step_{step}.txt'))]
         else:
             logger.info(f"Loading single-step system instruction for workflow: {workflow}")
-            system_instruction = [load_file(os.path.join(config.DATA_DIR, f'templates/{workflow}/system_instruction.txt'))]
+            system_instruction = [load_template_file(os.path.join(config.DATA_DIR, f'templates/{workflow}/system_instruction.txt'))]
         logger.info("System instruction loaded successfully")
         return system_instruction
     except Exception as e:
@@ -48,10 +84,10 @@ def load_user_instruction(workflow: str, step: Optional[int] = None) -> str:
     try:
         if step is not None:
             logger.info(f"Loading multi-step user instruction for workflow: {workflow}, step: {step}")
-            user_instruction = load_file(os.path.join(config.DATA_DIR, f'templates/{workflow}/user_instruction/user_instruction_step_{step}.txt'))
+            user_instruction = load_template_file(os.path.join(config.DATA_DIR, f'templates/{workflow}/user_instruction/user_instruction_step_{step}.txt'))
         else:
             logger.info(f"Loading single-step user instruction for workflow: {workflow}")
-            user_instruction = load_file(os.path.join(config.DATA_DIR, f'templates/{workflow}/user_instruction.txt'))
+            user_instruction = load_template_file(os.path.join(config.DATA_DIR, f'templates/{workflow}/user_instruction.txt'))
         logger.info("User instruction loaded successfully")
         return user_instruction
     except Exception as e:
@@ -78,7 +114,7 @@ def load_response_schema(workflow: str, step: Optional[int] = None) -> Dict[str,
             logger.info(f"Loading single-step response schema for workflow: {workflow}")
             response_schema_path = os.path.join(config.DATA_DIR, f'templates/{workflow}/response_schema.json')
 
-        response_schema_content = load_file(response_schema_path)
+        response_schema_content = load_template_file(response_schema_path)
         response_schema = json.loads(response_schema_content)
         logger.info("Response schema loaded successfully")
         return response_schema
@@ -88,3 +124,139 @@ def load_response_schema(workflow: str, step: Optional[int] = None) -> Dict[str,
     except Exception as e:
         logger.error(f"Error loading response schema for workflow {workflow} with step {step}: {e}")
         raise
+
+
+
+def load_metric_catalogue() -> List[Dict[str, Any]]:
+    """
+    Parse the metric catalogue (codes, item names and accepted units) from the
+    multi-step step 1 system instruction.
+
+    Catalogue lines look like:
+    - **Total energy consumption** (Code: 429, Units: Energy Units): ...
+    - **Share of renewable energy consumption** (Code: 819, Unit: %): ...
+
+    Returns:
+        List[Dict[str, Any]]: One entry per catalogue line with 'code', 'item' and 'units' keys,
+        where 'units' lists the concrete unit strings accepted for the metric.
+    """
+    try:
+        logger.info("Loading metric catalogue from the step 1 system instruction")
+        system_instruction = load_system_instruction(workflow='multi_step', step=1)[0]
+
+        # Unit families, e.g. "- **Energy Units**: GWh, MWh, kWh, TJ, GJ, MJ"
+        unit_families = {
+            family: [unit.strip() for unit in units.split(',')]
+            for family, units in re.findall(r'^- \*\*([A-Za-z ]+ Units)\*\*: (.+)$', system_instruction, re.MULTILINE)
+        }
+
+        catalogue = []
+        pattern = r'^- \*\*(.+?)\*\* \(Code: ([A-Za-z0-9_]+), Units?: ([^)]+)\)'
+        for item, code, units in re.findall(pattern, system_instruction, re.MULTILINE):
+            accepted_units = []
+            for unit in units.split(','):
+                accepted_units.extend(unit_families.get(unit.strip(), [unit.strip()]))
+            catalogue.append({'code': code, 'item': item, 'units': accepted_units})
+
+        logger.info(f"Loaded {len(catalogue)} catalogue entries")
+        return catalogue
+    except Exception as e:
+        logger.error(f"Error loading metric catalogue: {e}")
+        raise
+
+
+# Sections of the merged workflow, in the order the model should work through them.
+# The keys sort alphabetically in chain order, matching how the schema properties are emitted.
+MERGED_SECTIONS = (
+    (1, 'discovery', 'Metric Discovery'),
+    (2, 'extraction', 'Value Extraction'),
+    (3, 'scope_and_classification', 'Scope and Classification')
+)
+
+
+def load_merged_templates() -> Tuple[List[str], str, Dict[str, Any]]:
+    """
+    Compose the merged workflow's templates from the multi-step steps 1-3 templates.
+
+    The multi-step system and user instructions become numbered sections of a single prompt,
+    and the response schema nests each step's new fields under a per-metric section object:
+    discovery (step 1), extraction (fields added by step 2) and scope_and_classification
+    (fields added by step 3).
+
+    Returns:
+        Tuple[List[str], str, Dict[str, Any]]: The system instruction, the user instruction
+        and the response schema.
+    """
+    try:
+        logger.info("Composing merged workflow templates from multi-step steps 1-3")
+        system_sections = []
+        user_sections = [load_template_file(os.path.join(config.DATA_DIR, 'templates/merged_step/user_instruction.txt'))]
+        metric_properties: Dict[str, Any] = {}
+        known_fields = set()
+
+        for step, key, title in MERGED_SECTIONS:
+            system_sections.append(f"# Section {step}: {title}\n\n{load_system_instruction(workflow='multi_step', step=step)[0]}")
+            user_sections.append(f"## Section {step}: {title}\n{load_user_instruction(workflow='multi_step', step=step)}")
+
+            step_items = load_response_schema(workflow='multi_step', step=step)['items']
+            new_fields = [field for field in step_items['properties'] if field not in known_fields]
+            metric_properties[key] = {
+                'type': 'object',
+                'properties': {field: step_items['properties'][field] for field in new_fields},
+                'required': [field for field in step_items['required'] if field in new_fields]
+            }
+            known_fields.update(new_fields)
+
+        response_schema = {
+            'type': 'object',
+            'properties': {
+                'metrics': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': metric_properties,
+                        'required': [key for _, key, _ in MERGED_SECTIONS]
+                    }
+                }
+            },
+            'required': ['metrics']
+        }
+        logger.info("Merged workflow templates composed successfully")
+        return ['\n\n'.join(system_sections)], '\n\n'.join(user_sections), response_schema
+    except Exception as e:
+        logger.error(f"Error composing merged workflow templates: {e}")
+        raise
+
+
+def load_packed_templates(document_ids: List[str]) -> Tuple[List[str], str, Dict[str, Any]]:
+    """
+    Compose the single-step templates for one request covering several documents.
+
+    The single-step system instruction is used as is, the user instruction is prefixed
+    with the packing rules, and the response schema holds the single-step schema once per
+    document, keyed by document ID.
+
+    Args:
+        document_ids (List[str]): The IDs of the packed documents, in the order they are sent.
+
+    Returns:
+        Tuple[List[str], str, Dict[str, Any]]: The system instruction, the user instruction
+        and the response schema.
+    """
+    try:
+        logger.info(f"Composing packed single-step templates for {len(document_ids)} documents")
+        system_instruction = load_system_instruction(workflow='single_step', step=None)
+        user_instruction = '\n\n'.join([
+            load_template_file(os.path.join(config.DATA_DIR, 'templates/single_step/packed_instruction.txt')),
+            load_user_instruction(workflow='single_step', step=None)
+        ])
+        document_schema = load_response_schema(workflow='single_step', step=None)
+        response_schema = {
+            'type': 'object',
+            'properties': {document_id: document_schema for document_id in document_ids},
+            'required': list(document_ids)
+        }
+        return system_instruction, user_instruction, response_schema
+    except Exception as e:
+        logger.error(f"Error composing packed single-step templates: {e}")
+        raise
@@ -0,0 +1,239 @@
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+import numpy as np
+import functools
+import difflib
+import re
+
+
+class Unit(NamedTuple):
+    """A parsed unit: its dimension, canonical unit and factor to the canonical unit."""
+    name: str
+    dimension: str
+    canonical: str
+    factor: float
+
+
+# Canonical units: GJ for energy, cubic meters for volume, tons (metric) for mass
+CANONICAL_UNITS = {
+    'energy': 'GJ',
+    'volume': 'cubic meters',
+    'mass': 'tons',
+    'share': '%'
+}
+
+# Units accepted by the step 1 instructions and their factor to the canonical unit
+UNITS = {
+    'TWh': ('energy', 3600000.0),
+    'GWh': ('energy', 3600.0),
+    'MWh': ('energy', 3.6),
+    'kWh': ('energy', 0.0036),
+    'PJ': ('energy', 1000000.0),
+    'TJ': ('energy', 1000.0),
+    'GJ': ('energy', 1.0),
+    'MJ': ('energy', 0.001),
+    'liters': ('volume', 0.001),
+    'gallons': ('volume', 0.003785411784),
+    'cubic meters': ('volume', 1.0),
+    # Barrels are listed with the mass units in the instructions, but a barrel of oil is a volume
+    'barrels': ('volume', 0.158987294928),
+    'tons': ('mass', 1.0),
+    '%': ('share', 1.0)
+}
+
+# Surface forms found in reports and model outputs, keyed by their normalised spelling
+ALIASES = {
+    'twh': 'TWh', 'terawatthour': 'TWh', 'terawatthours': 'TWh',
+    'gwh': 'GWh', 'gigawatthour': 'GWh', 'gigawatthours': 'GWh',
+    'mwh': 'MWh', 'megawatthour': 'MWh', 'megawatthours': 'MWh',
+    'kwh': 'kWh', 'kilowatthour': 'kWh', 'kilowatthours': 'kWh',
+    'pj': 'PJ', 'petajoule': 'PJ', 'petajoules': 'PJ',
+    'tj': 'TJ', 'terajoule': 'TJ', 'terajoules': 'TJ',
+    'gj': 'GJ', 'gigajoule': 'GJ', 'gigajoules': 'GJ',
+    'mj': 'MJ', 'megajoule': 'MJ', 'megajoules': 'MJ',
+    'l': 'liters', 'liter': 'liters', 'liters': 'liters', 'litre': 'liters', 'litres': 'liters',
+    'kl': ('liters', 1000.0), 'kiloliter': ('liters', 1000.0), 'kiloliters': ('liters', 1000.0),
+    'kilolitre': ('liters', 1000.0), 'kilolitres': ('liters', 1000.0),
+    'gal': 'gallons', 'gallon': 'gallons', 'gallons': 'gallons',
+    'm3': 'cubic meters', 'cubicmeter': 'cubic meters', 'cubicmeters': 'cubic meters',
+    'cubicmetre': 'cubic meters', 'cubicmetres': 'cubic meters',
+    'bbl': 'barrels', 'barrel': 'barrels', 'barrels': 'barrels',
+    't': 'tons', 'ton': 'tons', 'tons': 'tons', 'tonne': 'tons', 'tonnes': 'tons', 'metrictons': 'tons', 'metrictonnes': 'tons',
+    # "MT" in ESG tables is the metric ton, not the megatonne (see MEGATONNES)
+    'mt': 'tons', 'tco2e': 'tons', 'mtco2e': 'tons',
+    '%': '%', 'percent': '%', 'percentage': '%'
+}
+
+# Scale words that prefix a unit in table headers, e.g. "Thousands of m3"
+SCALE_PREFIXES = (
+    (re.compile(r"^(?:thousands?|'000|000s?)(?:of)?"), 1e3),
+    (re.compile(r'^(?:millions?|mn|mio)(?:of)?'), 1e6),
+    (re.compile(r'^(?:billions?|bn)(?:of)?'), 1e9)
+)
+
+# Metric prefixes written against a unit, e.g. "ktonnes" or "Mbbl"; case matters, so they are
+# matched before the spelling is lower-cased. Barrels and gallons follow the oil and water
+# industry convention (M and m for thousand, MM for million); for other units M is mega,
+# and m (milli, metric or million) and MM are ambiguous and not resolved.
+UNIT_PREFIX = re.compile(r'^(MM|M|k|K|m)(?=[A-Za-z])')
+
+# The SI megatonne is written with a capital M and a lower-case t ("Mt", "MtCO2e"); every
+# other case of "mt" is read as metric tons
+MEGATONNES = re.compile(r'^Mt(?:CO2e?)?$')
+THOUSANDS_UNITS = ('barrels', 'gallons')
+
+# Minimum similarity for a misspelt unit to be resolved to a known alias
+FUZZY_CUTOFF = 0.85
+
+
+def _normalize_spelling(unit: str, lower: bool = True) -> str:
+    """
+    Normalise a unit string for alias lookup: lower case, no spaces, dots or hyphens.
+
+    Args:
+        unit (str): The raw unit string.
+        lower (bool): Whether to lower-case it; prefixes are read from the original case.
+
+    Returns:
+        str: The normalised spelling.
+    """
+    unit = unit.replace('³', '3')
+    return re.sub(r'[\s.\-_]', '', unit.lower() if lower else unit)
+
+
+def _prefix_scale(prefix: str, name: str) -> Optional[float]:
+    """
+    Get the scale of a metric prefix written against a unit.
+
+    Args:
+        prefix (str): The prefix as written (MM, M, k, K or m).
+        name (str): The catalogue unit it prefixes.
+
+    Returns:
+        Optional[float]: The scale, or None if the prefix is ambiguous for the unit.
+    """
+    if prefix in ('k', 'K'):
+        return 1e3
+    if name in THOUSANDS_UNITS:
+        return 1e6 if prefix == 'MM' else 1e3
+    return 1e6 if prefix == 'M' else None
+
+
+def _is_prefixed(spelling: str, candidate: str) -> bool:
+    """
+    Check whether two spellings differ only by a leading prefix (e.g. 'ktons' and 'tons'),
+    which a fuzzy match must not resolve since the prefix scales the value.
+
+    Args:
+        spelling (str): The normalised input.
+        candidate (str): A known alias.
+
+    Returns:
+        bool: True if one spelling ends with the other.
+    """
+    return spelling != candidate and (spelling.endswith(candidate) or candidate.endswith(spelling))
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_unit(unit: Optional[str]) -> Optional[Unit]:
+    """
+    Parse a unit string, tolerating case, spacing, plural forms, scale words
+    ("thousands of m3"), metric prefixes ("ktonnes", "Mbbl") and small misspellings. A
+    misspelling is never resolved to a unit that only lacks or adds a prefix.
+
+    Args:
+        unit (Optional[str]): The raw unit string.
+
+    Returns:
+        Optional[Unit]: The parsed unit, or None if it is not recognised.
+    """
+    if not unit or not isinstance(unit, str):
+        return None
+    spelling = _normalize_spelling(unit)
+    written = _normalize_spelling(unit, lower=False)
+    multiplier = 1.0
+    for pattern, scale in SCALE_PREFIXES:
+        match = pattern.match(spelling)
+        if match and spelling[match.end():]:
+            spelling, written, multiplier = spelling[match.end():], written[match.end():], scale
+            break
+    alias = ('tons', 1e6) if MEGATONNES.match(written) else ALIASES.get(spelling)
+    if alias is None:
+        prefix = UNIT_PREFIX.match(written)
+        base = ALIASES.get(spelling[prefix.end():]) if prefix else None
+        if isinstance(base, str):
+            scale = _prefix_scale(prefix.group(1), base)
+            if scale is None:
+                return None
+            alias = (base, scale)
+    if alias is None:
+        close = [
+            candidate for candidate in difflib.get_close_matches(spelling, ALIASES, n=3, cutoff=FUZZY_CUTOFF)
+            if not _is_prefixed(spelling, candidate)
+        ]
+        if not close:
+            return None
+        alias = ALIASES[close[0]]
+    name, scale = alias if isinstance(alias, tuple) else (alias, 1.0)
+    dimension, factor = UNITS[name]
+    return Unit(name, dimension, CANONICAL_UNITS[dimension], factor * scale * multiplier)
+
+
+def canonical_unit(unit: Optional[str]) -> Optional[str]:
+    """
+    Get the catalogue spelling of a unit (e.g. 'tonnes' -> 'tons').
+
+    Args:
+        unit (Optional[str]): The raw unit string.
+
+    Returns:
+        Optional[str]: The catalogue unit, or None if it is not recognised.
+    """
+    parsed = parse_unit(unit)
+    return parsed.name if parsed else None
+
+
+def to_canonical(values: Sequence[Optional[float]], units: Sequence[Optional[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert values to the canonical unit of their dimension in one vectorised pass.
+
+    Each distinct unit string is parsed once; the conversion itself is a single array
+    multiplication. Values that are missing or whose unit is not recognised become NaN.
+
+    Args:
+        values (Sequence[Optional[float]]): The values.
+        units (Sequence[Optional[str]]): The unit of each value.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The canonical values (float64) and canonical unit of
+        each value (object array, None where the unit is not recognised).
+    """
+    if not len(values):
+        return np.empty(0), np.empty(0, dtype=object)
+    array = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    keys = np.array(['' if unit is None else str(unit) for unit in units], dtype=object)
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    parsed = [parse_unit(unit) for unit in distinct]
+    factors = np.array([unit.factor if unit else np.nan for unit in parsed], dtype=np.float64)
+    canonical = np.array([unit.canonical if unit else None for unit in parsed], dtype=object)
+    return array * factors[inverse], canonical[inverse]
+
+
+def round_significant(values: np.ndarray, digits: int = 6) -> np.ndarray:
+    """
+    Round values to a number of significant digits, so that converted values compare equal
+    despite floating point error (e.g. 2,410,574.4 MWh and 8,678,068 GJ).
+
+    Args:
+        values (np.ndarray): The values.
+        digits (int): The significant digits to keep.
+
+    Returns:
+        np.ndarray: The rounded values (NaN and zero are kept).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.where(np.isfinite(values) & (values != 0), np.floor(np.log10(np.abs(values))), 0)
+        scale = np.power(10.0, digits - 1 - magnitude)
+        return np.round(values * scale) / scale
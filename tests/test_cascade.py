@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('vertexai')
+
+from src.utils.cascade import consistency_errors
+from src.utils.cascade import schema_errors
+from src.utils.cascade import empty_errors
+
+
+ARRAY_SCHEMA = {'type': 'array', 'items': {'type': 'object'}}
+
+
+def test_empty_array_escalates():
+    assert schema_errors([], ARRAY_SCHEMA) == []
+    assert empty_errors([]) == ['$: empty array']
+    assert empty_errors({'year': 2023, 'metrics': []}) == ['$.metrics: empty array']
+    assert empty_errors({'doc-a': {'metrics': []}, 'doc-b': {'metrics': [{'code': '429'}]}}) == ['doc-a: $.metrics: empty array']
+    assert empty_errors([{'code': '429'}]) == []
+
+
+def test_printed_values_are_checked():
+    output = {'year': 2023, 'metrics': [
+        {'code': '429', 'value': '1,000', 'unit': 'MWh'},
+        {'code': '432', 'value': '400', 'unit': 'MWh'},
+        {'code': '711', 'value': '500', 'unit': 'MWh'}
+    ]}
+    assert consistency_errors(output, 0.05) == ['429 (1000.0 MWh) != 432 + 711 (900.0 MWh)']
+
+
+def test_years_are_compared_separately():
+    rows = [
+        {'code': '429', 'value': 900, 'unit': 'MWh', 'year': 2023},
+        {'code': '429', 'value': 1000, 'unit': 'MWh', 'year': 2022},
+        {'code': '432', 'value': 400, 'unit': 'MWh', 'year': 2023},
+        {'code': '711', 'value': 500, 'unit': 'MWh', 'year': 2023}
+    ]
+    assert consistency_errors(rows, 0.05) == []
+
+
+def test_rows_without_year_are_not_mixed():
+    rows = [
+        {'code': '429', 'value': 1000, 'unit': 'MWh'},
+        {'code': '429', 'value': 900, 'unit': 'MWh'},
+        {'code': '432', 'value': 400, 'unit': 'MWh'},
+        {'code': '711', 'value': 500, 'unit': 'MWh'}
+    ]
+    assert consistency_errors(rows, 0.05) == []
+    assert consistency_errors(rows[:1] + rows[2:], 0.05) == ['429 (1000 MWh) != 432 + 711 (900 MWh)']
@@ -0,0 +1,28 @@
+from src.evaluate.compare import workflow_costs
+from src.utils.telemetry import telemetry_context
+from src.utils.telemetry import record_event
+from src.utils.telemetry import run_context
+from src.utils import telemetry
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_telemetry(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, 'TELEMETRY_PATH', str(tmp_path / 'events.jsonl'))
+
+
+def test_packed_calls_are_split_by_share():
+    with telemetry_context(workflow='single_step', file_name='pack-1', run_id='pack-run'):
+        record_event('call', total_tokens=1000, attempt='primary')
+        record_event('call', total_tokens=200, attempt='hedge')
+    for file_name, share in (('small', 0.25), ('large', 0.75)):
+        with run_context('single_step', file_name):
+            record_event('run', latency=8.0 * share, status='ok', pack='pack-1', packed=2, share=share)
+    with run_context('single_step', 'alone'):
+        record_event('call', total_tokens=500, attempt='primary')
+        record_event('run', latency=3.0, status='ok')
+
+    costs = workflow_costs('single_step')
+    assert costs['small'] == pytest.approx({'latency': 2.0, 'tokens': 300, 'calls': 0.5, 'hedges': 0.25})
+    assert costs['large'] == pytest.approx({'latency': 6.0, 'tokens': 900, 'calls': 1.5, 'hedges': 0.75})
+    assert costs['alone'] == {'latency': 3.0, 'tokens': 500, 'calls': 1, 'hedges': 0}
@@ -0,0 +1,54 @@
+from src.utils.dedup import find_duplicate_groups
+from src.utils.dedup import _link_or_copy
+from src.utils.dedup import text_sketch
+from src.utils.dedup import main_year
+from src.utils.io import atomic_write
+from src.utils import dedup
+import os
+
+
+REPORT = ' '.join(f'word{i}' for i in range(400))
+
+
+def fingerprint(sha256, page_texts):
+    return {'sha256': sha256, 'sketch': text_sketch(page_texts), 'pages': len(page_texts), 'year': main_year(page_texts)}
+
+
+def test_main_year():
+    assert main_year(['Report 2022', 'Scope 1 in 2022 and 2021']) == 2022
+    assert main_year(['2021 and 2022']) == 2022
+    assert main_year(['No year here']) is None
+
+
+def test_near_duplicates_need_same_edition():
+    index = {
+        'a': fingerprint('1', [REPORT + ' 2022', 'tables 2022']),
+        'b': fingerprint('2', [REPORT + ' 2022', 'tables 2022']),
+        'c': fingerprint('3', [REPORT + ' 2023', 'tables 2023']),
+        'd': fingerprint('4', [REPORT + ' 2022', 'tables 2022', 'annex']),
+        'e': fingerprint('1', ['unreadable'])
+    }
+    assert find_duplicate_groups(index, sorted(index), 0.9) == {'a': ['b', 'e']}
+
+
+def test_boilerplate_hashes_do_not_pick_candidates(monkeypatch):
+    monkeypatch.setattr(dedup, 'MAX_POSTING_LENGTH', 3)
+    boilerplate = ' '.join(f'notice{i}' for i in range(200))
+    index = {f'other{i}': fingerprint(str(i), [boilerplate + ' ' + REPORT.replace('word', f'other{i}-')]) for i in range(5)}
+    index['a'] = fingerprint('a', [boilerplate + ' ' + REPORT])
+    index['b'] = fingerprint('b', [boilerplate + ' ' + REPORT])
+    assert find_duplicate_groups(index, sorted(index), 0.9) == {'a': ['b']}
+
+
+def test_duplicate_run_does_not_overwrite_canonical(tmp_path):
+    canonical, duplicate = tmp_path / 'canonical', tmp_path / 'duplicate'
+    (canonical / 'step_1').mkdir(parents=True)
+    (canonical / 'step_1' / 'output.json').write_text('canonical')
+    _link_or_copy(str(canonical), str(duplicate), 'symlink')
+    linked = duplicate / 'step_1' / 'output.json'
+    assert not os.path.islink(duplicate) and os.path.islink(linked)
+    assert linked.read_text() == 'canonical'
+
+    atomic_write(str(linked), 'duplicate')
+    assert linked.read_text() == 'duplicate' and not os.path.islink(linked)
+    assert (canonical / 'step_1' / 'output.json').read_text() == 'canonical'
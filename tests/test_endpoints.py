@@ -0,0 +1,148 @@
+import pytest
+
+pytest.importorskip('vertexai')
+
+from google.api_core import exceptions as google_exceptions
+from src.utils.llm import EndpointPool
+from src.utils.llm import Endpoint
+from src.utils import telemetry
+from src.utils import llm
+from types import SimpleNamespace
+import json
+import os
+
+
+MODEL = SimpleNamespace(_model_name='test-model', _system_instruction=None)
+CONTENTS = ['Extract the metrics']
+SCHEMA = {'type': 'array'}
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, 'TELEMETRY_PATH', str(tmp_path / 'events.jsonl'))
+    monkeypatch.setattr(llm, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(llm.rate_limiter, 'rate', None)
+
+
+def local_endpoint(name, latency=0.01, error_rate=0.0, quota=None):
+    return Endpoint(name, None, None, quota=quota, local=True, latency=latency, error_rate=error_rate)
+
+
+def create_pool(*endpoints, failure_threshold=3):
+    return EndpointPool(list(endpoints), failure_threshold, cooldown=60, smoothing=0.5)
+
+
+def record_response(rows):
+    path = llm._cache_path(llm.response_cache_key(MODEL, CONTENTS, SCHEMA))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(json.dumps(rows))
+
+
+def test_routes_to_lowest_expected_time():
+    slow, fast = local_endpoint('slow'), local_endpoint('fast')
+    pool = create_pool(slow, fast)
+    pool.release(pool.acquire('test-model', {fast.name}), 2.0, ok=True)
+    pool.release(pool.acquire('test-model', {slow.name}), 0.5, ok=True)
+    assert pool.acquire('test-model', set()) is fast
+
+
+def test_untried_endpoint_goes_first():
+    measured, fresh = local_endpoint('measured'), local_endpoint('fresh')
+    pool = create_pool(measured, fresh)
+    pool.release(pool.acquire('test-model', {fresh.name}), 0.1, ok=True)
+    assert pool.acquire('test-model', set()) is fresh
+
+
+def test_only_serving_endpoints_are_used():
+    other = Endpoint('other', None, None, models=['other-model'], local=True)
+    serving = local_endpoint('serving')
+    pool = create_pool(other, serving)
+    assert pool.acquire('test-model', set()) is serving
+    assert pool.acquire('test-model', {serving.name}) is None
+
+
+def test_saturated_quota_routes_elsewhere():
+    saturated, spare = local_endpoint('saturated', quota=60), local_endpoint('spare', quota=60)
+    pool = create_pool(saturated, spare)
+    for endpoint in (saturated, spare):
+        endpoint.latency = 1.0
+    saturated.limiter.tokens = 0
+    assert pool.expected_time(saturated) > pool.expected_time(spare)
+    assert pool.acquire('test-model', set()) is spare
+
+
+def test_saturated_quota_wait_is_bounded():
+    saturated = local_endpoint('saturated', quota=60)
+    saturated.limiter.tokens = 0
+    pool = create_pool(saturated)
+    with pytest.raises(google_exceptions.DeadlineExceeded):
+        pool.acquire('test-model', set(), timeout=0.05)
+    assert saturated.in_flight == 0
+
+
+def test_failover_on_endpoint_errors():
+    failing, healthy = local_endpoint('failing', error_rate=1.0), local_endpoint('healthy')
+    failing.latency, healthy.latency = 0.1, 1.0
+    record_response([{'metric': 'scope 1'}])
+    with llm.endpoint_pool.substitute([failing, healthy]):
+        assert llm._call_model(MODEL, CONTENTS, SCHEMA, 'primary') == [{'metric': 'scope 1'}]
+    assert failing.failures == 1 and failing.error_rate > 0
+    assert healthy.failures == 0 and failing.in_flight == healthy.in_flight == 0
+    calls = telemetry.load_events('call')
+    assert [(call['endpoint'], call['status']) for call in calls] == [('failing', 'error'), ('healthy', 'ok')]
+
+
+def test_request_errors_do_not_fail_over():
+    first, second = local_endpoint('first'), local_endpoint('second')
+    first.latency, second.latency = 0.1, 1.0
+    # No recorded response: the call itself is at fault, not the endpoint
+    with llm.endpoint_pool.substitute([first, second]), pytest.raises(LookupError):
+        llm._call_model(MODEL, CONTENTS, SCHEMA, 'primary')
+    assert [call['endpoint'] for call in telemetry.load_events('call')] == ['first']
+    assert first.failures == 0
+
+
+def test_failing_endpoint_leaves_rotation():
+    failing, healthy = local_endpoint('failing', error_rate=1.0), local_endpoint('healthy')
+    pool = create_pool(failing, healthy, failure_threshold=2)
+    for _ in range(2):
+        pool.release(pool.acquire('test-model', {healthy.name}), 0.1, ok=False)
+    status = {entry['endpoint']: entry for entry in pool.status()}
+    assert not status['failing']['available'] and status['healthy']['available']
+    assert pool.acquire('test-model', set()) is healthy
+
+
+def test_check_health():
+    failing, healthy = local_endpoint('failing', error_rate=1.0), local_endpoint('healthy')
+    pool = create_pool(failing, healthy)
+    status = {entry['endpoint']: entry for entry in pool.check_health()}
+    assert not status['failing']['available'] and status['failing']['failures'] == 1
+    assert status['healthy']['available'] and status['healthy']['latency'] is not None
+    assert all(entry['in_flight'] == 0 for entry in status.values())
+
+
+def test_disabled_hedging_does_not_count_calls():
+    policy = llm.HedgingPolicy(False, 95, min_samples=2, window=10, budget=0.5)
+    for latency in (1.0, 2.0, 3.0):
+        policy.observe('test-model', latency)
+    assert policy.delay('test-model') is None
+    assert policy._calls == 0
+    policy.workflows = {'multi_step': True}
+    with telemetry.run_context('multi_step', 'doc'):
+        assert policy.delay('test-model') == pytest.approx(2.9)
+    assert policy._calls == 1
+
+
+def test_hedge_delay_starts_after_rate_limit(monkeypatch):
+    record_response([{'metric': 'scope 1'}])
+    monkeypatch.setattr(llm.rate_limiter, 'rate', 2.0)
+    monkeypatch.setattr(llm.rate_limiter, 'tokens', 0.0)
+    monkeypatch.setattr(llm.rate_limiter, 'updated_at', llm.time.monotonic())
+    monkeypatch.setattr(llm.hedging, 'budget', 1.0)
+    monkeypatch.setattr(llm.hedging, '_calls', 10)
+    with llm.endpoint_pool.substitute([local_endpoint('local', latency=0.02)]):
+        # The primary waits about 0.5 s for the rate limit, far beyond the hedge delay
+        assert llm._hedged_call(MODEL, CONTENTS, SCHEMA, delay=0.1) == [{'metric': 'scope 1'}]
+    assert [call['attempt'] for call in telemetry.load_events('call')] == ['primary']
+    assert telemetry.load_events('hedge') == []
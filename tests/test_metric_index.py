@@ -0,0 +1,35 @@
+from src.utils.metric_index import update_index
+from src.utils.metric_index import query_metrics
+from src.utils import metric_index
+import pytest
+import json
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(metric_index, 'VALIDATION_DIR', str(tmp_path / 'validation'))
+    monkeypatch.setattr(metric_index, 'OUTPUT_DIR', str(tmp_path / 'output'))
+    rows = [
+        {'code': '429', 'item': 'energy', 'value': 100, 'unit': 'tonnes', 'page_number': 3},
+        {'code': '430', 'item': 'water', 'value': 5, 'unit': 'kt', 'page_number': 4, 'year': 2021}
+    ]
+    generated = tmp_path / 'validation/generated/single_step/doc.jsonl'
+    generated.parent.mkdir(parents=True)
+    generated.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+    output = tmp_path / 'output/single_step/doc/out.txt'
+    output.parent.mkdir(parents=True)
+    output.write_text(json.dumps({'year': 2022, 'metrics': rows}))
+    path = str(tmp_path / 'metrics.sqlite')
+    update_index(path)
+    return path
+
+
+def test_single_step_rows_take_the_output_year(db_path):
+    assert [row['code'] for row in query_metrics(year=2022, db_path=db_path)] == ['429']
+    assert [row['code'] for row in query_metrics(year=2021, db_path=db_path)] == ['430']
+
+
+def test_unit_filter_matches_spellings(db_path):
+    assert [row['code'] for row in query_metrics(unit='metric tons', db_path=db_path)] == ['429']
+    assert [row['code'] for row in query_metrics(unit='ktonnes', db_path=db_path)] == ['430']
+    assert query_metrics(unit='GJ', db_path=db_path) == []
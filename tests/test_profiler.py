@@ -0,0 +1,37 @@
+from src.utils.profiler import load_collapsed
+from src.utils.profiler import SamplingProfiler
+from src.utils.profiler import profile_run
+from src.utils.telemetry import telemetry_context
+from src.utils.telemetry import bind_context
+from src.utils.telemetry import run_context
+from src.utils.telemetry import thread_tags
+from concurrent.futures import ThreadPoolExecutor
+from src.utils import profiler
+import threading
+import pytest
+import time
+
+
+@pytest.fixture(autouse=True)
+def profile_every_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, 'PROFILES_DIR', str(tmp_path))
+    monkeypatch.setattr(profiler, 'profiler', SamplingProfiler(0.001))
+    monkeypatch.setattr(profiler, '_sample_fraction', 1.0)
+
+
+def busy_worker(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+    return threading.get_ident()
+
+
+def test_worker_threads_are_sampled(tmp_path):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with run_context('single_step', 'doc'), profile_run():
+            with telemetry_context(step='single'):
+                worker = executor.submit(bind_context(busy_worker), 0.2).result()
+        wall = load_collapsed(next(str(path) for path in tmp_path.glob('single_step/doc-*.wall.collapsed')))
+        assert any(stack.startswith('step single;') and 'busy_worker' in stack for stack in wall)
+        # Idle workers and finished runs leave no tags behind
+        assert thread_tags(worker) == {} and thread_tags(threading.get_ident()) == {}
@@ -0,0 +1,33 @@
+from src.pipeline.validation.schedule import compact_history
+from src.pipeline.validation.schedule import record_latency
+from src.pipeline.validation.schedule import load_history
+from src.pipeline.validation import schedule
+import pytest
+import os
+
+
+@pytest.fixture(autouse=True)
+def isolated_history(tmp_path, monkeypatch):
+    monkeypatch.setattr(schedule, 'HISTORY_PATH', str(tmp_path / 'history.json'))
+    monkeypatch.setattr(schedule, 'HISTORY_LOG_PATH', str(tmp_path / 'history.log.jsonl'))
+
+
+def test_runs_are_logged_then_compacted():
+    record_latency('single_step', 'doc', 10.0, 5, 1000)
+    record_latency('single_step', 'doc', 20.0, 5, 1000)
+    assert not os.path.exists(schedule.HISTORY_PATH)
+    expected = {'single_step': {'doc': {'latency': 15.0, 'pages': 5, 'size': 1000, 'runs': 2}}}
+    assert load_history() == expected
+
+    compact_history()
+    assert not os.path.exists(schedule.HISTORY_LOG_PATH)
+    assert load_history() == expected
+    record_latency('single_step', 'doc', 5.0, 5, 1000)
+    assert load_history()['single_step']['doc'] == {'latency': 10.0, 'pages': 5, 'size': 1000, 'runs': 3}
+
+
+def test_truncated_log_line_is_skipped():
+    record_latency('multi_step', 'doc', 4.0, None, None)
+    with open(schedule.HISTORY_LOG_PATH, 'a', encoding='utf-8') as file:
+        file.write('{"workflow": "multi_st')
+    assert load_history() == {'multi_step': {'doc': {'latency': 4.0, 'pages': None, 'size': None, 'runs': 1}}}
@@ -0,0 +1,62 @@
+from src.utils.units import to_canonical
+from src.utils.units import parse_unit
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('unit, name, factor', [
+    ('ktons', 'tons', 1e3),
+    ('ktonnes', 'tons', 1e3),
+    ('kt', 'tons', 1e3),
+    ('Mtonnes', 'tons', 1e6),
+    ('Mt', 'tons', 1e6),
+    ('kgal', 'gallons', 1e3),
+    ('Mgal', 'gallons', 1e3),
+    ('kbbl', 'barrels', 1e3),
+    ('Mbbl', 'barrels', 1e3),
+    ('mbbl', 'barrels', 1e3),
+    ('MMbbl', 'barrels', 1e6),
+])
+def test_prefixed_units_are_scaled(unit, name, factor):
+    parsed = parse_unit(unit)
+    base = parse_unit(name)
+    assert parsed.name == name
+    assert parsed.factor == pytest.approx(base.factor * factor)
+
+
+@pytest.mark.parametrize('unit', ['mtons', 'MMtons'])
+def test_ambiguous_prefixes_are_not_resolved(unit):
+    assert parse_unit(unit) is None
+
+
+@pytest.mark.parametrize('unit, name, factor', [
+    ('MWh', 'MWh', 3.6),
+    ('mwh', 'MWh', 3.6),
+    ('kWh', 'kWh', 0.0036),
+    ('m3', 'cubic meters', 1.0),
+    ('tonnes', 'tons', 1.0),
+    ('metric tonnes', 'tons', 1.0),
+    ('Thousands of m3', 'cubic meters', 1e3),
+    ('million tonnes', 'tons', 1e6),
+    ('gigajoles', 'GJ', 1.0),
+    ('tones', 'tons', 1.0),
+    ('MT', 'tons', 1.0),
+    ('mt', 'tons', 1.0),
+    ('MTCO2e', 'tons', 1.0),
+    ('tCO2e', 'tons', 1.0),
+    ('MtCO2e', 'tons', 1e6),
+    ('PJ', 'PJ', 1e6),
+    ('TWh', 'TWh', 3.6e6),
+])
+def test_aliases_scale_words_and_misspellings(unit, name, factor):
+    parsed = parse_unit(unit)
+    assert parsed.name == name
+    assert parsed.factor == pytest.approx(factor)
+
+
+def test_to_canonical_converts_arrays():
+    values, units = to_canonical([2410574.4, 5.0, None], ['MWh', 'ktonnes', 'GJ'])
+    assert values[0] == pytest.approx(8678067.84)
+    assert values[1] == pytest.approx(5000.0)
+    assert np.isnan(values[2])
+    assert units.tolist() == ['GJ', 'tons', 'GJ']